@@ -0,0 +1,118 @@
+import os
+import time
+import queue
+import random
+import atexit
+import threading
+from database import supabase
+
+# --- Batched Visitor Analytics Writer ---
+# Page-view rows are pushed onto a bounded in-memory queue and a background
+# thread bulk-inserts them into 'portal_analytics'. The request never waits on
+# Supabase. When the queue backs up we sample, and when it is full we drop.
+
+ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', 5000))
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 200))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 5))
+# Once the queue is this full, only ANALYTICS_SAMPLE_RATE of new rows are kept
+ANALYTICS_SAMPLE_WATERMARK = float(os.environ.get('ANALYTICS_SAMPLE_WATERMARK', 0.8))
+ANALYTICS_SAMPLE_RATE = float(os.environ.get('ANALYTICS_SAMPLE_RATE', 0.25))
+
+
+class AnalyticsWriter:
+    def __init__(self, table='portal_analytics', max_queue=ANALYTICS_QUEUE_SIZE,
+                 batch_size=ANALYTICS_BATCH_SIZE, flush_interval=ANALYTICS_FLUSH_INTERVAL):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"queued": 0, "written": 0, "sampled_out": 0, "dropped": 0, "failed": 0}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _ensure_started(self):
+        # Started lazily so the thread is created inside each gunicorn worker
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, row):
+        """Queues one analytics row. Never blocks and never raises."""
+        if self._stopping.is_set():
+            return False
+        self._ensure_started()
+
+        maxsize = self.queue.maxsize
+        if maxsize and self.queue.qsize() >= maxsize * ANALYTICS_SAMPLE_WATERMARK:
+            if random.random() >= ANALYTICS_SAMPLE_RATE:
+                self.stats["sampled_out"] += 1
+                return False
+        try:
+            self.queue.put_nowait(row)
+            self.stats["queued"] += 1
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            supabase.table(self.table).insert(batch).execute()
+            self.stats["written"] += len(batch)
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            print(f"[ANALYTICS] Failed to write {len(batch)} rows: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            # Collect until the batch is full or the flush interval passes
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                if self._stopping.is_set():
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Writes everything still queued. Used on shutdown."""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        """Stops the flusher thread and writes whatever is left."""
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+
+visitor_writer = AnalyticsWriter()
+
+# gunicorn workers exit through sys.exit() on graceful shutdown, so this runs there too
+atexit.register(visitor_writer.shutdown)
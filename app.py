@@ -2,8 +2,6 @@ import os
 import hashlib 
 from flask import render_template_string
 from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response,jsonify, Response
-from flask import send_file
-from io import BytesIO
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from supabase_auth.errors import AuthApiError
@@ -13,7 +11,8 @@ import invoice_utils
 from shurjopay_plugin import ShurjopayPlugin, ShurjoPayConfigModel
 from types import SimpleNamespace
 import logging
-import requests
+import http_client
+import gateway_tokens
 from flask import session, jsonify
 import json
 from werkzeug.exceptions import abort
@@ -21,14 +20,32 @@ from PIL import Image
 import io         
 import sys
 import email_service 
-from database import supabase, get_saas_settings # <-- MODIFIED: Added get_saas_settings
+from database import supabase, get_saas_settings, invalidate_saas_settings, get_saas_settings_cache_stats
 from functools import wraps
 from portal_helpers import reactivate_service
+from request_cache import request_memoized, queries_avoided
+from analytics_writer import visitor_writer
+from product_catalog import catalog, check_live_stock
+from job_queue import jobs
 from flask_apscheduler import APScheduler
 from datetime import date, datetime, timedelta, timezone
 from flask import send_from_directory
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from task_executor import tasks
+from sla_engine import run_sla_sweep
+from scheduler_leader import leader, leader_only
+from ticket_assignment import assignment_engine
+import employee_metrics
+from parallel_queries import run_parallel
+from page_cache import cached_page, invalidate_pages, page_cache_stats
+from product_search import search_index
+from promo_engine import promo_engine, PromoError
+from pricing import quote_cart, unit_price
+from pdf_store import pdf_store, pdf_key, send_pdf
+from mail_dispatcher import mailer
+from email_templates import invalidate_branding
+from company_profiles import company_profiles
+import session_store
 
 
 
@@ -46,43 +63,66 @@ print("------------------------")
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY")
 app.debug = os.environ.get("FLASK_DEBUG") == '1'
-executor = ThreadPoolExecutor(max_workers=1)
+# Session data lives server-side; the cookie only carries an opaque id (see session_store.py)
+session_store.init_app(app)
 scheduler = APScheduler()
 
+SLA_SWEEP_MINUTES = int(os.environ.get('SLA_SWEEP_MINUTES', 5))
+# Product orders still 'Pending Payment' after this long were abandoned at the gateway
+PENDING_ORDER_TTL_MINUTES = int(os.environ.get('PENDING_ORDER_TTL_MINUTES', 120))
+PENDING_ORDER_SWEEP_MINUTES = int(os.environ.get('PENDING_ORDER_SWEEP_MINUTES', 15))
+
+@leader_only('check_sla_breaches')
 def check_sla_breaches():
-    """Background task to mark overdue tickets."""
+    """Background task to mark overdue tickets (set-based, see sla_engine.py)."""
     with app.app_context():
         try:
-            now = datetime.now().isoformat()
-            
-            # Find open tickets that are past their due date
-            response = supabase.table('support_tickets')\
-                .select('id, ticket_number, assigned_to_employee_id')\
-                .lt('due_at', now)\
-                .neq('status', 'Resolved')\
-                .neq('status', 'Closed')\
-                .neq('status', 'Overdue')\
-                .execute()
-            
-            if response.data:
-                for ticket in response.data:
-                    print(f"SLA BREACH: Marking Ticket {ticket['ticket_number']} as Overdue.")
-                    
-                    # 1. Update Status
-                    supabase.table('support_tickets').update({'status': 'Overdue'}).eq('id', ticket['id']).execute()
-                    
-                    # 2. Notify Employee (Optional: Add email logic here)
-                    if ticket.get('assigned_to_employee_id'):
-                        print(f"--> Alert sent to Employee ID: {ticket['assigned_to_employee_id']}")
+            marked, notified = run_sla_sweep()
+            if marked:
+                print(f"SLA sweep: {marked} ticket(s) marked Overdue, {notified} employee alert(s) sent.")
+        except Exception as e:
+            print(f"Scheduler Error: {e}")
+            raise
 
+@leader_only('expire_pending_product_orders')
+def expire_pending_product_orders():
+    """Deletes abandoned unpaid product orders so the promo uses they reserved are given back."""
+    with app.app_context():
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=PENDING_ORDER_TTL_MINUTES)
+        try:
+            expired = discard_pending_product_order(created_before=cutoff.isoformat())
+            if expired:
+                print(f"[PROMO] Expired {len(expired)} abandoned pending order(s).")
         except Exception as e:
             print(f"Scheduler Error: {e}")
+            raise
 
 # Config for Scheduler
+# Every gunicorn worker runs the scheduler, but only the elected leader
+# (see scheduler_leader.py) actually executes jobs.
 app.config['SCHEDULER_API_ENABLED'] = True
+leader.init_app(app)
 scheduler.init_app(app)
+scheduler.add_job(id='check_sla_breaches', func=check_sla_breaches,
+                  trigger='interval', minutes=SLA_SWEEP_MINUTES, replace_existing=True,
+                  max_instances=1, coalesce=True)
+scheduler.add_job(id='expire_pending_product_orders', func=expire_pending_product_orders,
+                  trigger='interval', minutes=PENDING_ORDER_SWEEP_MINUTES, replace_existing=True,
+                  max_instances=1, coalesce=True)
 scheduler.start()
 
+# Durable job queue (instance/jobs.sqlite3); handlers are registered further down
+# and the workers are started at the end of this module
+jobs.init_app(app)
+
+# Rendered receipts/payslips, keyed by content (instance/pdf_cache)
+pdf_store.init_app(app)
+
+# Outbound email queue (instance/mail.sqlite3), drained on the scheduler leader
+mailer.init_app(app)
+
+# Email headers/footers are rendered from company details; drop them when those change
+company_profiles.add_listener(lambda company_id: invalidate_branding())
 
 
 # --- ADDED: from_json filter to fix errors in templates ---
@@ -197,15 +237,20 @@ def safe_verify_payment(saas_settings, order_id_from_sp):
         "password": sp_config.password
     }
     
-    token_res = requests.post(token_url, json=token_payload)
-    token_res.raise_for_status() 
-    token_data = token_res.json()
-    
-    if not token_data or 'token' not in token_data:
-        raise Exception("ShurjoPay: Failed to get auth token for verification.")
+    def grant_token():
+        token_res = http_client.post('shurjopay', token_url, json=token_payload, idempotent=True)
+        token_res.raise_for_status() 
+        token_data = token_res.json()
+        
+        if not token_data or 'token' not in token_data:
+            raise Exception("ShurjoPay: Failed to get auth token for verification.")
+        return token_data, token_data.get('expires_in')
     
+    # Shared with ShurjopayPlugin.get_token (same credentials -> same cached grant)
+    token_key = ('shurjopay', sp_config.api_url, sp_config.username, sp_config.password)
+    token_data = gateway_tokens.get(token_key, grant_token)
     token = token_data['token']
-    token_type = token_data['token_type']
+    token_type = token_data.get('token_type', 'Bearer')
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"{token_type} {token}"
@@ -215,7 +260,9 @@ def safe_verify_payment(saas_settings, order_id_from_sp):
     verify_url = f"{sp_config.api_url}/api/verification"
     verify_payload = {"order_id": order_id_from_sp}
     
-    response = requests.post(verify_url, headers=headers, json=verify_payload)
+    response = http_client.post('shurjopay', verify_url, headers=headers, json=verify_payload, idempotent=True)
+    if response.status_code == 401:
+        gateway_tokens.invalidate(token_key)
     response.raise_for_status() 
     
     response_data = response.json()
@@ -395,6 +442,18 @@ def customer_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@request_memoized('isp_companies', 'payment_gateway_settings')
+def get_company_gateway_settings(company_id):
+    """Returns the company's bKash gateway settings (memoized per request)."""
+    comp_res = supabase.table('isp_companies').select('payment_gateway_settings').eq('id', company_id).maybe_single().execute()
+    return comp_res.data.get('payment_gateway_settings', {}).get('bkash', {})
+
+def get_company_support_phone(company_id):
+    """Returns the ISP's contact phone, digits only (from the company profile cache)."""
+    profile = company_profiles.get(company_id)
+    return profile.support_phone if profile else None
+
+@request_memoized('saas_settings', 'portal_ads')
 def get_portal_ads():
     """Fetches active portal ads and ensures they have IDs."""
     try:
@@ -421,6 +480,9 @@ def get_portal_ads():
 # ==========================================
 #  bKash Gateway Logic
 # ==========================================
+# bKash statusCodes meaning the Authorization token was not accepted
+BKASH_TOKEN_ERROR_CODES = {'2079'}
+
 class BkashGateway:
     def __init__(self, username, password, app_key, app_secret, is_sandbox=True):
         self.username = username
@@ -431,17 +493,52 @@ class BkashGateway:
         self.base_url = "https://tokenized.sandbox.bka.sh/v1.2.0-beta" if is_sandbox else "https://tokenized.pay.bka.sh/v1.2.0-beta"
         self.headers = {'Content-Type': 'application/json', 'username': self.username, 'password': self.password}
 
-    def get_token(self):
+    def _token_key(self):
+        return ('bkash', self.base_url, self.username, self.password, self.app_key, self.app_secret)
+
+    def _grant_token(self):
         url = f"{self.base_url}/tokenized/checkout/token/grant"
         payload = {"app_key": self.app_key, "app_secret": self.app_secret}
         
-        res = requests.post(url, json=payload, headers=self.headers)
+        res = http_client.post('bkash', url, json=payload, headers=self.headers, idempotent=True)
         data = res.json()
         
         if data.get('statusCode') == '0000':
-            return data['id_token']
+            return data['id_token'], data.get('expires_in')
         raise Exception(f"bKash Token Error: {data.get('statusMessage')}")
 
+    def get_token(self):
+        # Cached per merchant account until shortly before expiry (see gateway_tokens.py)
+        return gateway_tokens.get(self._token_key(), self._grant_token)
+
+    def invalidate_token(self):
+        gateway_tokens.invalidate(self._token_key())
+
+    @staticmethod
+    def _token_rejected(res, data):
+        # The gateway answers 401 for an expired id_token; checkout calls report 2079 (Invalid App Token)
+        return res.status_code == 401 or data.get('statusCode') in BKASH_TOKEN_ERROR_CODES
+
+    def _checkout_post(self, path, payload, token):
+        """
+        POSTs to a tokenized checkout endpoint. If bKash rejects the (cached) token,
+        it is dropped and the call is retried once with a freshly granted one.
+        """
+        url = f"{self.base_url}/tokenized/checkout/{path}"
+        for attempt in range(2):
+            headers = {'Authorization': token, 'X-APP-Key': self.app_key, 'Content-Type': 'application/json'}
+            res = http_client.post('bkash', url, json=payload, headers=headers)
+            try:
+                data = res.json()
+            except ValueError:
+                data = {}
+            if attempt == 0 and self._token_rejected(res, data):
+                print(f"[BKASH] Token rejected on {path}, granting a new one")
+                self.invalidate_token()
+                token = self.get_token()
+                continue
+            return data
+
     def create_payment(self, token, amount, invoice_number, callback_url):
         # --- SIMULATION MODE ---
         if self.username == 'demo':
@@ -454,13 +551,6 @@ class BkashGateway:
             }
         # -----------------------
 
-        url = f"{self.base_url}/tokenized/checkout/create"
-        headers = {
-            'Authorization': token, 
-            'X-APP-Key': self.app_key, 
-            'Content-Type': 'application/json'
-        }
-        
         # --- THE FIX: Make Invoice Number Unique for Every Attempt ---
         # We append the current seconds to the invoice number so bKash sees it as new.
         import time
@@ -476,17 +566,16 @@ class BkashGateway:
             "merchantInvoiceNumber": unique_invoice_id # This must be unique every time
         }
         
-        res = requests.post(url, json=payload, headers=headers)
-        return res.json()
+        return self._checkout_post('create', payload, token)
 
     def execute_payment(self, token, payment_id):
-        url = f"{self.base_url}/tokenized/checkout/execute"
-        headers = {'Authorization': token, 'X-APP-Key': self.app_key, 'Content-Type': 'application/json'}
-        
         payload = {"paymentID": payment_id}
-        
-        res = requests.post(url, json=payload, headers=headers)
-        return res.json()
+        return self._checkout_post('execute', payload, token)
+
+    def query_payment(self, token, payment_id):
+        # Status of a payment, e.g. one that was already executed
+        payload = {"paymentID": payment_id}
+        return self._checkout_post('payment/status', payload, token)
 
 
 @app.route('/')
@@ -507,6 +596,7 @@ def index():
 
 # --- *** ADDED MISSING PUBLIC ROUTES *** ---
 @app.route('/purchase')
+@cached_page()
 def purchase_plans():
     """
     Public page to display subscription plans and payment info for NEW clients.
@@ -542,6 +632,7 @@ def purchase_plans():
     )
 
 @app.route('/product/<uuid:product_id>')
+@cached_page()
 def product_detail(product_id):
     """
     Shows the detailed page for a single e-commerce product
@@ -593,6 +684,7 @@ def product_detail(product_id):
     )
 
 @app.route('/contact')
+@cached_page()
 def contact_us():
     """
     Public page to display SaaS Admin contact info.
@@ -781,27 +873,8 @@ def calculate_final_price(product):
     Handles None/Null values safely to prevent errors.
     """
     try:
-        # 1. Get Price safely
-        original_price = float(product.get('selling_price') or 0)
-        
-        # 2. Get Discount safely (Handle None)
-        raw_percent = product.get('discount_percent')
-        if raw_percent is None:
-            percent = 0.0
-        else:
-            percent = float(raw_percent)
-            
-        # 3. Get Dates safely
-        today = date.today().isoformat()
-        start = str(product.get('discount_start_date') or '1970-01-01')
-        end = str(product.get('discount_end_date') or '2099-12-31')
-        
-        # 4. Check Validity
-        if percent > 0 and start <= today and end >= today:
-            discount_amount = original_price * (percent / 100)
-            final_price = original_price - discount_amount
-            return final_price, True, percent # Returns: (Price, Is_Discounted?, Percent)
-            
+        # Same rules as cart pricing (pricing.py)
+        return unit_price(product) # Returns: (Price, Is_Discounted?, Percent)
     except Exception as e:
         print(f"Price Calc Error for product {product.get('id')}: {e}")
         
@@ -809,6 +882,43 @@ def calculate_final_price(product):
     return float(product.get('selling_price') or 0), False, 0.0
 
 
+def quote_session_cart(cart, promo=None, shipping_cost=0.0):
+    """
+    The one pricing path for cart, apply-promo and checkout: prices the session
+    cart from the catalog in a single pass and returns an immutable CartQuote.
+    """
+    fetched_products = []
+    if cart:
+        try:
+            # Indexed catalog lookup (falls back to the products table for unknown ids)
+            fetched_products = catalog.get_many(list(cart.keys()))
+        except Exception as e:
+            print(f"Cart Fetch Error: {e}")
+    return quote_cart(cart, fetched_products, promo, shipping_cost)
+
+
+def discard_pending_product_order(order_id=None, gateway_tx_id=None, created_before=None):
+    """
+    Deletes unpaid product orders (one by id / gateway id, or every one created
+    before an ISO timestamp) and gives back the promo uses they reserved at checkout.
+    """
+    query = supabase.table('product_orders').delete().eq('status', 'Pending Payment')
+    if order_id:
+        query = query.eq('id', order_id)
+    elif gateway_tx_id:
+        query = query.eq('gateway_tx_id', gateway_tx_id)
+    elif created_before:
+        query = query.lt('created_at', created_before)
+    else:
+        return []
+    res = query.execute()
+    orders = res.data or []
+    for order in orders:
+        if order.get('promo_code'):
+            promo_engine.release_usage(order['promo_code'])
+    return orders
+
+
 # --- REPLACE YOUR EXISTING 'cart' ROUTE ---
 @app.route('/cart')
 def cart():
@@ -816,78 +926,20 @@ def cart():
     saas_settings = get_saas_settings()
     cart = session.get('cart', {})
     
-    shipping_cost = float(saas_settings.get('shipping_cost', 0.0))
-    cart_products = []
-    subtotal = 0
-    
-    if cart:
-        product_ids = list(cart.keys())
-        fetched_products = []
-        
-        try:
-            # Try RPC first
-            res = supabase.rpc('get_products_with_reviews', {'p_search_term': ""}).execute()
-            if res.data:
-                # Filter in Python to ensure we match IDs correctly
-                fetched_products = [p for p in res.data if str(p['id']) in product_ids]
-            
-            # Fallback to direct table query
-            if not fetched_products:
-                res_table = supabase.table('products').select('*, category_id').in_('id', product_ids).execute()
-                fetched_products = res_table.data or []
-                    
-        except Exception as e:
-            print(f"Cart Fetch Error: {e}")
-        
-        for product in fetched_products:
-            product_id = str(product['id'])
-            if product_id not in cart: continue
-                
-            quantity = int(cart[product_id])
-            
-            # --- USE THE ROBUST HELPER ---
-            final_price, is_discounted, percent = calculate_final_price(product)
-            original_price = float(product.get('selling_price', 0))
-            
-            item_subtotal = final_price * quantity
-            subtotal += item_subtotal
-            
-            cart_products.append({
-                "id": product_id,
-                "name": product.get('name'),
-                "image_url": product.get('image_url'),
-                "quantity": quantity,
-                "original_price": original_price,
-                "final_price_per_item": final_price,
-                "is_discounted": is_discounted,
-                "discount_percent": percent, # Pass this to template
-                "subtotal": item_subtotal,
-                "category_id": product.get('category_id')
-            })
-    
-    # Promo Logic
     promo = session.get('promo')
-    discount_amount = 0.0
-    if promo:
-        if promo['type'] == 'Percentage':
-            discount_amount = subtotal * (promo['value'] / 100)
-        else:
-            discount_amount = promo['value']
-        if discount_amount > subtotal: discount_amount = subtotal
-            
-    total_price = max(0, subtotal + shipping_cost - discount_amount)
+    quote = quote_session_cart(cart, promo, float(saas_settings.get('shipping_cost', 0.0)))
 
     return render_template(
         'product_cart.html',
         logo_url=saas_settings.get('saas_logo_url'),
         app_name=saas_settings.get('app_name', 'ISP Manager'),
         contact_email=saas_settings.get('contact_email', 'support@huda-it.com'),
-        cart_products=cart_products,
-        subtotal=subtotal,
-        shipping_cost=shipping_cost,
+        cart_products=quote.lines,
+        subtotal=quote.subtotal,
+        shipping_cost=quote.shipping_cost,
         promo=promo,
-        discount_amount=discount_amount,
-        total_price=total_price
+        discount_amount=quote.discount_amount,
+        total_price=quote.total_price
     )
 # --- *** NEW: Promo Code Routes *** ---
 
@@ -901,82 +953,16 @@ def apply_promo():
         return redirect(url_for('cart'))
         
     try:
-        # --- *** THIS IS THE FIX *** ---
-        # We use standard .execute() instead of .maybe_single() to avoid the crash
-        res = supabase.table('product_promos').select('*').eq('code', code).execute()
-        
-        # Check if we got any results
-        if not res.data or len(res.data) == 0:
-            flash(f"The promo code '{code}' is invalid. Please check the spelling.", "error")
-            return redirect(url_for('cart'))
-            
-        promo = res.data[0] # Get the first result
-        # --- *** END OF FIX *** ---
-        
-        # --- Scenario 2: Code is manually set to Inactive ---
-        if promo['status'] != 'Active':
-            flash(f"The promo code '{code}' is currently inactive.", "error")
-            return redirect(url_for('cart'))
-            
-        today = date.today().isoformat()
-        
-        # --- Scenario 3: Date validation ---
-        if today < promo['start_date']:
-            flash(f"The promo code '{code}' is not active yet. It starts on {promo['start_date']}.", "error")
-            return redirect(url_for('cart'))
-            
-        if today > promo['end_date']:
-            flash(f"The promo code '{code}' has expired.", "error")
-            return redirect(url_for('cart'))
-            
-        # --- Scenario 4: Usage Limit Reached ---
-        if promo['usage_count'] >= promo['usage_limit']:
-            flash(f"The promo code '{code}' has reached its maximum usage limit and is no longer available.", "error")
-            return redirect(url_for('cart'))
-            
-        # --- Scenario 5: Item Targeting (Product/Category mismatch) ---
-        cart = session.get('cart', {})
-        if not cart:
-            flash("Your cart is empty. Please add items before applying a promo code.", "error")
-            return redirect(url_for('cart'))
-            
-        target_pid = promo.get('target_product_id')
-        target_cid = promo.get('target_category_id')
-        
-        # If the promo targets specific items, we must check if they are in the cart
-        if target_pid or target_cid:
-            cart_product_ids = list(cart.keys())
-            is_eligible = False
-            
-            # Check Product Match
-            if target_pid:
-                if str(target_pid) in cart_product_ids:
-                    is_eligible = True
-            
-            # Check Category Match
-            elif target_cid:
-                prods_res = supabase.table('products').select('category_id').in_('id', cart_product_ids).execute()
-                if prods_res.data:
-                    for p in prods_res.data:
-                        if str(p.get('category_id')) == str(target_cid):
-                            is_eligible = True
-                            break
-            
-            if not is_eligible:
-                flash(f"The promo code '{code}' is valid, but it does not apply to the items currently in your cart.", "error")
-                return redirect(url_for('cart'))
+        # Cached, compiled promo rules checked against the priced cart lines (no queries)
+        quote = quote_session_cart(session.get('cart', {}))
+        rule = promo_engine.validate(code, quote.lines)
 
         # --- Success! Store in session ---
-        session['promo'] = {
-            'code': promo['code'],
-            'type': promo['discount_type'],
-            'value': float(promo['discount_value']),
-            'id': promo['id'],
-            'target_product_id': promo.get('target_product_id'),
-            'target_category_id': promo.get('target_category_id')
-        }
+        session['promo'] = rule.to_session()
         flash(f"Promo code '{code}' applied successfully!", "success")
         
+    except PromoError as e:
+        flash(str(e), "error")
     except Exception as e:
         print(f"Error applying promo: {e}")
         # Generic error for unexpected system issues
@@ -1000,20 +986,10 @@ def add_to_cart(product_id):
     target_product = None
     
     try:
-        # Strategy: Fetch list and find item in Python (Bypasses RLS/Filter issues)
-        # 1. Try RPC
-        res = supabase.rpc('get_products_with_reviews', {'p_search_term': ""}).execute()
-        if res.data:
-            # Find product in the list
-            target_product = next((p for p in res.data if str(p['id']) == product_id_str), None)
-            
-        # 2. Fallback to Table if RPC missed it (e.g. for Guests)
-        if not target_product:
-            res_table = supabase.table('products').select('*').eq('id', product_id_str).execute()
-            if res_table.data:
-                target_product = res_table.data[0]
+        # 1. Catalog lookup by id (falls back to the products table if the RPC missed it, e.g. for Guests)
+        target_product = catalog.get(product_id_str)
 
-        # 3. Check if found and stock
+        # 2. Check if found and stock
         if not target_product:
             flash("Product not found.", "error")
             return redirect(request.referrer or url_for('shop'))
@@ -1047,16 +1023,8 @@ def buy_now(product_id):
     target_product = None
     
     try:
-        # 1. Fetch via RPC
-        res = supabase.rpc('get_products_with_reviews', {'p_search_term': ""}).execute()
-        if res.data:
-            target_product = next((p for p in res.data if str(p['id']) == product_id_str), None)
-        
-        # 2. Fallback
-        if not target_product:
-            res_table = supabase.table('products').select('stock_quantity').eq('id', product_id_str).execute()
-            if res_table.data:
-                target_product = res_table.data[0]
+        # 1. Catalog lookup by id (with products table fallback)
+        target_product = catalog.get(product_id_str)
 
         if not target_product:
             flash("Product not found.", "error")
@@ -1368,32 +1336,22 @@ def login():
                     if customer.get('status') != 'Active':
                          flash('Account inactive/suspended. Contact support.', 'error'); supabase.auth.sign_out(); return redirect(url_for('login'))
                     
-                    company_id = customer['company_id']; company_info = {}
-                    if company_id:
-                        try:
-                            # --- RLS FIX: Only select NON-SENSITIVE info ---
-                            company_response = supabase.table('isp_companies').select(
-                                'company_name, logo_url, social_media_links, company_details, payment_info, developer_logo_url'
-                            ).eq('id', company_id).maybe_single().execute()
-                            
-                            # --- *** FIX for 'NoneType' object *** ---
-                            if company_response and company_response.data: 
-                                company_info = company_response.data
-                        except APIError as e:
-                             if "Missing response" in e.message:
-                                 print(f"Login Warning: Customer {customer['id']} linked to missing company_id {company_id}")
-                                 company_info = {} # Continue with default info
-                             else:
-                                 raise
+                    company_id = customer['company_id']
+                    # --- RLS FIX: Only NON-SENSITIVE info (see company_profiles.py) ---
+                    company_profile = company_profiles.get(company_id)
+                    if company_id and company_profile is None:
+                        print(f"Login Warning: Customer {customer['id']} linked to missing company_id {company_id}")
+                    company_fields = company_profile.session_fields() if company_profile else {}
                     
+                    session_store.rotate(session)  # New session id for the logged-in user
                     session['user'] = { 
                         'auth_id': auth_id, 'email': auth_email, 'customer_id': customer['id'], 
                         'customer_name': customer['full_name'], 'avatar_url': customer.get('profile_avatar_url'), 
                         'company_id': customer['company_id'], 'package_id': customer.get('package_id'),
-                        'zone_id': customer.get('zone_id'), 'company_name': company_info.get('company_name', 'Your ISP'), 
-                        'company_logo': company_info.get('logo_url'), 'social_media': company_info.get('social_media_links'), 
-                        'company_details': company_info.get('company_details'), 'payment_info': company_info.get('payment_info'),
-                        'developer_logo': company_info.get('developer_logo_url'), 'is_employee': False
+                        'zone_id': customer.get('zone_id'), 'company_name': company_fields.get('company_name', 'Your ISP'), 
+                        'company_logo': company_fields.get('company_logo'), 'social_media': company_fields.get('social_media'), 
+                        'company_details': company_fields.get('company_details'), 'payment_info': company_fields.get('payment_info'),
+                        'developer_logo': company_fields.get('developer_logo'), 'is_employee': False
                     }
                     
                     response = make_response(redirect(url_for('dashboard_overview')))
@@ -1421,22 +1379,11 @@ def login():
                     if not company_id:
                         raise Exception("Employee record is missing a company ID.")
 
-                    company_info = {}
-                    try:
-                        company_response = supabase.table('isp_companies').select(
-                            'company_name, logo_url, social_media_links, company_details, payment_info, developer_logo_url'
-                        ).eq('id', company_id).maybe_single().execute()
-                        
-                        if company_response and company_response.data: 
-                            company_info = company_response.data
-                        else:
-                            raise Exception("This company's account is not active or cannot be found.")
-                    except APIError as e:
-                        if "Missing response" in e.message:
-                            print(f"Login Error: Employee {employee['id']} linked to missing company_id {company_id}")
-                            raise Exception("Login failed: Your linked company does not exist.")
-                        else:
-                            raise
+                    company_profile = company_profiles.get(company_id)
+                    if company_profile is None:
+                        print(f"Login Error: Employee {employee['id']} linked to missing company_id {company_id}")
+                        raise Exception("This company's account is not active or cannot be found.")
+                    company_fields = company_profile.session_fields()
                     
 # --- *** ROBUST FIX for 'str' object has no attribute 'get' *** ---
                     
@@ -1459,14 +1406,15 @@ def login():
                         permissions_data = {}
                     # --- *** END OF FIX *** ---
 
+                    session_store.rotate(session)  # New session id for the logged-in user
                     session['user'] = { 
                         'auth_id': auth_id, 'email': auth_email, 'employee_id': employee['id'], 
                         'employee_name': employee['full_name'], 'avatar_url': employee.get('profile_avatar_url'), 
                         'role': employee_role_data.get('role_name', 'Employee'),
                         'permissions': permissions_data, # <-- Use the new, clean variable
-                        'company_id': employee['company_id'], 'company_name': company_info.get('company_name', 'Your ISP'), 
-                        'company_logo': company_info.get('logo_url'), 'social_media': company_info.get('social_media_links'), 
-                        'company_details': company_info.get('company_details'), 'is_employee': True
+                        'company_id': employee['company_id'], 'company_name': company_fields['company_name'], 
+                        'company_logo': company_fields['company_logo'], 'social_media': company_fields['social_media'], 
+                        'company_details': company_fields['company_details'], 'is_employee': True
                     }
                     
                     response = make_response(redirect(url_for('employee_dashboard')))
@@ -1640,46 +1588,9 @@ def dashboard_overview():
     customer_id = user['customer_id']
     customer_zone_id = user.get('zone_id')  
     
-    open_ticket_count = 0
-    unpaid_invoice_count = 0
-    upcoming_appt_count = 0  
-    network_updates = []
-    has_error = False  
+    today = datetime.now().isoformat()
 
-    # --- Existing Logic: Tickets ---
-    try:
-        ticket_response = supabase.table('support_tickets').select('id', count='exact').eq('customer_id', customer_id).neq('status', 'Closed').neq('status', 'Resolved').execute()
-        if ticket_response.count is not None:
-            open_ticket_count = ticket_response.count
-    except Exception as e:
-        print(f"Error fetching ticket data: {e}")
-        has_error = True
-
-    # --- Existing Logic: Invoices ---
-    try:
-        invoice_response = supabase.table('invoices').select('id', count='exact').eq('customer_id', customer_id).neq('status', 'Paid').execute()
-        if invoice_response.count is not None:
-            unpaid_invoice_count = invoice_response.count
-    except Exception as e:
-        print(f"Error fetching invoice data: {e}")
-        has_error = True
-
-    # --- Existing Logic: Appointments ---
-    try:
-        today = datetime.now().isoformat()
-        appt_response = supabase.table('appointments').select('id', count='exact')\
-            .eq('customer_id', customer_id)\
-            .eq('status', 'Scheduled')\
-            .gte('start_time', today)\
-            .execute()
-        if appt_response.count is not None:
-            upcoming_appt_count = appt_response.count
-    except Exception as e:
-        print(f"Error fetching appointment data: {e}")
-        has_error = True
-
-    # --- Existing Logic: Network Updates ---
-    try:
+    def network_updates_query():
         query = supabase.table('network_status').select('*')\
             .eq('company_id', user['company_id'])\
             .in_('status_type', ['Outage', 'Maintenance', 'Degraded'])\
@@ -1689,22 +1600,30 @@ def dashboard_overview():
         if customer_zone_id:
             filter_or += f",zone_ids.cs.{{{customer_zone_id}}}"  
         
-        query = query.or_(filter_or)
-        
-        update_response = query.execute()
-        if update_response.data:
-            network_updates = update_response.data
-            
-    except Exception as e:
-        print(f"Error fetching network updates: {e}")
-        has_error = True
-
-    if has_error:
+        return query.or_(filter_or).execute()
+
+    # Independent reads run concurrently (see parallel_queries.py)
+    results, failed = run_parallel({
+        'tickets': (lambda: supabase.table('support_tickets').select('id', count='exact').eq('customer_id', customer_id).neq('status', 'Closed').neq('status', 'Resolved').execute(), None),
+        'invoices': (lambda: supabase.table('invoices').select('id', count='exact').eq('customer_id', customer_id).neq('status', 'Paid').execute(), None),
+        'appointments': (lambda: supabase.table('appointments').select('id', count='exact')
+                         .eq('customer_id', customer_id)
+                         .eq('status', 'Scheduled')
+                         .gte('start_time', today)
+                         .execute(), None),
+        'network': (network_updates_query, None),
+        'ads': (get_portal_ads, []),
+    })
+
+    open_ticket_count = (results['tickets'].count or 0) if results['tickets'] else 0
+    unpaid_invoice_count = (results['invoices'].count or 0) if results['invoices'] else 0
+    upcoming_appt_count = (results['appointments'].count or 0) if results['appointments'] else 0
+    network_updates = (results['network'].data or []) if results['network'] else []
+    portal_ads = results['ads']
+
+    if failed - {'ads'}:
         flash('Could not load all dashboard summary data.', 'error')
 
-    # --- NEW: Fetch Portal Ads ---
-    portal_ads = get_portal_ads()
-
     return render_template('dashboard_overview.html',  
                            open_tickets=open_ticket_count,  
                            unpaid_invoices=unpaid_invoice_count,
@@ -1736,8 +1655,7 @@ def initiate_invoice_payment(invoice_id):
             return redirect(url_for('invoices'))
 
         # 2. Fetch Company Credentials (DYNAMIC)
-        comp_res = supabase.table('isp_companies').select('payment_gateway_settings').eq('id', invoice['company_id']).maybe_single().execute()
-        gateway_settings = comp_res.data.get('payment_gateway_settings', {}).get('bkash', {})
+        gateway_settings = get_company_gateway_settings(invoice['company_id'])
         
         if not gateway_settings.get('enabled'):
             flash("Online payment is not enabled for your ISP. Please contact them.", "error")
@@ -1774,15 +1692,135 @@ def initiate_invoice_payment(invoice_id):
         flash(f"Payment initiation failed: {e}", "error")
         return redirect(url_for('invoices'))
 
+# --- Stored Receipt PDFs (see pdf_store.py) ---
+
+RECEIPT_CUSTOMER_FIELDS = ('full_name', 'email', 'address', 'phone_number')
+
+
+def _receipt_key(kind, invoice, customer, company_details, *extra):
+    # Only the fields the receipt renders, so different selects of the same rows give the same key
+    invoice_row = {k: v for k, v in invoice.items() if k != 'customers'}
+    customer_row = {k: (customer or {}).get(k) for k in RECEIPT_CUSTOMER_FIELDS}
+    return pdf_key(kind, invoice_row, customer_row, company_details, *extra)
+
+
+def _one_time_charge_lines(invoice):
+    """Returns (charge_details, employee_name) for a One-Time invoice, else (None, None)."""
+    pkg_details = invoice.get('package_details')
+    if isinstance(pkg_details, str):
+        try: pkg_details = json.loads(pkg_details)
+        except: pkg_details = {}
+    if not (isinstance(pkg_details, dict) and "One-Time" in pkg_details.get('name', '')):
+        return None, None
+
+    charge_res = supabase.table('one_time_charges').select(
+        'charge_details, employees(full_name)'
+    ).eq('invoice_id', invoice['id']).maybe_single().execute()
+    if not charge_res or not charge_res.data:
+        return None, None
+    employee = charge_res.data.get('employees') or {}
+    return charge_res.data.get('charge_details'), employee.get('full_name')
+
+
+def customer_receipt_pdf(invoice, customer, company_details):
+    """
+    The A4 receipt shown in the customer portal, as (key, pdf_bytes). One-time charge
+    lines are only looked up when rendering; they are fixed once the invoice is paid.
+    """
+    key = _receipt_key('receipt', invoice, customer, company_details)
+
+    def render():
+        charge_details, employee_name = _one_time_charge_lines(invoice)
+        return invoice_utils.create_receipt_pdf_as_bytes(
+            invoice, customer, company_details, "Customer Portal",
+            charge_details=charge_details, employee_name=employee_name
+        )
+    return key, pdf_store.get_or_render(key, render)
+
+
+def thermal_receipt_pdf(invoice, customer, company_details, generated_by):
+    """The 80mm thermal receipt, as (key, pdf_bytes)."""
+    key = _receipt_key('thermal_receipt', invoice, customer, company_details, generated_by)
+    return key, pdf_store.get_or_render(key, lambda: invoice_utils.create_thermal_receipt_as_bytes(
+        invoice, customer, company_details, generated_by
+    ))
+
+
+# --- Post-Payment Jobs ---
+
+@jobs.handler('payment_admin_notification')
+def payment_admin_notification_job(payload):
+    send_admin_notification(**payload)
+
+
+@jobs.handler('invoice_receipt_email')
+def invoice_receipt_email_job(payload):
+    """Builds the thermal receipt for a paid invoice and emails it to the customer."""
+    inv_res = supabase.table('invoices').select('*, customers(*)').eq('id', payload['invoice_id']).maybe_single().execute()
+    if not inv_res or not inv_res.data:
+        raise Exception(f"Invoice {payload['invoice_id']} not found.")
+    invoice = inv_res.data
+    customer = invoice.get('customers') or {}
+    customer_email = customer.get('email')
+    if not customer_email:
+        return
+
+    company_details = invoice_utils.get_isp_company_details_from_db(invoice['company_id'])
+    _, pdf_bytes = thermal_receipt_pdf(invoice, customer, company_details, payload.get('collected_by', 'Online System'))
+
+    sent, message = email_service.send_invoice_email(
+        customer_email=customer_email,
+        customer_name=customer.get('full_name', 'Customer'),
+        invoice_data=invoice,
+        company_details=company_details,
+        pdf_bytes=pdf_bytes
+    )
+    if not sent:
+        raise Exception(message)
+    print(f"SUCCESS: Receipt emailed to {customer_email}")
+
+    # Render the portal receipt now, so the customer's first view is served from the store
+    try:
+        customer_receipt_pdf(invoice, customer, company_details)
+    except Exception as e:
+        print(f"[PDF_STORE] Could not pre-render receipt for invoice {invoice['id']}: {e}")
+
+
+@jobs.handler('reactivate_service')
+def reactivate_service_job(payload):
+    # Wait for the router so a MikroTik failure is retried / dead-lettered like any other
+    ok, message = reactivate_service(payload['customer_id'], wait_for_router=True)
+    if not ok:
+        raise Exception(message)
+
+
+def enqueue_invoice_payment_jobs(invoice, customer_name, trx_id, collected_by):
+    """Queues the notification, receipt email and reactivation for a freshly paid invoice."""
+    key = f"invoice:{invoice['id']}:{trx_id}"
+    jobs.enqueue('payment_admin_notification', {
+        'company_id': invoice['company_id'],
+        'title': "Payment Received",
+        'message': f"Invoice #{invoice['invoice_number']} paid by {customer_name} ({invoice['amount']} BDT).",
+        'notif_type': "Payment",
+        'related_id': str(invoice['id'])
+    }, idempotency_key=f"{key}:notify")
+    jobs.enqueue('invoice_receipt_email', {
+        'invoice_id': invoice['id'],
+        'collected_by': collected_by
+    }, idempotency_key=f"{key}:receipt")
+    jobs.enqueue('reactivate_service', {
+        'customer_id': invoice['customer_id']
+    }, idempotency_key=f"{key}:reactivate")
+
+
 @app.route('/payment/bkash/callback')
 def bkash_callback():
     """
     Handles the redirect back from bKash:
     1. Verifies payment.
     2. Updates Invoice to 'Paid'.
-    3. Sends Real-Time Notification to Admin App (WITH CUSTOMER NAME).
-    4. Generates PDF Receipt & Emails Customer.
-    5. Auto-Reactivates Internet Service.
+    3. Queues the admin notification, PDF receipt email and service
+       reactivation as background jobs (see job_queue.py).
     """
     payment_id = request.args.get('paymentID')
     status = request.args.get('status')
@@ -1805,8 +1843,7 @@ def bkash_callback():
         customer_name = customer.get('full_name', 'Unknown Customer') # Extract Name
         
         # 3. Fetch Company Credentials
-        comp_res = supabase.table('isp_companies').select('payment_gateway_settings').eq('id', invoice['company_id']).maybe_single().execute()
-        gateway_settings = comp_res.data.get('payment_gateway_settings', {}).get('bkash', {})
+        gateway_settings = get_company_gateway_settings(invoice['company_id'])
         
         bkash = BkashGateway(
             username=gateway_settings.get('username'),
@@ -1840,59 +1877,11 @@ def bkash_callback():
             invoice['payment_method'] = 'bKash Online'
             invoice['transaction_id'] = trx_id
             
-            # 6. TRIGGER ADMIN NOTIFICATION (UPDATED with Customer Name)
-            send_admin_notification(
-                company_id=invoice['company_id'],
-                title="Payment Received",
-                # Message now includes the Customer Name
-                message=f"Invoice #{invoice['invoice_number']} paid by {customer_name} ({invoice['amount']} BDT).",
-                notif_type="Payment",
-                related_id=str(invoice['id'])
-            )
-
-            # 7. Generate PDF Receipt & Send Email
-            try:
-                print("Attempting to send receipt email...")
-                customer_email = customer.get('email')
-                
-                if customer_email:
-                    company_details = invoice_utils.get_isp_company_details_from_db(invoice['company_id'])
-                    
-                    pdf_gen = invoice_utils.create_thermal_receipt_as_bytes(
-                        invoice,  
-                        customer, # Pass full customer dict
-                        company_details,  
-                        "Online bKash System" 
-                    )
-                    
-                    success, pdf_bytes = pdf_gen
-                    if success:
-                        pdf_filename = f"receipt_{invoice['invoice_number']}.pdf"
-                        with open(pdf_filename, 'wb') as f:
-                            f.write(pdf_bytes)
-                        
-                        email_service.send_invoice_email(
-                            customer_email=customer_email,
-                            customer_name=customer_name,
-                            invoice_data=invoice,
-                            company_details=company_details,
-                            pdf_attachment_path=pdf_filename
-                        )
-                        print(f"SUCCESS: Email sent to {customer_email}")
-                        
-                        if os.path.exists(pdf_filename): os.remove(pdf_filename)
-                    else:
-                        print(f"PDF Error: {pdf_bytes}") 
-            except Exception as e:
-                print(f"EMAIL FAILED: {e}")
+            # 6. Everything else runs in the background job queue, so the customer
+            #    is redirected as soon as the payment is committed.
+            enqueue_invoice_payment_jobs(invoice, customer_name, trx_id, "Online bKash System")
 
-            # 8. Auto-Reactivate Internet Service
-            try:
-                reactivate_service(invoice['customer_id'])
-                flash("Payment successful! Internet reactivated. Receipt emailed.", "success")
-            except Exception:
-                flash("Payment successful! Receipt emailed.", "success")
-                
+            flash("Payment successful! Your receipt will be emailed and your service reactivated shortly.", "success")
             return redirect(url_for('invoices'))
         else:
             flash(f"Payment verification failed: {resp.get('statusMessage')}", "error")
@@ -1928,9 +1917,6 @@ def view_receipt(invoice_id):
     user = get_user_from_session()
     if not supabase: abort(500, "Database connection not available")
     
-    charge_details = None
-    employee_name = None
-
     try:
         response = supabase.table('invoices').select('*, customers(full_name, email, address, phone_number)').eq('id', invoice_id).eq('customer_id', user['customer_id']).eq('status', 'Paid').maybe_single().execute()
         if not response.data: flash("Receipt not found or invoice is not paid.", 'error'); return redirect(url_for('invoices'))
@@ -1939,38 +1925,12 @@ def view_receipt(invoice_id):
         customer_data = invoice_data.get('customers')
         if customer_data is None: flash("Cannot generate receipt: Customer data is missing.", 'error'); return redirect(url_for('invoices'))
         
-        pkg_details = invoice_data.get('package_details')
-        if isinstance(pkg_details, str):
-            try: pkg_details = json.loads(pkg_details)
-            except: pkg_details = {}
-        
-        if isinstance(pkg_details, dict) and "One-Time" in pkg_details.get('name', ''):
-            charge_res = supabase.table('one_time_charges').select(
-                'charge_details, employees(full_name)'
-            ).eq('invoice_id', invoice_id).maybe_single().execute()
-            
-            if charge_res and charge_res.data:
-                charge_details = charge_res.data.get('charge_details')
-                if charge_res.data.get('employees'):
-                    employee_name = charge_res.data['employees'].get('full_name')
-        
         # --- CORRECTED FUNCTION CALL ---
         company_data_for_pdf = invoice_utils.get_isp_company_details_from_db(user['company_id'])
         
-        pdf_gen = invoice_utils.create_receipt_pdf_as_bytes(
-            invoice_data,  
-            customer_data,  
-            company_data_for_pdf,  
-            "Customer Portal",
-            charge_details=charge_details,
-            employee_name=employee_name
-        )
-        
-        success, pdf_bytes_or_error = pdf_gen
-        if not success: raise Exception(f"PDF generation failed: {pdf_bytes_or_error}")
-        
-        pdf_bytes = pdf_bytes_or_error
-        return send_file(BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=False, download_name=f"Receipt_{invoice_data['invoice_number']}.pdf")
+        # Rendered once per content (usually already at payment time), then served from the store
+        key, pdf_bytes = customer_receipt_pdf(invoice_data, customer_data, company_data_for_pdf)
+        return send_pdf(key, pdf_bytes, f"Receipt_{invoice_data['invoice_number']}.pdf")
     
     except Exception as e:  
         print(f"Error generating receipt: {e}");  
@@ -2039,62 +1999,41 @@ def create_ticket():
             assigned_at = None
             
             try:
-                # A. Get Customer's Zone
-                cust_res = supabase.table('customers').select('zone_id').eq('id', customer_id).single().execute()
+                # A. Customer's Zone (stored in the session at login)
+                zone_id = user.get('zone_id')
+                if not zone_id:
+                    cust_res = supabase.table('customers').select('zone_id').eq('id', customer_id).single().execute()
+                    zone_id = cust_res.data.get('zone_id') if cust_res.data else None
                 
-                if cust_res.data and cust_res.data.get('zone_id'):
-                    zone_id = cust_res.data['zone_id']
-                    
-                    # B. Find Active Employees in that Zone
-                    emp_res = supabase.table('employees').select('id, full_name, email')\
-                        .eq('zone_id', zone_id)\
-                        .eq('status', 'Active').execute()
-                    
-                    candidates = emp_res.data or []
+                if zone_id or assignment_engine.strategy == 'zone_weighted':
+                    # B/C. Pick a technician from the cached roster + load index (see ticket_assignment.py)
+                    best_candidate = assignment_engine.assign(company_id, zone_id)
                     
-                    if candidates:
-                        # C. Find Employee with FEWEST Open/In-Progress Tickets
-                        best_candidate = None
-                        min_tickets = float('inf')
+                    # D. Assign to the best candidate
+                    if best_candidate:
+                        assigned_emp_id = best_candidate['id']
+                        assigned_at = now_utc.isoformat()
+                        print(f"Auto-Assigned Ticket {ticket_number} to {best_candidate['full_name']} ({assignment_engine.strategy})")
                         
-                        for emp in candidates:
-                            # Count open tickets for this employee
-                            count_res = supabase.table('support_tickets').select('id', count='exact')\
-                                .eq('assigned_to_employee_id', emp['id'])\
-                                .in_('status', ['Open', 'In Progress'])\
-                                .execute()
-                            
-                            count = count_res.count if count_res.count is not None else 0
+                        # E. Send Notification Email to Employee
+                        try:
+                            # Fetch company details for branding
+                            company_details = invoice_utils.get_isp_company_details_from_db(company_id)
                             
-                            if count < min_tickets:
-                                min_tickets = count
-                                best_candidate = emp
-                        
-                        # D. Assign to the best candidate
-                        if best_candidate:
-                            assigned_emp_id = best_candidate['id']
-                            assigned_at = now_utc.isoformat()
-                            print(f"Auto-Assigned Ticket {ticket_number} to {best_candidate['full_name']} (Load: {min_tickets})")
+                            # Fetch customer details for the email body
+                            cust_info_res = supabase.table('customers').select('full_name, phone_number, address').eq('id', customer_id).single().execute()
+                            cust_info = cust_info_res.data or {}
                             
-                            # E. Send Notification Email to Employee
-                            try:
-                                # Fetch company details for branding
-                                company_details = invoice_utils.get_isp_company_details_from_db(company_id)
-                                
-                                # Fetch customer details for the email body
-                                cust_info_res = supabase.table('customers').select('full_name, phone_number, address').eq('id', customer_id).single().execute()
-                                cust_info = cust_info_res.data or {}
-                                
-                                email_service.send_ticket_assignment_email(
-                                    employee_email=best_candidate['email'],
-                                    employee_name=best_candidate['full_name'],
-                                    ticket_number=ticket_number,
-                                    customer=cust_info,
-                                    ticket_description=description,
-                                    company_details=company_details
-                                )
-                            except Exception as email_err:
-                                print(f"Failed to send auto-assign email: {email_err}")
+                            email_service.send_ticket_assignment_email(
+                                employee_email=best_candidate['email'],
+                                employee_name=best_candidate['full_name'],
+                                ticket_number=ticket_number,
+                                customer=cust_info,
+                                ticket_description=description,
+                                company_details=company_details
+                            )
+                        except Exception as email_err:
+                            print(f"Failed to send auto-assign email: {email_err}")
 
             except Exception as auto_assign_err:
                 print(f"Auto-Assign System Error: {auto_assign_err}")
@@ -2116,10 +2055,17 @@ def create_ticket():
                 'assigned_at': assigned_at
             }
             
-            response = supabase.table('support_tickets').insert(payload).execute()
+            try:
+                response = supabase.table('support_tickets').insert(payload).execute()
+            except Exception:
+                # Give the reserved slot back to the load index
+                assignment_engine.release(company_id, assigned_emp_id)
+                raise
             
             if response.data:
                 new_ticket_id = response.data[0]['id']
+                if assigned_emp_id:
+                    employee_metrics.on_ticket_assigned(assigned_emp_id, status='Open')
                 
                 # Notifications & Logging
                 try:
@@ -2140,6 +2086,7 @@ def create_ticket():
                 flash(msg, 'success')
                 return redirect(url_for('support_tickets'))
             else:
+                assignment_engine.release(company_id, assigned_emp_id)
                 flash('There was an error creating your ticket.', 'error')
                 
         except Exception as e:
@@ -2247,6 +2194,7 @@ def rate_ticket(ticket_id):
             'feedback': feedback
         }
         supabase.table('ticket_ratings').insert(payload).execute()
+        employee_metrics.on_rating(ticket['assigned_to_employee_id'], rating)
         
         flash("Thank you for your feedback!", "success")
         return redirect(url_for('view_ticket', ticket_id=ticket_id))
@@ -2284,6 +2232,7 @@ def ticket_feedback(ticket_id):
                 'feedback': comment
             }
             supabase.table('ticket_ratings').insert(payload).execute()
+            employee_metrics.on_rating(ticket['assigned_to_employee_id'], rating)
             
             return render_template('feedback_success.html')
             
@@ -2467,15 +2416,11 @@ def profile():
                 except:
                     smart_id = "EMP-???"
 
-                # --- D. NEW: CALCULATE RATINGS ---
+                # --- D. RATINGS (from the metrics rollup) ---
                 try:
-                    rating_res = supabase.table('ticket_ratings').select('rating').eq('employee_id', employee_details['id']).execute()
-                    ratings_data = rating_res.data or []
-                    review_count = len(ratings_data)
-                    
-                    if review_count > 0:
-                        total_stars = sum(r['rating'] for r in ratings_data)
-                        avg_rating = round(total_stars / review_count, 1)
+                    metrics = employee_metrics.get_employee_metrics(employee_details['id'])
+                    review_count = metrics['rating_count']
+                    avg_rating = metrics['avg_rating']
                 except Exception as e:
                     print(f"Rating Calc Error: {e}")
 
@@ -2551,17 +2496,7 @@ def inject_whatsapp_support():
 
     if user and 'company_id' in user:
         try:
-            # FIX: Changed 'phone' to 'contact_phone'
-            res = supabase.table('isp_companies').select('contact_phone')\
-                .eq('id', user['company_id'])\
-                .limit(1).execute()
-            
-            if res.data and len(res.data) > 0:
-                # FIX: Access 'contact_phone' from the result
-                raw_phone = res.data[0].get('contact_phone')
-                if raw_phone:
-                    # Clean the number (remove + - ( ) spaces)
-                    support_phone = ''.join(filter(str.isdigit, str(raw_phone)))
+            support_phone = get_company_support_phone(user['company_id'])
         except Exception as e:
             # Fail silently
             pass
@@ -2580,20 +2515,20 @@ def my_plan():
     customer_data = None
     available_packages = []
     
-    try:
-        # 1. Fetch Current Customer Data (with linked Package details)
-        cust_res = supabase.table('customers').select('*, packages(*)').eq('id', user['customer_id']).maybe_single().execute()
-        customer_data = cust_res.data
-        
-        # 2. Fetch All Available Packages for this ISP
-        pkg_res = supabase.table('packages').select('*')\
-            .eq('company_id', user['company_id'])\
-            .order('price', desc=False)\
-            .execute()
-        available_packages = pkg_res.data or []
-        
-    except Exception as e:
-        print(f"Error fetching plan data: {e}")
+    # Both reads are independent, so they run concurrently
+    results, failed = run_parallel({
+        # 1. Current Customer Data (with linked Package details)
+        'customer': (lambda: supabase.table('customers').select('*, packages(*)').eq('id', user['customer_id']).maybe_single().execute(), None),
+        # 2. All Available Packages for this ISP
+        'packages': (lambda: supabase.table('packages').select('*')
+                     .eq('company_id', user['company_id'])
+                     .order('price', desc=False)
+                     .execute(), None),
+    })
+    customer_data = results['customer'].data if results['customer'] else None
+    available_packages = (results['packages'].data or []) if results['packages'] else []
+    
+    if failed:
         flash("Could not load plan details.", "error")
         
     return render_template('my_plan.html', 
@@ -2657,78 +2592,49 @@ def employee_dashboard():
     avg_rating = 0.0
     review_count = 0
     avg_resolution_time_str = "N/A" # New Variable
+    portal_ads = []
     
     try:
-        # 1. Fetch Upcoming Appointments
+        # 1. Upcoming Appointments, 2. Ticket & Rating Statistics (metrics rollup)
+        #    and Portal Ads are independent, so they are fetched concurrently
         today = datetime.now().isoformat()
-        appt_response = supabase.table('appointments').select('id', count='exact')\
-            .eq('employee_id', user['employee_id'])\
-            .eq('status', 'Scheduled')\
-            .gte('start_time', today)\
-            .execute()
-        if appt_response.count is not None:
-            upcoming_appt_count = appt_response.count
-
-        # 2. Fetch Ticket Statistics (Modified to get timestamps for math)
-        tickets_res = supabase.table('support_tickets').select('status, created_at, closed_at')\
-            .eq('assigned_to_employee_id', user['employee_id']).execute()
-        
-        all_tickets = tickets_res.data or []
-        total_assigned = len(all_tickets)
-        
-        # Count Stats
-        pending = sum(1 for t in all_tickets if t['status'] in ['Open', 'In Progress'])
-        resolved_tickets = [t for t in all_tickets if t['status'] == 'Resolved']
-        resolved = len(resolved_tickets)
-
-        # --- CALCULATE AVERAGE RESOLUTION TIME ---
-        if resolved > 0:
-            total_seconds = 0
-            count_valid = 0
-            for t in resolved_tickets:
-                if t.get('created_at') and t.get('closed_at'):
-                    try:
-                        # Handle ISO format. Replace Z with +00:00 for Python compatibility
-                        start = datetime.fromisoformat(t['created_at'].replace('Z', '+00:00'))
-                        end = datetime.fromisoformat(t['closed_at'].replace('Z', '+00:00'))
-                        duration = (end - start).total_seconds()
-                        if duration > 0:
-                            total_seconds += duration
-                            count_valid += 1
-                    except:
-                        continue
-            
-            if count_valid > 0:
-                avg_sec = total_seconds / count_valid
-                # Format logic
-                if avg_sec < 3600: # Less than 1 hour
-                    avg_resolution_time_str = f"{int(avg_sec // 60)}m"
-                elif avg_sec < 86400: # Less than 1 day
-                    hours = int(avg_sec // 3600)
-                    mins = int((avg_sec % 3600) // 60)
-                    avg_resolution_time_str = f"{hours}h {mins}m"
-                else: # Days
-                    days = int(avg_sec // 86400)
-                    hours = int((avg_sec % 86400) // 3600)
-                    avg_resolution_time_str = f"{days}d {hours}h"
-
-        # 3. Fetch & Calculate Ratings
-        rating_res = supabase.table('ticket_ratings').select('rating')\
-            .eq('employee_id', user['employee_id']).execute()
-        
-        ratings_data = rating_res.data or []
-        review_count = len(ratings_data)
-        
-        if review_count > 0:
-            total_stars = sum(r['rating'] for r in ratings_data)
-            avg_rating = round(total_stars / review_count, 1)
+        results, failed = run_parallel({
+            'appointments': (lambda: supabase.table('appointments').select('id', count='exact')
+                             .eq('employee_id', user['employee_id'])
+                             .eq('status', 'Scheduled')
+                             .gte('start_time', today)
+                             .execute(), None),
+            'metrics': (lambda: employee_metrics.get_employee_metrics(user['employee_id']), None),
+            'ads': (get_portal_ads, []),
+        })
+        portal_ads = results['ads']
+        if results['appointments'] and results['appointments'].count is not None:
+            upcoming_appt_count = results['appointments'].count
+
+        metrics = results['metrics'] or {}
+        total_assigned = metrics.get('assigned_count', 0)
+        pending = metrics.get('pending_count', 0)
+        resolved = metrics.get('resolved_count', 0)
+        review_count = metrics.get('rating_count', 0)
+        avg_rating = metrics.get('avg_rating', 0.0)
+
+        # --- FORMAT AVERAGE RESOLUTION TIME ---
+        avg_sec = metrics.get('avg_resolution_seconds')
+        if avg_sec:
+            if avg_sec < 3600: # Less than 1 hour
+                avg_resolution_time_str = f"{int(avg_sec // 60)}m"
+            elif avg_sec < 86400: # Less than 1 day
+                hours = int(avg_sec // 3600)
+                mins = int((avg_sec % 3600) // 60)
+                avg_resolution_time_str = f"{hours}h {mins}m"
+            else: # Days
+                days = int(avg_sec // 86400)
+                hours = int((avg_sec % 86400) // 3600)
+                avg_resolution_time_str = f"{days}d {hours}h"
 
     except Exception as e:
         print(f"Error fetching employee dashboard data: {e}")
     
-    # Fetch Portal Ads
-    portal_ads = get_portal_ads()
-    
     return render_template('employee_dashboard.html', 
                            upcoming_appointments=upcoming_appt_count,
                            total_assigned=total_assigned,
@@ -2946,28 +2852,18 @@ def download_payslip(record_id):
         # --- *** CORRECTED FUNCTION CALL *** ---
         company_data = invoice_utils.get_isp_company_details_from_db(user['company_id'])
         
-        pdf_gen = invoice_utils.create_payslip_pdf_as_bytes(
+        key = pdf_key('payslip', payroll_data, employee_data, company_data)
+        pdf_bytes = pdf_store.get_or_render(key, lambda: invoice_utils.create_payslip_pdf_as_bytes(
             payroll_data,
             employee_data,
             company_data,
             "Employee Portal"
-        )
-        
-        success, pdf_bytes_or_error = pdf_gen
-        if not success:  
-            raise Exception(f"PDF generation failed: {pdf_bytes_or_error}")
-        
-        pdf_bytes = pdf_bytes_or_error
+        ))
         
         pay_period = f"{date(payroll_data['pay_period_year'], payroll_data['pay_period_month'], 1).strftime('%B-%Y')}"
         download_name = f"Payslip-{pay_period}.pdf"
         
-        return send_file(
-            BytesIO(pdf_bytes),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=download_name
-        )
+        return send_pdf(key, pdf_bytes, download_name, as_attachment=True)
 
     except Exception as e:
         print(f"Error generating payslip: {e}")
@@ -3007,23 +2903,21 @@ def employee_expenses():
     categories = []
     customers = []
     expenses = []
-    try:
-        cat_res = supabase.table('expense_categories').select('id, name').eq('company_id', user['company_id']).order('name').execute()
-        if cat_res.data:
-            categories = cat_res.data
-            
-        cust_res = supabase.table('customers').select('id, full_name').eq('company_id', user['company_id']).eq('status', 'Active').order('full_name').execute()
-        if cust_res.data:
-            customers = cust_res.data
-            
-        exp_res = supabase.table('expenses').select(
+    results, failed = run_parallel({
+        'categories': (lambda: supabase.table('expense_categories').select('id, name').eq('company_id', user['company_id']).order('name').execute(), None),
+        'customers': (lambda: supabase.table('customers').select('id, full_name').eq('company_id', user['company_id']).eq('status', 'Active').order('full_name').execute(), None),
+        'expenses': (lambda: supabase.table('expenses').select(
             '*, expense_categories(name), customers(full_name)'
-        ).eq('employee_id', user['employee_id']).order('expense_date', desc=True).execute()
-        if exp_res.data:
-            expenses = exp_res.data
-
-    except Exception as e:
-        print(f"Error loading expense data: {e}")
+        ).eq('employee_id', user['employee_id']).order('expense_date', desc=True).execute(), None),
+    })
+    if results['categories'] and results['categories'].data:
+        categories = results['categories'].data
+    if results['customers'] and results['customers'].data:
+        customers = results['customers'].data
+    if results['expenses'] and results['expenses'].data:
+        expenses = results['expenses'].data
+
+    if failed:
         flash('Could not load all expense data.', 'error')
         
     return render_template('employee_expenses.html',  
@@ -3142,7 +3036,7 @@ def employee_view_ticket(ticket_id):
             try:
                 # Fetch current data to check existing timestamps
                 ticket_check = supabase.table('support_tickets').select(
-                    'ticket_number, subject, assigned_at, customers(full_name, email)'
+                    'ticket_number, subject, status, created_at, assigned_at, customers(full_name, email)'
                 ).eq('id', ticket_id).maybe_single().execute()
                 
                 if not ticket_check.data:
@@ -3172,6 +3066,10 @@ def employee_view_ticket(ticket_id):
                 
                 if response.data:
                     flash(f'Ticket updated to {new_status}', 'success')
+                    assignment_engine.on_status_change(user['company_id'], user['employee_id'],
+                                                       current_data.get('status'), new_status)
+                    employee_metrics.on_ticket_status_change(user['employee_id'], current_data.get('status'), new_status,
+                                                             current_data.get('created_at'), update_payload.get('resolved_at'))
                     
                     # --- SAFE BACKGROUND EMAIL TASK ---
                     if new_status in ['Resolved', 'Closed'] and customer_info.get('email'):
@@ -3196,8 +3094,9 @@ def employee_view_ticket(ticket_id):
                             # Prepare Data
                             company_details = invoice_utils.get_isp_company_details_from_db(user['company_id'])
                             
-                            # USE EXECUTOR (Prevents Crash)
-                            executor.submit(
+                            # Email pool (see task_executor.py)
+                            tasks.submit(
+                                'email',
                                 send_ticket_email_safe,
                                 company_details, 
                                 customer_info.get('email'), 
@@ -3548,60 +3447,43 @@ def employee_collect_payment(invoice_id):
                 except Exception as e:
                     print(f"Notification Error: {e}")
 
-                # --- 5. BACKGROUND TASKS (SAFE SINGLE THREAD) ---
-                def background_payment_tasks(inv_data, cust_data, comp_id, emp_name):
-                    print("--- [BACKGROUND] Payment Tasks Started ---")
-                    
-                    # A. Reactivate Service (Router Connection)
-                    try:
-                        print(f"--- Reactivating Service for Customer ID: {inv_data['customer_id']} ---")
-                        reactivate_service(inv_data['customer_id'])
-                        print("--- Reactivation Success ---")
-                    except Exception as e:
-                        print(f"Reactivation Error: {e}")
+                # --- 5. BACKGROUND TASKS (router / pdf / email pools) ---
+                def reactivate_task(customer_id):
+                    print(f"--- Reactivating Service for Customer ID: {customer_id} ---")
+                    reactivate_service(customer_id)
+                    print("--- Reactivation Success ---")
 
-                    # B. Send Email
+                def receipt_pdf_task(inv_data, cust_data, comp_id, emp_name):
+                    company_details = invoice_utils.get_isp_company_details_from_db(comp_id)
                     try:
-                        if cust_data and cust_data.get('email'):
-                            print(f"--- Sending Email to {cust_data['email']} ---")
-                            company_details = invoice_utils.get_isp_company_details_from_db(comp_id)
-                            
-                            pdf_gen = invoice_utils.create_thermal_receipt_as_bytes(
-                                inv_data, cust_data, company_details, emp_name
-                            )
-                            
-                            if pdf_gen[0]: 
-                                pdf_bytes = pdf_gen[1]
-                                pdf_filename = f"receipt_{inv_data['invoice_number']}.pdf"
-                                
-                                # Save temporary file
-                                with open(pdf_filename, 'wb') as f:
-                                    f.write(pdf_bytes)
-                                
-                                email_service.send_invoice_email(
-                                    customer_email=cust_data['email'],
-                                    customer_name=cust_data['full_name'],
-                                    invoice_data=inv_data,
-                                    company_details=company_details,
-                                    pdf_attachment_path=pdf_filename
-                                )
-                                
-                                # Clean up temp file
-                                if os.path.exists(pdf_filename):
-                                    os.remove(pdf_filename)
-                                print("--- Email Sent Successfully ---")
+                        # Stored under the same key the print and portal views will ask for
+                        _, pdf_bytes = thermal_receipt_pdf(inv_data, cust_data, company_details, emp_name)
+                        customer_receipt_pdf(inv_data, cust_data, company_details)
                     except Exception as e:
-                        print(f"Email Error: {e}")
-
-                # --- USE EXECUTOR (This prevents the 'Resource temporarily unavailable' error) ---
-                executor.submit(
-                    background_payment_tasks, 
-                    invoice, 
-                    customer, 
-                    user['company_id'], 
-                    user['employee_name']
-                )
-                # -------------------------------------------------------------------------------
+                        print(f"PDF Error: {e}")
+                        return
+                    # Hand the finished PDF over to the email pool
+                    tasks.submit('email', receipt_email_task, inv_data, cust_data, company_details, pdf_bytes)
+
+                def receipt_email_task(inv_data, cust_data, company_details, pdf_bytes):
+                    print(f"--- Sending Email to {cust_data['email']} ---")
+                    # Attached straight from memory, no temp file
+                    sent, message = email_service.send_invoice_email(
+                        customer_email=cust_data['email'],
+                        customer_name=cust_data['full_name'],
+                        invoice_data=inv_data,
+                        company_details=company_details,
+                        pdf_bytes=pdf_bytes
+                    )
+                    print("--- Email Sent Successfully ---" if sent else f"--- Email Failed: {message} ---")
+
+                try:
+                    tasks.submit('router', reactivate_task, invoice['customer_id'])
+                    if customer and customer.get('email'):
+                        # The updated row as stored, so the receipt key matches later reads
+                        tasks.submit('pdf', receipt_pdf_task, update_res.data[0], customer, user['company_id'], user['employee_name'])
+                except Exception as e:
+                    print(f"Failed to queue payment tasks: {e}")
 
                 # C. Audit Log
                 log_portal_action("Invoice Paid (Portal)",  
@@ -3642,29 +3524,13 @@ def employee_print_receipt(invoice_id):
         invoice_data = response.data
         customer_data = invoice_data.get('customers')
         
-        # 2. Generate PDF (In Memory Only)
+        # 2. Get the PDF from the store (rendered at collection time, or now)
         company_data = invoice_utils.get_isp_company_details_from_db(user['company_id'])
         
-        pdf_gen = invoice_utils.create_thermal_receipt_as_bytes(
-            invoice_data,  
-            customer_data,  
-            company_data,  
-            user['employee_name']  
-        )
-        
-        success, pdf_bytes_or_error = pdf_gen
-        if not success:
-            raise Exception(f"PDF generation failed: {pdf_bytes_or_error}")
-            
-        pdf_bytes = pdf_bytes_or_error
+        key, pdf_bytes = thermal_receipt_pdf(invoice_data, customer_data, company_data, user['employee_name'])
         
         # 3. Return the File for Printing
-        return send_file(
-            BytesIO(pdf_bytes),
-            mimetype='application/pdf',
-            as_attachment=False,  
-            download_name=f"Receipt_{invoice_data['invoice_number']}.pdf"
-        )
+        return send_pdf(key, pdf_bytes, f"Receipt_{invoice_data['invoice_number']}.pdf")
 
     except Exception as e:
         print(f"Error generating thermal receipt: {e}")
@@ -4104,6 +3970,7 @@ def speed_test_upload():
 #
 
 @app.route('/shop')
+@cached_page(arg_names=('search', 'sort_by', 'category'))
 def shop():
     """
     Shows the main e-commerce shop page, with a category sidebar,
@@ -4113,7 +3980,7 @@ def shop():
     
     # Get all filter parameters from the URL
     search_term = request.args.get('search', '').strip()
-    sort_by = request.args.get('sort_by', 'price_asc') # Default sort
+    sort_by = request.args.get('sort_by') or ('relevance' if search_term else 'price_asc') # Default sort
     category_filter_id = request.args.get('category') # The category to filter by
     
     categories = []
@@ -4131,27 +3998,20 @@ def shop():
         print(f"[DB_ERROR] /shop (Failed to load categories): {e}")
         categories = [] # Set to empty list on error
         
-    # 2. Fetch all products
+    # 2. Products from the in-memory catalog + local search index (see product_search.py)
     try:
-        query = supabase.rpc('get_products_with_reviews', {
-                'p_search_term': search_term or None
-            })
-            
-        # 3. Apply category filter if one is selected
-        if category_filter_id:
-            query = query.eq('category_id', category_filter_id)
+        # 3. Search and category filter
+        products, _ = search_index.search(search_term, category_id=category_filter_id)
             
         # 4. Apply sorting
         if sort_by == 'price_desc':
-            query = query.order('selling_price', desc=True)
+            products.sort(key=lambda p: float(p.get('selling_price') or 0), reverse=True)
         elif sort_by == 'name_asc':
-            query = query.order('name', desc=False)
+            products.sort(key=lambda p: (p.get('name') or '').lower())
+        elif sort_by == 'relevance' and search_term:
+            pass # Already ranked by the index
         else: # Default (price_asc)
-            query = query.order('selling_price', desc=False)
-
-        # 5. Execute the query
-        products_res = query.execute()
-        products = products_res.data or []
+            products.sort(key=lambda p: float(p.get('selling_price') or 0))
         
     except Exception as e:
         print(f"[DB_ERROR] /shop (Failed to load products): {e}")
@@ -4173,6 +4033,40 @@ def shop():
         category_filter_id=category_filter_id # Pass current filter
     )
 
+@app.route('/api/shop/search')
+def api_shop_search():
+    """Instant search for the shop: ranked matches plus per-category counts."""
+    query = request.args.get('q', '').strip()
+    category_id = request.args.get('category') or None
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    try:
+        results, facets = search_index.search(query, category_id=category_id, limit=limit)
+    except Exception as e:
+        print(f"[SEARCH] /api/shop/search: {e}")
+        return jsonify({"error": "Search is temporarily unavailable."}), 503
+
+    category_names = search_index.category_names()
+    return jsonify({
+        "query": query,
+        "results": [{
+            "id": p['id'],
+            "name": p.get('name'),
+            "image_url": p.get('image_url'),
+            "category_id": p.get('category_id'),
+            "selling_price": float(p.get('selling_price') or 0),
+            "final_price": calculate_final_price(p)[0],
+            "in_stock": (p.get('stock_quantity') or 0) > 0,
+            "score": p['_score'],
+            "url": url_for('product_detail', product_id=p['id'])
+        } for p in results],
+        "facets": [{"category_id": cid, "name": category_names.get(cid, ''), "count": n}
+                   for cid, n in sorted(facets.items(), key=lambda item: -item[1])]
+    })
+
 @app.route('/track-order', methods=['GET', 'POST'])
 def track_order():
     """
@@ -4255,62 +4149,27 @@ def product_checkout():
     if not cart:
         flash("Your cart is empty.", "info"); return redirect(url_for('cart'))
 
-    # Setup Data
-    shipping_cost = float(saas_settings.get('shipping_cost', 0.0))
-    subtotal = 0
-    cart_products_snapshot = []
-    product_ids = list(cart.keys())
-    fetched_products = []
-    
-    try:
-        res = supabase.rpc('get_products_with_reviews', {'p_search_term': ""}).execute()
-        if res.data: fetched_products = [p for p in res.data if str(p['id']) in product_ids]
-        if not fetched_products:
-             res_table = supabase.table('products').select('*, category_id').in_('id', product_ids).execute()
-             if res_table.data: fetched_products = res_table.data
-    except Exception as e: print(f"Data Error: {e}")
-
-    if not fetched_products:
-        flash("Items unavailable.", "error"); return redirect(url_for('cart'))
+    # Same pricing path as the cart page; this quote is the order snapshot
+    promo = session.get('promo')
+    quote = quote_session_cart(cart, promo, float(saas_settings.get('shipping_cost', 0.0)))
 
-    # Calculations
-    today_date = date.today().isoformat()
-    for product in fetched_products:
-        pid = str(product['id'])
-        if pid not in cart: continue
-        qty = cart[pid]
-        
-        op = float(product.get('selling_price', 0))
-        fp = op
-        is_discounted = False 
-        
-        start = product.get('discount_start_date') or '1970-01-01'
-        end = product.get('discount_end_date') or '2099-12-31'
-        
-        if product.get('discount_percent', 0) > 0 and start <= today_date and end >= today_date:
-            fp = op * (1 - (float(product.get('discount_percent', 0)) / 100))
-            is_discounted = True
-            
-        item_sub = fp * qty
-        subtotal += item_sub
-        
-        cart_products_snapshot.append({
-            "id": pid, "name": product.get('name'), "image_url": product.get('image_url'),
-            "quantity": qty, "subtotal": item_sub, "original_price": op,
-            "final_price_per_item": fp, "is_discounted": is_discounted,
-            "category_id": product.get('category_id')
-        })
+    if not quote.lines:
+        flash("Items unavailable.", "error"); return redirect(url_for('cart'))
     
-    # Promo Logic
-    discount_amount = 0.0
-    promo = session.get('promo')
-    promo_code_used = None
+    # Promo Logic: re-check the session promo against the cached rules (it may have expired or run out)
     if promo:
-        promo_code_used = promo['code']
-        discount_amount = subtotal * (promo['value'] / 100) if promo['type'] == 'Percentage' else promo['value']
-        if discount_amount > subtotal: discount_amount = subtotal
+        try:
+            promo_engine.validate(promo['code'], quote.lines)
+        except PromoError as e:
+            session.pop('promo', None)
+            flash(str(e), "error"); return redirect(url_for('cart'))
+        except Exception as e:
+            print(f"[PROMO] Checkout re-check failed, keeping applied promo: {e}")
 
-    total_price = max(0, subtotal + shipping_cost - discount_amount)
+    cart_products_snapshot = quote.order_items()
+    promo_code_used = quote.promo_code
+    subtotal, shipping_cost = quote.subtotal, quote.shipping_cost
+    discount_amount, total_price = quote.discount_amount, quote.total_price
 
     # --- HANDLE POST ---
     if request.method == 'POST':
@@ -4325,6 +4184,24 @@ def product_checkout():
         
         if not all([form_data['full_name'], form_data['email'], form_data['phone'], street]):
             flash("All fields required.", "error"); return redirect(url_for('product_checkout'))
+
+        # Catalog stock may be a few seconds old, so re-check the DB before taking the order
+        try:
+            short_items = check_live_stock(cart)
+        except Exception as e:
+            print(f"[DB_ERROR] /product-checkout (stock check): {e}")
+            flash("Could not verify stock. Please try again.", "error"); return redirect(url_for('cart'))
+        if short_items:
+            names = {p['id']: p['name'] for p in cart_products_snapshot}
+            for pid, wanted, available in short_items:
+                flash(f"Only {available} left of '{names.get(pid, 'an item')}' (you asked for {wanted}).", "error")
+            return redirect(url_for('cart'))
+
+        # Count the promo use before any order row exists, so usage_limit holds under concurrent checkouts
+        if promo_code_used and not promo_engine.record_usage(promo_code_used):
+            session.pop('promo', None)
+            flash(f"The promo code '{promo_code_used}' has just reached its usage limit and was removed. Please review your new total.", "error")
+            return redirect(url_for('cart'))
             
         try:
             order_num_res = supabase.rpc('generate_new_product_order_number').execute()
@@ -4375,6 +4252,7 @@ def product_checkout():
                     if res.data: session['pending_order_id'] = res.data[0]['id']
                     return redirect(response.checkout_url)
                 
+                if promo_code_used: promo_engine.release_usage(promo_code_used)
                 flash("Gateway error.", "error"); return redirect(url_for('product_checkout'))
 
             elif payment_choice == 'bkash':
@@ -4395,9 +4273,11 @@ def product_checkout():
                     else:
                         raise Exception(resp.get('statusMessage'))
                 except Exception as e:
+                    if promo_code_used: promo_engine.release_usage(promo_code_used)
                     flash(f"bKash Error: {e}", "error"); return redirect(url_for('product_checkout'))
 
         except Exception as e:
+            if promo_code_used: promo_engine.release_usage(promo_code_used)
             flash(f"Order failed: {e}", "error"); return redirect(url_for('product_checkout'))
 
     # RENDER GET
@@ -4460,9 +4340,9 @@ def product_payment_return():
         # Cleanup pending order
         try:
             if pending_order_id:
-                supabase.table('product_orders').delete().eq('id', pending_order_id).execute()
+                discard_pending_product_order(order_id=pending_order_id)
             elif order_id_from_sp:
-                supabase.table('product_orders').delete().eq('gateway_tx_id', order_id_from_sp).execute()
+                discard_pending_product_order(gateway_tx_id=order_id_from_sp)
         except: pass
         return redirect(url_for('cart'))
 
@@ -4534,7 +4414,7 @@ def product_payment_return():
         else:
             # Payment Failed
             flash(f"Payment Failed: {response.get('message')}", "error")
-            if pending_order_id: supabase.table('product_orders').delete().eq('id', pending_order_id).execute()
+            if pending_order_id: discard_pending_product_order(order_id=pending_order_id)
             return redirect(url_for('product_checkout'))
 
     except Exception as e:
@@ -4555,7 +4435,7 @@ def product_payment_cancel():
     pending_order_id = session.pop('pending_order_id', None)
     if pending_order_id:
         try:
-            supabase.table('product_orders').delete().eq('id', pending_order_id).execute()
+            discard_pending_product_order(order_id=pending_order_id)
             print(f"Deleted cancelled order {pending_order_id}.")
         except Exception as e:
             print(f"Error deleting cancelled order {pending_order_id}: {e}")
@@ -4617,7 +4497,7 @@ def _get_pathao_access_token(settings):
             "password": settings.get('courier_pathao_password', '').strip(),
             "grant_type": "password"
         }
-        res = requests.post(f"{base_url}/aladdin/api/v1/issue-token", json=payload)
+        res = http_client.post('courier', f"{base_url}/aladdin/api/v1/issue-token", json=payload, idempotent=True)
         return res.json().get('access_token')
     except:
         return None
@@ -4637,7 +4517,7 @@ def fetch_live_courier_status(order, settings):
                 "Api-Key": settings.get('courier_steadfast_api_key', '').strip(),
                 "Secret-Key": settings.get('courier_steadfast_secret_key', '').strip()
             }
-            res = requests.get(url, headers=headers)
+            res = http_client.get('courier', url, headers=headers)
             data = res.json()
             if data.get('status') == 200:
                 return data.get('delivery_status', 'Unknown').capitalize()
@@ -4654,7 +4534,7 @@ def fetch_live_courier_status(order, settings):
                     "Content-Type": "application/json",
                     "Accept": "application/json"
                 }
-                res = requests.get(url, headers=headers)
+                res = http_client.get('courier', url, headers=headers)
                 if res.status_code == 200:
                     data = res.json().get('data', {})
                     status = data.get('order_status', 'Unknown')
@@ -4843,7 +4723,7 @@ def bkash_product_callback():
     if not payment_id or status != 'success':
         flash("Payment failed.", "error")
         if pending_order_id:
-            supabase.table('product_orders').delete().eq('id', pending_order_id).execute()
+            discard_pending_product_order(order_id=pending_order_id)
         return redirect(url_for('cart'))
 
     saas_settings = get_saas_settings()
@@ -4897,7 +4777,7 @@ def bkash_product_callback():
         else:
             flash(f"Verification failed: {resp.get('statusMessage')}", "error")
             if pending_order_id:
-                supabase.table('product_orders').delete().eq('id', pending_order_id).execute()
+                discard_pending_product_order(order_id=pending_order_id)
             return redirect(url_for('cart'))
             
     except Exception as e:
@@ -5024,8 +4904,101 @@ def admin_health_page():
         "env": "Production" if os.environ.get("FLASK_DEBUG") != '1' else "Debug/Dev"
     }
 
+    # 5. Settings Cache
+    health_data['settings_cache'] = get_saas_settings_cache_stats()
+
+    health_data['page_cache'] = page_cache_stats()
+    health_data['pdf_render'] = invoice_utils.render_cache_stats()
+    health_data['pdf_store'] = pdf_store.stats_snapshot()
+
+    # 6. Outbound API latency (per host, since this worker started)
+    health_data['outbound'] = http_client.latency_stats()
+
+    # 7. Background task pools
+    health_data['task_pools'] = tasks.stats()
+
+    # 8. Scheduler leadership and recent runs
+    health_data['scheduler'] = {
+        "is_leader": leader.is_leader(),
+        "leader_pid": leader.leader_pid(),
+        "worker_pid": os.getpid(),
+    }
+    try:
+        runs = leader.recent_runs(limit=10)
+        for run in runs:
+            run['started'] = datetime.fromtimestamp(run['started_at'], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        health_data['scheduler']['runs'] = runs
+    except Exception as e:
+        print(f"Health Check Scheduler Error: {e}")
+        health_data['scheduler']['runs'] = []
+
+    # 9. Background job queue
+    try:
+        health_data['jobs'] = jobs.counts()
+    except Exception as e:
+        print(f"Health Check Jobs Error: {e}")
+        health_data['jobs'] = {}
+
+    # 10. Outbound mail queue
+    try:
+        health_data['mail'] = mailer.counts()
+    except Exception as e:
+        print(f"Health Check Mail Error: {e}")
+        health_data['mail'] = {}
+    health_data['mail_transport'] = mailer.transport.name
+
     return render_template('admin_health.html', health=health_data)
 
+@app.route('/admin/settings/refresh', methods=['POST'])
+@employee_login_required
+def refresh_saas_settings():
+    """Drops this worker's cached SaaS settings after an admin edits them."""
+    invalidate_saas_settings()
+    catalog.invalidate()
+    invalidate_pages()
+    invoice_utils.invalidate_logo()
+    company_profiles.invalidate()  # Also clears the email branding (listener below)
+    flash("Settings cache cleared.", "success")
+    return redirect(url_for('admin_health_page'))
+
+@app.route('/admin/jobs')
+@employee_login_required
+def admin_jobs_page():
+    """Dead-letter view for background jobs that ran out of retries."""
+    status = request.args.get('status', 'dead')
+    if status not in ('dead', 'pending', 'running', 'done'):
+        status = 'dead'
+    return render_template('admin_jobs.html',
+                           jobs=jobs.list_jobs(status=status),
+                           counts=jobs.counts(),
+                           status=status,
+                           failed_mail=mailer.recent(status='failed', limit=50))
+
+@app.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@employee_login_required
+def admin_retry_job(job_id):
+    if jobs.retry(job_id):
+        flash(f"Job #{job_id} queued for retry.", "success")
+    else:
+        flash(f"Job #{job_id} is not in the dead-letter list.", "error")
+    return redirect(url_for('admin_jobs_page'))
+
+@app.route('/admin/mail/<int:mail_id>/retry', methods=['POST'])
+@employee_login_required
+def admin_retry_mail(mail_id):
+    if mailer.retry(mail_id):
+        flash(f"Email #{mail_id} queued for retry.", "success")
+    else:
+        flash(f"Email #{mail_id} has not failed.", "error")
+    return redirect(url_for('admin_jobs_page'))
+
+@app.route('/admin/jobs/<int:job_id>/discard', methods=['POST'])
+@employee_login_required
+def admin_discard_job(job_id):
+    if jobs.discard(job_id):
+        flash(f"Job #{job_id} discarded.", "info")
+    return redirect(url_for('admin_jobs_page'))
+
 # --- ADD TO app.py ---
 
 @app.route('/admin/maintenance')
@@ -5275,15 +5248,29 @@ def track_visitor():
         user_id = session.get('user', {}).get('id') if 'user' in session else None
         
         # 2. Log IP AND User Agent (Fixes Phone+Laptop showing as 1)
-        supabase.table('portal_analytics').insert({
+        # Queued and bulk-inserted in the background (see analytics_writer.py)
+        visitor_writer.record({
             'ip_address': request.remote_addr,
             'user_agent': request.headers.get('User-Agent', 'Unknown'), # <--- NEW
             'path': request.path,
             'user_id': str(user_id) if user_id else None
-        }).execute()
+        })
     except Exception:
         pass
 
+@app.after_request
+def report_request_memo(response):
+    """In debug mode, reports how many DB lookups the request memo saved."""
+    if app.debug:
+        avoided = queries_avoided()
+        response.headers['X-Queries-Avoided'] = str(avoided)
+        if avoided:
+            print(f"[REQUEST_CACHE] {request.path}: {avoided} queries avoided")
+    return response
+
+
+# Every @jobs.handler is registered by now; start the job workers
+jobs.start()
 
 if __name__ == '__main__':
 
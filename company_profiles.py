@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from postgrest.exceptions import APIError
+from database import supabase
+
+# --- Company Profile Cache ---
+# invoice_utils (PDFs and emails), login and the WhatsApp button each read
+# 'isp_companies' with their own column list, and the invoice path re-cleaned
+# every string on each call. A company's details change rarely but are read on
+# nearly every request, so each worker now loads one record per company_id,
+# cleans it once, and keeps it for COMPANY_PROFILE_TTL seconds.
+#
+#   profile = company_profiles.get(company_id)   # CompanyProfile, or None if the company doesn't exist
+#   details = profile.invoice_details()          # cleaned dict for invoice_utils / email_service
+#
+# Only branding and contact columns are loaded. Payment gateway credentials,
+# router credentials and SLA config stay with the code that needs them.
+# Call company_profiles.invalidate(company_id) after editing a company (or with
+# no argument for all of them); listeners registered with add_listener() are
+# told, so derived caches (e.g. email branding) can drop their copies too.
+
+COMPANY_PROFILE_TTL = float(os.environ.get('COMPANY_PROFILE_TTL', 300))
+MISSING_COMPANY_TTL = float(os.environ.get('MISSING_COMPANY_TTL', 30))
+PROFILE_COLUMNS = 'id, company_name, logo_url, social_media_links, company_details, payment_info, developer_logo_url, contact_phone'
+
+
+def clean_string(s, default=''):
+    """
+    Forcefully cleans a string by stripping whitespace and removing
+    any non-ASCII characters that can corrupt email headers.
+    """
+    if s is None:
+        return default
+    try:
+        # Encode to ASCII, ignoring errors, then decode back.
+        # This strips all non-ASCII chars. Then strip whitespace.
+        return s.encode('ascii', 'ignore').decode('ascii').strip()
+    except Exception:
+        # Fallback for any other error
+        return str(s).strip()
+
+
+class CompanyProfile:
+    __slots__ = ('id', 'company_name', 'logo_url', 'social_media_links', 'company_details',
+                 'payment_info', 'developer_logo_url', 'support_phone', '_invoice_details')
+
+    def __init__(self, company_id, row):
+        company_info = row.get('company_details') or {}
+        self.id = company_id
+        self.company_name = row.get('company_name')
+        self.logo_url = row.get('logo_url')
+        self.social_media_links = row.get('social_media_links')
+        self.company_details = company_info
+        self.payment_info = row.get('payment_info')
+        self.developer_logo_url = row.get('developer_logo_url')
+
+        # Digits only, for wa.me links (remove + - ( ) spaces)
+        raw_phone = row.get('contact_phone')
+        self.support_phone = ''.join(filter(str.isdigit, str(raw_phone))) if raw_phone else None
+
+        company_name_cleaned = clean_string(self.company_name, 'N/A')
+        self._invoice_details = {
+            "company_id": company_id,
+            "company_name": company_name_cleaned,
+            "address": clean_string(company_info.get('address'), 'N/A'),
+            "phone": clean_string(company_info.get('phone'), 'N/A'),
+            "email": clean_string(company_info.get('email'), 'N/A'),
+            "logo_path": self.logo_url,
+            "payment_info": clean_string(self.payment_info, ''),
+            "smtp_host": clean_string(company_info.get('smtp_host'), None),
+            "smtp_port": company_info.get('smtp_port', 587),
+            "smtp_user": clean_string(company_info.get('smtp_user'), None),
+            "smtp_pass": clean_string(company_info.get('smtp_pass'), None),
+            "sender_name": company_name_cleaned
+        }
+
+    def invoice_details(self):
+        """The cleaned details used for PDFs and emails (a fresh copy each call)."""
+        return dict(self._invoice_details)
+
+    def session_fields(self):
+        """The company part of a logged-in user's session."""
+        return {
+            'company_name': self.company_name or 'Your ISP',
+            'company_logo': self.logo_url,
+            'social_media': self.social_media_links,
+            'company_details': self.company_details,
+            'payment_info': self.payment_info,
+            'developer_logo': self.developer_logo_url
+        }
+
+
+class CompanyProfiles:
+    def __init__(self, ttl=COMPANY_PROFILE_TTL):
+        self.ttl = ttl
+        self._entries = {}  # company_id -> (expires_at, CompanyProfile or None)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.stats = {"hits": 0, "loads": 0, "errors": 0, "stale_served": 0}
+
+    def _load(self, company_id):
+        try:
+            res = supabase.table('isp_companies').select(PROFILE_COLUMNS)\
+                .eq('id', company_id).maybe_single().execute()
+        except APIError as e:
+            if "Missing response" in (e.message or ''):
+                return None
+            raise
+        if res and res.data:
+            return CompanyProfile(company_id, res.data)
+        return None
+
+    def get(self, company_id):
+        """Returns the CompanyProfile for `company_id`, or None if there is no such company."""
+        if not company_id:
+            return None
+        key = str(company_id)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            self.stats["hits"] += 1
+            return entry[1]
+
+        try:
+            profile = self._load(company_id)
+        except Exception as e:
+            self.stats["errors"] += 1
+            if entry:
+                # Database hiccup: a slightly stale profile beats failing the page
+                self.stats["stale_served"] += 1
+                print(f"[COMPANY] Reload of {company_id} failed, serving cached copy: {e}")
+                return entry[1]
+            raise
+
+        self.stats["loads"] += 1
+        ttl = self.ttl if profile is not None else MISSING_COMPANY_TTL
+        with self._lock:
+            self._entries[key] = (now + ttl, profile)
+        return profile
+
+    def add_listener(self, callback):
+        """Registers callback(company_id) to run on invalidation (company_id is None for 'all')."""
+        self._listeners.append(callback)
+
+    def invalidate(self, company_id=None):
+        with self._lock:
+            if company_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(company_id), None)
+        for callback in self._listeners:
+            try:
+                callback(company_id)
+            except Exception as e:
+                print(f"[COMPANY] Invalidation listener failed: {e}")
+
+    def stats_snapshot(self):
+        stats = dict(self.stats)
+        stats["entries"] = len(self._entries)
+        return stats
+
+
+company_profiles = CompanyProfiles()
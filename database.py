@@ -1,4 +1,6 @@
 import os
+import time
+import threading
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -15,17 +17,85 @@ supabase: Client = create_client(url, key)
 # This is the single, fixed ID for the SaaS settings row
 SAAS_SETTINGS_ID = "11111111-1111-1111-1111-111111111111"
 
-# --- NEW FUNCTION ---
+# --- SaaS Settings Cache ---
+# saas_settings is read on almost every public page, but only changes when an
+# admin edits it. We keep one copy per worker process for a short TTL.
+SAAS_SETTINGS_TTL = float(os.environ.get("SAAS_SETTINGS_TTL", 60))
+
+_settings_lock = threading.Lock()
+_settings_cache = {
+    "data": None,        # Last good settings row
+    "fetched_at": 0.0,   # time.monotonic() of the last successful fetch
+    "version": 0,        # Bumped every time the cached row changes
+}
+_settings_stats = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+
+def _fetch_saas_settings():
+    """Reads the settings row straight from the database (no caching)."""
+    # This table is public, so it can be read before login.
+    res = supabase.table('saas_settings').select('*').eq('id', SAAS_SETTINGS_ID).maybe_single().execute()
+    if res and res.data:
+        return res.data
+    return {}
+
+
+def _settings_fresh(now):
+    return (_settings_cache["data"] is not None and
+            now - _settings_cache["fetched_at"] < SAAS_SETTINGS_TTL)
+
+
 def get_saas_settings():
     """
     Fetches the global SaaS Admin settings (logo, contact, payment info).
+    Served from a per-process cache; only one thread refreshes it after expiry.
     """
-    try:
-        # This table is public, so it can be read before login.
-        res = supabase.table('saas_settings').select('*').eq('id', SAAS_SETTINGS_ID).maybe_single().execute()
-        if res.data:
-            return res.data
-        return {}
-    except Exception as e:
-        print(f"[DB_ERROR] get_saas_settings: {e}")
-        return {}
\ No newline at end of file
+    now = time.monotonic()
+    if _settings_fresh(now):
+        _settings_stats["hits"] += 1
+        return dict(_settings_cache["data"])
+
+    # Single-flight: the first thread refreshes, the rest wait and re-use its result.
+    with _settings_lock:
+        now = time.monotonic()
+        if _settings_fresh(now):
+            _settings_stats["hits"] += 1
+            return dict(_settings_cache["data"])
+
+        _settings_stats["misses"] += 1
+        try:
+            data = _fetch_saas_settings()
+            _settings_stats["refreshes"] += 1
+            if data != _settings_cache["data"]:
+                _settings_cache["version"] += 1
+            _settings_cache["data"] = data
+            _settings_cache["fetched_at"] = now
+            return dict(data)
+        except Exception as e:
+            _settings_stats["errors"] += 1
+            print(f"[DB_ERROR] get_saas_settings: {e}")
+            # Serve the stale copy rather than breaking every page
+            if _settings_cache["data"] is not None:
+                return dict(_settings_cache["data"])
+            return {}
+
+
+def invalidate_saas_settings():
+    """Drops the cached settings so the next call re-reads the database.
+    Call this from any code path that writes to saas_settings."""
+    with _settings_lock:
+        _settings_cache["fetched_at"] = 0.0
+    print("[CACHE] saas_settings invalidated.")
+
+
+def get_saas_settings_version():
+    """Returns a counter that changes whenever the cached settings change."""
+    return _settings_cache["version"]
+
+
+def get_saas_settings_cache_stats():
+    """Returns hit/miss counters for the settings cache."""
+    stats = dict(_settings_stats)
+    stats["ttl"] = SAAS_SETTINGS_TTL
+    stats["age"] = round(time.monotonic() - _settings_cache["fetched_at"], 1) if _settings_cache["data"] is not None else None
+    return stats
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import html
+import hashlib
+import datetime
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+
+# --- Email Templates ---
+# Email HTML used to be assembled with f-strings on every send: the whole
+# branded document in _get_html_template, plus a string concatenation per item
+# row for order confirmations. Bodies now live in templates/emails/*.html and
+# are compiled once per worker by a dedicated Jinja environment (auto_reload
+# off, so a compiled template is never re-checked against the file). Each body
+# extends emails/layout.html, so an email is rendered in one pass; arbitrary
+# HTML bodies go through render_layout().
+#
+# The branded chrome - logo header, social bar and footer - only depends on the
+# company details, so it is rendered once per company and kept in a small LRU
+# keyed by a hash of the branding fields. Edited details hash to a new key; the
+# old entry just ages out (or call invalidate_branding()).
+#
+#   html = render_email('emails/ticket_status.html', company_details, title, preheader, ticket_number=...)
+#
+# Values are autoescaped, so customer-supplied names and ticket text can't break the markup.
+#
+# Order item rows are the exception: a per-item loop through autoescaped
+# subscripts cost about twice the old f-string. order_item_rows() builds each
+# <tr> with an f-string instead, escaping only the string fields (numbers can't
+# carry markup), and keeps the finished rows in an LRU keyed by the row's
+# values, so a product that sells repeatedly is formatted once per worker.
+# Run `python email_templates_bench.py` to time it against the old f-string path.
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+BRANDING_CACHE_SIZE = int(os.environ.get('EMAIL_BRANDING_CACHE_SIZE', 256))
+BRANDING_CACHE_TTL = float(os.environ.get('EMAIL_BRANDING_CACHE_TTL', 3600))
+ITEM_ROW_CACHE_SIZE = int(os.environ.get('EMAIL_ITEM_ROW_CACHE_SIZE', 4096))
+ITEM_PLACEHOLDER_IMAGE = 'https://via.placeholder.com/60'
+
+# Social link keys from saas_settings ('social_media') and from clients ('social_media_links')
+SOCIAL_ICONS = {
+    'facebook_url': 'https://img.icons8.com/color/32/000000/facebook-new.png',
+    'youtube_url': 'https://img.icons8.com/color/32/000000/youtube-play.png',
+    'linkedin_url': 'https://img.icons8.com/color/32/000000/linkedin.png',
+    'social_facebook': 'https://img.icons8.com/color/32/000000/facebook-new.png',
+    'social_youtube': 'https://img.icons8.com/color/32/000000/youtube-play.png',
+    'social_linkedin': 'https://img.icons8.com/color/32/000000/linkedin.png'
+}
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+    cache_size=-1  # Keep every compiled email template for the life of the worker
+)
+
+_branding_cache = OrderedDict()  # key -> (rendered_at, branding dict)
+_branding_lock = threading.Lock()
+stats = {"branding_hits": 0, "branding_renders": 0, "renders": 0}
+
+
+def _branding_fields(company_details):
+    """
+    Smart key finding: reads saas_settings keys (for admin) OR company_details keys (for clients).
+    Doesn't modify the caller's dict.
+    """
+    social_links = company_details.get('social_media', company_details.get('social_media_links', {})) or {}
+    return {
+        "logo_url": company_details.get('saas_logo_url', company_details.get('logo_path')),
+        "company_name": company_details.get('app_name', company_details.get('company_name', 'Your ISP')),
+        "company_phone": company_details.get('contact_phone', company_details.get('phone', '')),
+        "company_email": company_details.get('contact_email', company_details.get('email', '')),
+        "company_address": company_details.get('contact_address', company_details.get('address', '')),
+        "social_links": [
+            {"url": social_links[key], "icon": icon, "name": key.split('_')[0].capitalize()}
+            for key, icon in SOCIAL_ICONS.items() if social_links.get(key)
+        ],
+        "year": datetime.datetime.now().year,
+    }
+
+
+def branding_for(company_details):
+    """Returns {'header': Markup, 'footer': Markup} for a company, rendered once and cached."""
+    fields = _branding_fields(company_details)
+    key = hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    now = time.monotonic()
+
+    with _branding_lock:
+        entry = _branding_cache.get(key)
+        if entry and now - entry[0] < BRANDING_CACHE_TTL:
+            _branding_cache.move_to_end(key)
+            stats["branding_hits"] += 1
+            return entry[1]
+
+    branding = {
+        "header": Markup(env.get_template('emails/_header.html').render(fields)),
+        "footer": Markup(env.get_template('emails/_footer.html').render(fields)),
+    }
+    with _branding_lock:
+        _branding_cache[key] = (now, branding)
+        _branding_cache.move_to_end(key)
+        while len(_branding_cache) > BRANDING_CACHE_SIZE:
+            _branding_cache.popitem(last=False)
+        stats["branding_renders"] += 1
+    return branding
+
+
+def invalidate_branding():
+    """Drops every cached header/footer (e.g. after company or SaaS settings are edited)."""
+    with _branding_lock:
+        _branding_cache.clear()
+
+
+def render_layout(company_details, title, preheader, body_html):
+    """Wraps already-rendered body HTML in the branded email document."""
+    stats["renders"] += 1
+    return env.get_template('emails/layout.html').render(
+        title=title,
+        preheader=preheader,
+        body=Markup(body_html),
+        branding=branding_for(company_details)
+    )
+
+
+def render_email(template_name, company_details, title, preheader, **context):
+    """Renders an email template (one that extends emails/layout.html) in a single pass."""
+    stats["renders"] += 1
+    return env.get_template(template_name).render(
+        title=title,
+        preheader=preheader,
+        branding=branding_for(company_details),
+        **context
+    )
+
+
+def _cell(value):
+    # Numbers can't carry markup; anything else (names, URLs, numeric strings, None) is escaped
+    if isinstance(value, str):
+        return html.escape(value)
+    if isinstance(value, (int, float)):
+        return str(value)
+    return html.escape(str(value))
+
+
+@lru_cache(maxsize=ITEM_ROW_CACHE_SIZE, typed=True)
+def _order_item_row(image_url, name, unit_price, quantity, subtotal):
+    return f"""
+            <tr>
+                <td style="padding: 12px 0; border-bottom: 1px solid #eee; width: 60px;">
+                    <img src="{_cell(image_url) if image_url else ITEM_PLACEHOLDER_IMAGE}" alt="Product" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px; border: 1px solid #eee;">
+                </td>
+                <td style="padding: 12px 10px; border-bottom: 1px solid #eee;">
+                    <p style="margin: 0; font-weight: 600; color: #333;">{_cell(name)}</p>
+                    <p style="margin: 2px 0 0 0; color: #888; font-size: 12px;">Unit Price: {_cell(unit_price or 0)} BDT</p>
+                </td>
+                <td style="padding: 12px 10px; border-bottom: 1px solid #eee; text-align: center;">x{_cell(quantity)}</td>
+                <td style="padding: 12px 0; border-bottom: 1px solid #eee; text-align: right; font-weight: 600;">{_cell(subtotal)} BDT</td>
+            </tr>"""
+
+
+def order_item_rows(items):
+    """The <tr> rows for an order's items, as Markup for the 'item_rows' template variable."""
+    return Markup(''.join(
+        _order_item_row(
+            item.get('image_url'), item.get('name'), item.get('final_price_per_item'),
+            item.get('quantity'), item.get('subtotal')
+        )
+        for item in items
+    ))
+
+
+def cache_stats():
+    snapshot = dict(stats)
+    snapshot["branding_entries"] = len(_branding_cache)
+    rows = _order_item_row.cache_info()
+    snapshot["item_row_hits"] = rows.hits
+    snapshot["item_row_misses"] = rows.misses
+    snapshot["item_row_entries"] = rows.currsize
+    return snapshot
+
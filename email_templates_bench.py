@@ -0,0 +1,262 @@
+import os
+import timeit
+import datetime
+import email_templates
+from email_templates import render_email, order_item_rows
+
+# --- Email Rendering Benchmark ---
+# Times a 50-item product order confirmation three ways:
+#
+#   legacy f-string   the code email_service used before email_templates (copied below,
+#                     minus one unused local)
+#   template, cold    render_email() with the item row cache emptied before every render
+#   template, warm    render_email() with the rows already cached (repeat products)
+#
+#   python email_templates_bench.py         (EMAIL_BENCH_RUNS=2000 by default)
+#
+# The template path escapes customer-supplied values; the legacy path does not.
+# With the row cache cold that costs roughly a third more than the legacy code
+# (measured 15-40% on a noisy box); once the rows are cached it is ~40% faster.
+
+WEB_PORTAL_URL = "https://hudaitsolutions.onrender.com"
+
+
+def legacy_html_template(company_details, title, preheader, body_content):
+    """email_service._get_html_template as it was before email_templates."""
+    
+    # --- Smart key finding ---
+    logo_url = company_details.get('saas_logo_url', company_details.get('logo_path'))
+    company_name = company_details.get('app_name', company_details.get('company_name', 'Your ISP'))
+    company_phone = company_details.get('contact_phone', company_details.get('phone', ''))
+    company_email = company_details.get('contact_email', company_details.get('email', ''))
+    company_address = company_details.get('contact_address', company_details.get('address', ''))
+    
+    # Use 'social_media' from saas_settings, or 'social_media_links' from client
+    social_links = company_details.get('social_media', company_details.get('social_media_links', {})) 
+    if social_links is None:
+        social_links = {}
+    
+    social_html = ""
+    # Check for both key formats
+    platforms = {
+        'facebook_url': 'https://img.icons8.com/color/32/000000/facebook-new.png',
+        'youtube_url': 'https://img.icons8.com/color/32/000000/youtube-play.png',
+        'linkedin_url': 'https://img.icons8.com/color/32/000000/linkedin.png',
+        'social_facebook': 'https://img.icons8.com/color/32/000000/facebook-new.png',
+        'social_youtube': 'https://img.icons8.com/color/32/000000/youtube-play.png',
+        'social_linkedin': 'https://img.icons8.com/color/32/000000/linkedin.png'
+    }
+    
+    for key, icon in platforms.items():
+        url = social_links.get(key)
+        if url:
+            platform_name = key.split('_')[0].capitalize()
+            # Add to social_html and remove the found key to avoid duplicates
+            social_html += f'<a href="{url}" style="text-decoration: none; margin: 0 8px;" target="_blank"><img src="{icon}" alt="{platform_name}" style="width: 32px; height: 32px; border: 0;"></a>'
+            if key in social_links: social_links.pop(key) 
+
+    # Build Header with a clean white background
+    logo_html = ""
+    if logo_url:
+        logo_html = f"""
+        <tr>
+            <td style="background-color: #ffffff; padding: 30px 20px 20px 20px; text-align: center;">
+                <img src="{logo_url}" alt="{company_name} Logo" style="max-height: 70px; width: auto; border: 0;">
+            </td>
+        </tr>
+        """
+    else:
+        logo_html = f"""
+        <tr>
+            <td style="background-color: #ffffff; padding: 20px; text-align: center;">
+                <h1 style="color: #5A67D8; margin: 0; font-family: Arial, sans-serif;">{company_name}</h1>
+            </td>
+        </tr>
+        """
+
+    # Build Footer
+    footer_content = f"""
+    <td style="padding: 30px; text-align: center; color: #888888; font-size: 12px; background-color: #f8faff; border-top: 1px solid #e2e8f0;">
+        <div class="social-bar" style="margin-top: 15px; margin-bottom: 15px;"> {social_html} </div>
+        <p style="margin: 5px 0; color: #5a657d;">&copy; {datetime.datetime.now().year} {company_name}. All rights reserved.</p>
+        <p style="margin: 5px 0; color: #5a657d;">{company_address}</p>
+        <p style="margin: 5px 0; color: #5a657d;">{company_phone} | {company_email}</p>
+        <p style="color: #aaa; margin-top: 10px;">Powered by Huda IT Solutions</p>
+    </td>
+    """
+
+    return f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head> <meta charset="UTF-8"> <meta name="viewport" content="width=device-width, initial-scale=1.0"> <title>{title}</title> </head>
+    <body style="margin: 0; padding: 0; background-color: #f8faff; width: 100%;" bgcolor="#f8faff">
+        <div style="display:none;font-size:1px;color:#f8faff;line-height:1px;max-height:0px;max-width:0px;opacity:0;overflow:hidden;">
+            {preheader}
+        </div>
+        <table width="100%" border="0" cellpadding="0" cellspacing="0" bgcolor="#f8faff" style="width: 100%; background-color: #f8faff; padding: 20px 0;">
+            <tr> <td align="center">
+                <table width="600" border="0" cellpadding="0" cellspacing="0" style="width: 100%; max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 12px; overflow: hidden; font-family: Arial, sans-serif; border: 1px solid #e2e8f0; box-shadow: 0 4px 12px rgba(0,0,0,0.05);">
+                    
+                    {logo_html}
+                    
+                    <tr><td style="padding: 30px 40px; color: #2d3748; line-height: 1.7; font-size: 16px;">
+                        {body_content}
+                    </td></tr>
+                    
+                    <tr>{footer_content}</tr>
+                </table>
+            </td> </tr>
+        </table>
+    </body> </html>
+    """
+
+
+def legacy_order_confirmation(saas_settings, customer_details, order_number, order_items, total_amount, shipping_cost, discount_amount, payment_details=None):
+    """The old f-string body of send_product_order_confirmation_customer; returns the HTML."""
+    title = f"Order Confirmation #{order_number}"
+    preheader = f"Your order #{order_number} has been placed successfully."
+    
+    # --- 1. Dynamic Status & Payment Info ---
+    if payment_details:
+        payment_method = payment_details.get('method', 'Online Payment')
+        payment_badge = '<span style="background-color: #def7ec; color: #03543f; padding: 4px 12px; border-radius: 50px; font-size: 12px; font-weight: bold; border: 1px solid #bcf0da;">PAID</span>'
+    else:
+        payment_method = "Cash on Delivery"
+        payment_badge = '<span style="background-color: #fff8f1; color: #9c4221; padding: 4px 12px; border-radius: 50px; font-size: 12px; font-weight: bold; border: 1px solid #fce9d8;">PENDING PAYMENT</span>'
+
+    # --- 2. Tracking Link ---
+    track_url = f"{WEB_PORTAL_URL}/product-order-status/{order_number}"
+
+    # --- 3. Build Items Table Rows ---
+    items_html = ""
+    for item in order_items:
+        # Check if item has an image, else use placeholder
+        img_src = item.get('image_url') or "https://via.placeholder.com/60"
+        
+        items_html += f"""
+        <tr>
+            <td style="padding: 12px 0; border-bottom: 1px solid #eee; width: 60px;">
+                <img src="{img_src}" alt="Product" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px; border: 1px solid #eee;">
+            </td>
+            <td style="padding: 12px 10px; border-bottom: 1px solid #eee;">
+                <p style="margin: 0; font-weight: 600; color: #333;">{item.get('name')}</p>
+                <p style="margin: 2px 0 0 0; color: #888; font-size: 12px;">Unit Price: {item.get('final_price_per_item', 0)} BDT</p>
+            </td>
+            <td style="padding: 12px 10px; border-bottom: 1px solid #eee; text-align: center;">x{item.get('quantity')}</td>
+            <td style="padding: 12px 0; border-bottom: 1px solid #eee; text-align: right; font-weight: 600;">{item.get('subtotal')} BDT</td>
+        </tr>
+        """
+
+    # --- 4. Professional HTML Body ---
+    body = f"""
+    <div style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;">
+        
+        <h2 style="color: #2d3748; margin-top: 0;">Order Confirmed!</h2>
+        <p style="color: #4a5568; font-size: 16px;">Hi {customer_details.get('full_name')},</p>
+        <p style="color: #4a5568;">We're getting your order ready to be shipped. We will notify you when it has been sent.</p>
+
+        <div style="text-align: center; margin: 30px 0;">
+            <a href="{track_url}" style="background-color: #5A67D8; color: #ffffff; padding: 14px 28px; text-decoration: none; border-radius: 6px; font-weight: bold; font-size: 16px; display: inline-block; box-shadow: 0 4px 6px rgba(90, 103, 216, 0.3);">
+                Track Your Order
+            </a>
+            <p style="margin-top: 10px; font-size: 13px; color: #718096;">or visit: <a href="{track_url}" style="color: #5A67D8;">{track_url}</a></p>
+        </div>
+
+        <table width="100%" cellpadding="0" cellspacing="0" style="margin-bottom: 25px; background-color: #f7fafc; border-radius: 8px; padding: 15px;">
+            <tr>
+                <td width="50%" valign="top" style="padding-right: 15px;">
+                    <p style="font-size: 12px; color: #718096; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 5px; font-weight: bold;">Order Details</p>
+                    <p style="margin: 0 0 5px 0; color: #2d3748;"><b>Order #:</b> {order_number}</p>
+                    <p style="margin: 0 0 5px 0; color: #2d3748;"><b>Date:</b> {datetime.datetime.now().strftime('%d %b, %Y')}</p>
+                    <p style="margin: 0; color: #2d3748;"><b>Payment:</b> {payment_method}</p>
+                    <div style="margin-top: 8px;">{payment_badge}</div>
+                </td>
+                <td width="50%" valign="top" style="border-left: 1px solid #e2e8f0; padding-left: 15px;">
+                    <p style="font-size: 12px; color: #718096; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 5px; font-weight: bold;">Customer Info</p>
+                    <p style="margin: 0 0 5px 0; color: #2d3748;"><b>{customer_details.get('full_name')}</b></p>
+                    <p style="margin: 0 0 5px 0; color: #4a5568; font-size: 14px;">📞 {customer_details.get('phone')}</p>
+                    <p style="margin: 0; color: #4a5568; font-size: 14px;">📍 {customer_details.get('address')}</p>
+                </td>
+            </tr>
+        </table>
+
+        <h3 style="color: #2d3748; border-bottom: 2px solid #edf2f7; padding-bottom: 10px; margin-top: 30px;">Order Summary</h3>
+        <table width="100%" cellpadding="0" cellspacing="0" style="width: 100%; border-collapse: collapse;">
+            <thead>
+                <tr>
+                    <th align="left" style="padding: 10px 0; color: #718096; font-size: 12px; text-transform: uppercase;">Item</th>
+                    <th align="left" style="padding: 10px 10px; color: #718096; font-size: 12px; text-transform: uppercase;">Details</th>
+                    <th align="center" style="padding: 10px 10px; color: #718096; font-size: 12px; text-transform: uppercase;">Qty</th>
+                    <th align="right" style="padding: 10px 0; color: #718096; font-size: 12px; text-transform: uppercase;">Price</th>
+                </tr>
+            </thead>
+            <tbody>
+                {items_html}
+            </tbody>
+        </table>
+
+        <table width="100%" cellpadding="0" cellspacing="0" style="margin-top: 20px;">
+            <tr>
+                <td align="right" style="padding: 5px 0; color: #718096;">Subtotal:</td>
+                <td align="right" style="padding: 5px 0; width: 100px; color: #2d3748; font-weight: 500;">{(total_amount - shipping_cost + discount_amount):.2f} BDT</td>
+            </tr>
+            <tr>
+                <td align="right" style="padding: 5px 0; color: #718096;">Shipping:</td>
+                <td align="right" style="padding: 5px 0; color: #2d3748; font-weight: 500;">{shipping_cost:.2f} BDT</td>
+            </tr>
+            <tr>
+                <td align="right" style="padding: 5px 0; color: #e53e3e;">Discount:</td>
+                <td align="right" style="padding: 5px 0; color: #e53e3e; font-weight: 500;">-{discount_amount:.2f} BDT</td>
+            </tr>
+            <tr>
+                <td align="right" style="padding: 10px 0; border-top: 2px solid #edf2f7; color: #2d3748; font-size: 16px; font-weight: bold;">Total:</td>
+                <td align="right" style="padding: 10px 0; border-top: 2px solid #edf2f7; color: #5A67D8; font-size: 18px; font-weight: bold;">{total_amount:.2f} BDT</td>
+            </tr>
+        </table>
+
+    </div>
+    """
+    
+    return legacy_html_template(saas_settings, title, preheader, body)
+
+def main():
+    company = {
+        'company_name': 'Demo ISP', 'logo_path': 'https://example.com/logo.png',
+        'phone': '01700000000', 'email': 'support@example.com', 'address': 'Dhaka',
+        'social_media_links': {'social_facebook': 'https://facebook.com/demo'}, 'sender_name': 'Demo ISP'
+    }
+    customer = {'full_name': 'Customer', 'phone': '01800000000', 'address': 'Dhaka'}
+    items = [{
+        'name': f'Product {i}', 'image_url': None, 'quantity': 2,
+        'final_price_per_item': 100.0 + i, 'subtotal': 2 * (100.0 + i)
+    } for i in range(50)]
+    total = sum(item['subtotal'] for item in items) + 60
+
+    def legacy():
+        # The old template popped found social keys off the caller's dict, so hand it a copy
+        details = dict(company, social_media_links=dict(company['social_media_links']))
+        return legacy_order_confirmation(details, customer, 'ORD-1', items, total, 60.0, 0.0)
+
+    def template():
+        return render_email(
+            'emails/product_order_confirmation.html', company, 'Order Confirmation #ORD-1',
+            'Your order #ORD-1 has been placed successfully.',
+            customer=customer, order_number='ORD-1', order_date=datetime.datetime.now().strftime('%d %b, %Y'),
+            track_url=f"{WEB_PORTAL_URL}/product-order-status/ORD-1", payment_method='Cash on Delivery',
+            paid=False, item_rows=order_item_rows(items),
+            total_amount=total, shipping_cost=60.0, discount_amount=0.0
+        )
+
+    def template_cold():
+        email_templates._order_item_row.cache_clear()
+        return template()
+
+    template()  # Compile the templates and fill the branding cache first
+    runs = int(os.environ.get('EMAIL_BENCH_RUNS', 2000))
+    for label, render in (('legacy f-string', legacy), ('template, cold', template_cold), ('template, warm', template)):
+        seconds = min(timeit.repeat(render, number=runs, repeat=5)) / runs
+        print(f"{label:16} {seconds * 1e6:9.1f} us/email  ({len(render())} bytes)")
+
+
+if __name__ == '__main__':
+    main()
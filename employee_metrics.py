@@ -0,0 +1,145 @@
+from datetime import datetime, timezone
+from database import supabase
+from ticket_assignment import OPEN_STATUSES
+
+# --- Employee Metrics Rollup ---
+# The employee dashboard and profile used to scan every ticket and every rating
+# an employee ever had. Per-employee counters now live in the
+# 'employee_metrics_rollup' table:
+#
+#   employee_id (pk), assigned_count, pending_count, resolved_count,
+#   resolution_seconds_sum, resolution_samples, rating_sum, rating_count, updated_at
+#
+# Ticket and rating events apply small deltas (through the
+# 'bump_employee_metrics' RPC when it is deployed, which does the update in one
+# statement; otherwise read-modify-write). A missing row is seeded from the base
+# tables the first time it's read, so events for employees without a row are
+# simply skipped - the seed will include them.
+
+ROLLUP_TABLE = 'employee_metrics_rollup'
+COUNTERS = ('assigned_count', 'pending_count', 'resolved_count',
+            'resolution_seconds_sum', 'resolution_samples', 'rating_sum', 'rating_count')
+
+
+def _parse_ts(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _compute_from_base_tables(employee_id):
+    """Full recompute - the slow path, only used to seed or rebuild a row."""
+    tickets_res = supabase.table('support_tickets').select('status, created_at, resolved_at')\
+        .eq('assigned_to_employee_id', employee_id).execute()
+    tickets = tickets_res.data or []
+
+    row = {c: 0 for c in COUNTERS}
+    row['employee_id'] = employee_id
+    row['assigned_count'] = len(tickets)
+    row['pending_count'] = sum(1 for t in tickets if t['status'] in OPEN_STATUSES)
+
+    for t in tickets:
+        if t['status'] != 'Resolved':
+            continue
+        row['resolved_count'] += 1
+        start, end = _parse_ts(t.get('created_at')), _parse_ts(t.get('resolved_at'))
+        if start and end and (end - start).total_seconds() > 0:
+            row['resolution_seconds_sum'] += (end - start).total_seconds()
+            row['resolution_samples'] += 1
+
+    rating_res = supabase.table('ticket_ratings').select('rating').eq('employee_id', employee_id).execute()
+    ratings = rating_res.data or []
+    row['rating_count'] = len(ratings)
+    row['rating_sum'] = sum(r['rating'] for r in ratings)
+    return row
+
+
+def _with_averages(row):
+    metrics = dict(row)
+    metrics['avg_rating'] = round(row['rating_sum'] / row['rating_count'], 1) if row['rating_count'] else 0.0
+    metrics['avg_resolution_seconds'] = (row['resolution_seconds_sum'] / row['resolution_samples']
+                                         if row['resolution_samples'] else None)
+    return metrics
+
+
+def rebuild(employee_id):
+    """Recomputes an employee's row from the base tables and stores it."""
+    row = _compute_from_base_tables(employee_id)
+    row['updated_at'] = datetime.now(timezone.utc).isoformat()
+    try:
+        supabase.table(ROLLUP_TABLE).upsert(row).execute()
+    except Exception as e:
+        print(f"[METRICS] Could not store rollup for {employee_id}: {e}")
+    return row
+
+
+def get_employee_metrics(employee_id):
+    """
+    One-call fetch for the dashboard and profile. Returns the counters plus
+    'avg_rating' and 'avg_resolution_seconds'.
+    """
+    try:
+        res = supabase.table(ROLLUP_TABLE).select('*').eq('employee_id', employee_id).maybe_single().execute()
+        row = res.data if res else None
+    except Exception as e:
+        print(f"[METRICS] Rollup read failed, computing directly: {e}")
+        return _with_averages(_compute_from_base_tables(employee_id))
+
+    if not row:
+        row = rebuild(employee_id)
+    return _with_averages({c: (row.get(c) or 0) for c in COUNTERS})
+
+
+def apply_delta(employee_id, **deltas):
+    """Adds the given deltas (e.g. rating_sum=5, rating_count=1) to an employee's counters."""
+    deltas = {k: v for k, v in deltas.items() if k in COUNTERS and v}
+    if not employee_id or not deltas:
+        return
+    try:
+        supabase.rpc('bump_employee_metrics', {'p_employee_id': employee_id, 'p_deltas': deltas}).execute()
+        return
+    except Exception:
+        pass
+
+    try:
+        res = supabase.table(ROLLUP_TABLE).select('*').eq('employee_id', employee_id).maybe_single().execute()
+        row = res.data if res else None
+        if not row:
+            return  # Seeded on first read
+        update = {k: (row.get(k) or 0) + v for k, v in deltas.items()}
+        update['updated_at'] = datetime.now(timezone.utc).isoformat()
+        supabase.table(ROLLUP_TABLE).update(update).eq('employee_id', employee_id).execute()
+    except Exception as e:
+        print(f"[METRICS] Could not update rollup for {employee_id}: {e}")
+
+
+# --- Event hooks ---
+
+def on_ticket_assigned(employee_id, status='Open'):
+    apply_delta(employee_id, assigned_count=1, pending_count=1 if status in OPEN_STATUSES else 0)
+
+
+def on_ticket_status_change(employee_id, old_status, new_status, created_at=None, resolved_at=None):
+    deltas = {}
+    if old_status in OPEN_STATUSES and new_status not in OPEN_STATUSES:
+        deltas['pending_count'] = -1
+    elif new_status in OPEN_STATUSES and old_status not in OPEN_STATUSES:
+        deltas['pending_count'] = 1
+
+    if new_status == 'Resolved' and old_status != 'Resolved':
+        deltas['resolved_count'] = 1
+        start, end = _parse_ts(created_at), _parse_ts(resolved_at)
+        if start and end and (end - start).total_seconds() > 0:
+            deltas['resolution_seconds_sum'] = (end - start).total_seconds()
+            deltas['resolution_samples'] = 1
+    elif old_status == 'Resolved' and new_status != 'Resolved':
+        # Re-opened: the count goes back, the old duration stays until the next rebuild
+        deltas['resolved_count'] = -1
+    apply_delta(employee_id, **deltas)
+
+
+def on_rating(employee_id, rating):
+    apply_delta(employee_id, rating_sum=int(rating), rating_count=1)
@@ -0,0 +1,103 @@
+import os
+import time
+import hashlib
+import threading
+
+# --- Payment Gateway Token Cache ---
+# bKash and ShurjoPay hand out auth tokens that stay valid for an hour or more,
+# but every payment step used to ask for a new one. Tokens are cached per set of
+# merchant credentials (so each ISP's bKash account and the SaaS account get
+# their own entry) until shortly before they expire.
+#
+#   token = gateway_tokens.get(('bkash', base_url, username, password, app_key, app_secret),
+#                              fetch_fn)
+#
+# `fetch_fn()` must return (value, expires_in_seconds). Concurrent callers for the
+# same key share one grant; a token close to expiry is renewed in the background
+# while the current one keeps being served.
+
+TOKEN_REFRESH_AHEAD = float(os.environ.get('TOKEN_REFRESH_AHEAD', 300))
+TOKEN_DEFAULT_TTL = float(os.environ.get('TOKEN_DEFAULT_TTL', 3000))
+
+_tokens = {}        # key digest -> {"value", "expires_at", "refreshing"}
+_key_locks = {}
+_registry_lock = threading.Lock()
+_stats = {"hits": 0, "grants": 0, "background_refreshes": 0, "errors": 0}
+
+
+def cache_key(parts):
+    """Digest of the credential tuple, so secrets are never kept as dict keys."""
+    raw = "\x1f".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _lock_for(key):
+    with _registry_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+
+def _grant(key, fetch_fn):
+    value, expires_in = fetch_fn()
+    try:
+        ttl = float(expires_in) if expires_in else TOKEN_DEFAULT_TTL
+    except (TypeError, ValueError):
+        ttl = TOKEN_DEFAULT_TTL
+    _tokens[key] = {"value": value, "expires_at": time.monotonic() + ttl, "refreshing": False}
+    _stats["grants"] += 1
+    return value
+
+
+def _refresh_in_background(key, fetch_fn):
+    def run():
+        with _lock_for(key):
+            try:
+                _grant(key, fetch_fn)
+                _stats["background_refreshes"] += 1
+            except Exception as e:
+                _stats["errors"] += 1
+                print(f"[TOKEN] Background refresh failed: {e}")
+                entry = _tokens.get(key)
+                if entry:
+                    entry["refreshing"] = False
+
+    threading.Thread(target=run, name='token-refresh', daemon=True).start()
+
+
+def get(parts, fetch_fn):
+    """Returns a cached token for the credential tuple `parts`, granting one if needed."""
+    key = cache_key(parts)
+    now = time.monotonic()
+    entry = _tokens.get(key)
+
+    if entry and now < entry["expires_at"]:
+        _stats["hits"] += 1
+        if entry["expires_at"] - now < TOKEN_REFRESH_AHEAD and not entry["refreshing"]:
+            entry["refreshing"] = True
+            _refresh_in_background(key, fetch_fn)
+        return entry["value"]
+
+    # Single-flight: one thread grants, the others wait and re-use it
+    with _lock_for(key):
+        entry = _tokens.get(key)
+        if entry and time.monotonic() < entry["expires_at"]:
+            _stats["hits"] += 1
+            return entry["value"]
+        try:
+            return _grant(key, fetch_fn)
+        except Exception:
+            _stats["errors"] += 1
+            raise
+
+
+def invalidate(parts):
+    """Drops a token the gateway rejected, so the next call grants a fresh one."""
+    _tokens.pop(cache_key(parts), None)
+
+
+def stats():
+    data = dict(_stats)
+    data["cached"] = len(_tokens)
+    return data
@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Shared Outbound HTTP Client ---
+# Every outbound API call (payment gateways, couriers, Brevo, logo downloads)
+# goes through one pooled requests.Session per service, so TCP + TLS connections
+# are kept alive and re-used between calls instead of being opened every time.
+#
+#   http_client.post('bkash', url, json=payload, headers=headers)
+#   http_client.get('assets', logo_url)
+#
+# Each service has its own (connect, read) timeout. Idempotent calls are retried
+# with jittered exponential backoff; non-idempotent ones (creating a payment...)
+# are only retried when the connection could not even be opened.
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.3))
+
+# (connect timeout, read timeout) in seconds
+SERVICE_TIMEOUTS = {
+    'bkash': (3.05, 30),
+    'shurjopay': (3.05, 30),
+    'courier': (3.05, 10),
+    'brevo': (3.05, 15),
+    'assets': (3.05, 10),
+    'default': (3.05, 20),
+}
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_latency = {}
+_latency_lock = threading.Lock()
+
+
+def _session(service):
+    session = _sessions.get(service)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if session is None:
+            session = requests.Session()
+            # Retries are handled in request() so we can tell idempotent calls apart
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[service] = session
+    return session
+
+
+def _record(host, elapsed_ms, failed):
+    with _latency_lock:
+        entry = _latency.get(host)
+        if entry is None:
+            entry = _latency[host] = {
+                "count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        if failed:
+            entry["errors"] += 1
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                entry["buckets"][i] += 1
+                break
+        else:
+            entry["buckets"][-1] += 1
+
+
+def _backoff(attempt):
+    # Full jitter: sleep somewhere between 0 and base * 2^attempt
+    time.sleep(random.uniform(0, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(service, method, url, idempotent=None, retries=None, **kwargs):
+    """
+    Sends a request through the pooled session for `service`.
+    `idempotent` defaults to True for GET/HEAD/OPTIONS/PUT/DELETE; pass it
+    explicitly for POST endpoints that are safe to repeat (token grants, status queries).
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    if retries is None:
+        retries = HTTP_MAX_RETRIES
+    kwargs.setdefault('timeout', SERVICE_TIMEOUTS.get(service, SERVICE_TIMEOUTS['default']))
+
+    session = _session(service)
+    host = urlsplit(url).netloc
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            _record(host, (time.perf_counter() - start) * 1000, True)
+            # A connect failure means nothing reached the server, so any call may retry it.
+            # Resets after the request was sent are only retried for idempotent calls.
+            if attempt < retries and (idempotent or _is_connect_error(e)):
+                _backoff(attempt)
+                attempt += 1
+                continue
+            raise
+        except requests.exceptions.Timeout:
+            # Read timeout: the server may already have acted on the request
+            _record(host, (time.perf_counter() - start) * 1000, True)
+            if attempt < retries and idempotent:
+                _backoff(attempt)
+                attempt += 1
+                continue
+            raise
+
+        _record(host, (time.perf_counter() - start) * 1000, response.status_code >= 500)
+        if idempotent and response.status_code in RETRY_STATUSES and attempt < retries:
+            _backoff(attempt)
+            attempt += 1
+            continue
+        return response
+
+
+def _is_connect_error(exc):
+    """True when the connection was never established (DNS, refused, connect timeout)."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = str(exc)
+    return any(marker in reason for marker in ('NewConnectionError', 'Name or service not known',
+                                              'Connection refused', 'Failed to resolve'))
+
+
+def get(service, url, **kwargs):
+    return request(service, 'GET', url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, 'POST', url, **kwargs)
+
+
+def latency_stats():
+    """Per-host call counts, average/max latency and histogram buckets (ms)."""
+    labels = [f"<={b}" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    with _latency_lock:
+        stats = {}
+        for host, entry in _latency.items():
+            stats[host] = {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "avg_ms": round(entry["total_ms"] / entry["count"], 1) if entry["count"] else 0,
+                "max_ms": round(entry["max_ms"], 1),
+                "histogram": dict(zip(labels, entry["buckets"])),
+            }
+    return stats
@@ -7,27 +7,14 @@ from reportlab.lib import colors
 from reportlab.lib.units import inch, mm
 from reportlab.pdfgen import canvas
 import os
+import time
+import threading
+from collections import OrderedDict
 from io import BytesIO
-import requests 
+import http_client
 import json
 from database import supabase # Make sure supabase is imported
-
-# --- *** NEW HELPER FUNCTION *** ---
-def _clean_string(s, default=''):
-    """
-    Forcefully cleans a string by stripping whitespace and removing
-    any non-ASCII characters that can corrupt email headers.
-    """
-    if s is None:
-        return default
-    try:
-        # Encode to ASCII, ignoring errors, then decode back.
-        # This strips all non-ASCII chars. Then strip whitespace.
-        return s.encode('ascii', 'ignore').decode('ascii').strip()
-    except Exception:
-        # Fallback for any other error
-        return str(s).strip()
-# --- *** END OF NEW FUNCTION *** ---
+from company_profiles import company_profiles
 
 def get_placeholder_isp_details():
     """Returns dummy ISP company details if DB fetch fails."""
@@ -42,48 +29,214 @@ def get_placeholder_isp_details():
 
 def get_isp_company_details_from_db(company_id):
     """
-    Fetches and CLEANS ISP company details, including SMTP info, from the database.
+    Returns the CLEANED ISP company details, including SMTP info.
     Now accepts a company_id parameter for Flask.
+    Served from the shared company profile cache (company_profiles.py).
     """
     if not company_id or not supabase:
         return get_placeholder_isp_details()
     try:
-        response = supabase.table('isp_companies')\
-                           .select('company_name, company_details, payment_info, logo_url')\
-                           .eq('id', company_id)\
-                           .maybe_single()\
-                           .execute()
-                            
-        if response and response.data:
-            details = response.data
-            company_info = details.get('company_details', {})
-            if company_info is None:
-                company_info = {}
-            
-            # --- Clean all strings coming from the database ---
-            company_name_cleaned = _clean_string(details.get('company_name'), 'N/A')
-            
-            print(f"--- DEBUG: Cleaning sender_name. Original: '{details.get('company_name')}', Cleaned: '{company_name_cleaned}' ---")
-
-            return {
-                "company_name": company_name_cleaned,
-                "address": _clean_string(company_info.get('address'), 'N/A'),
-                "phone": _clean_string(company_info.get('phone'), 'N/A'),
-                "email": _clean_string(company_info.get('email'), 'N/A'),
-                "logo_path": details.get('logo_url', None), 
-                "payment_info": _clean_string(details.get('payment_info'), ''),
-                "smtp_host": _clean_string(company_info.get('smtp_host'), None),
-                "smtp_port": company_info.get('smtp_port', 587),
-                "smtp_user": _clean_string(company_info.get('smtp_user'), None),
-                "smtp_pass": _clean_string(company_info.get('smtp_pass'), None),
-                "sender_name": company_name_cleaned 
-            }
-        else:
+        profile = company_profiles.get(company_id)
+        if profile is None:
             return get_placeholder_isp_details()
+        return profile.invoice_details()
     except Exception as e:
         print(f"ERROR: Failed to fetch ISP details from DB: {e}. Using placeholders.")
         return get_placeholder_isp_details()
 
+# --- PDF Render Context Cache ---
+# Every receipt/payslip used to download the company logo and rebuild the whole
+# style sheet. Logos are now fetched once, decoded and shrunk to print size,
+# and kept as PNG bytes in a size-capped LRU keyed by logo URL (a new logo_url
+# is a new key; entries also expire after LOGO_CACHE_TTL in case the file at
+# the same URL is replaced). Paragraph and table styles are built once at
+# import and shared - they must never be mutated by the PDF builders.
+
+LOGO_CACHE_MAX_BYTES = int(os.environ.get('LOGO_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+LOGO_CACHE_TTL = float(os.environ.get('LOGO_CACHE_TTL', 3600))
+LOGO_FAILURE_TTL = float(os.environ.get('LOGO_FAILURE_TTL', 300))
+LOGO_MAX_PIXELS = int(os.environ.get('LOGO_MAX_PIXELS', 400)) # Longest side after resizing
+
+_logo_cache = OrderedDict() # logo_url -> {"png": bytes or None, "size": (w, h), "stored_at": t}
+_logo_cache_bytes = 0
+_logo_lock = threading.Lock()
+_logo_stats = {"hits": 0, "misses": 0, "failures": 0, "evictions": 0}
+
+
+def _shrink_logo(raw_bytes):
+    """Decodes a logo and returns (png_bytes, (width, height)) no larger than LOGO_MAX_PIXELS."""
+    from PIL import Image as PILImage
+    with PILImage.open(BytesIO(raw_bytes)) as img:
+        img.load()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        img.thumbnail((LOGO_MAX_PIXELS, LOGO_MAX_PIXELS))
+        out = BytesIO()
+        img.save(out, format='PNG', optimize=True)
+        return out.getvalue(), img.size
+
+
+def _store_logo(logo_url, entry):
+    global _logo_cache_bytes
+    with _logo_lock:
+        old = _logo_cache.pop(logo_url, None)
+        if old and old["png"]:
+            _logo_cache_bytes -= len(old["png"])
+        _logo_cache[logo_url] = entry
+        if entry["png"]:
+            _logo_cache_bytes += len(entry["png"])
+        while _logo_cache_bytes > LOGO_CACHE_MAX_BYTES and len(_logo_cache) > 1:
+            _, evicted = _logo_cache.popitem(last=False)
+            if evicted["png"]:
+                _logo_cache_bytes -= len(evicted["png"])
+            _logo_stats["evictions"] += 1
+
+
+def get_logo_image(logo_url, width, height_scale=None, h_align='LEFT'):
+    """
+    Returns a new reportlab Image for the logo at `width` (drawn height follows
+    the aspect ratio, times `height_scale` / `width` when given), or None.
+    Only the first call per logo_url (and per LOGO_CACHE_TTL) downloads it.
+    """
+    if not logo_url:
+        return None
+
+    now = time.monotonic()
+    with _logo_lock:
+        entry = _logo_cache.get(logo_url)
+        if entry:
+            ttl = LOGO_CACHE_TTL if entry["png"] else LOGO_FAILURE_TTL
+            if now - entry["stored_at"] < ttl:
+                _logo_cache.move_to_end(logo_url)
+            else:
+                entry = None
+
+    if entry:
+        _logo_stats["hits"] += 1
+    else:
+        _logo_stats["misses"] += 1
+        try:
+            response = http_client.get('assets', logo_url)
+            response.raise_for_status()
+            png, size = _shrink_logo(response.content)
+            entry = {"png": png, "size": size, "stored_at": now}
+        except Exception as e:
+            print(f"Error downloading logo: {e}")
+            _logo_stats["failures"] += 1
+            entry = {"png": None, "size": None, "stored_at": now} # Don't retry on every PDF
+        _store_logo(logo_url, entry)
+
+    if not entry["png"]:
+        return None
+    img_width, img_height = entry["size"]
+    aspect = img_height / img_width
+    img = Image(BytesIO(entry["png"]), width=width, height=(height_scale or width) * aspect)
+    img.hAlign = h_align
+    return img
+
+
+def invalidate_logo(logo_url=None):
+    """Drops one cached logo (e.g. after a company changes its logo), or all of them."""
+    global _logo_cache_bytes
+    with _logo_lock:
+        if logo_url is None:
+            _logo_cache.clear()
+            _logo_cache_bytes = 0
+        else:
+            entry = _logo_cache.pop(logo_url, None)
+            if entry and entry["png"]:
+                _logo_cache_bytes -= len(entry["png"])
+
+
+def render_cache_stats():
+    stats = dict(_logo_stats)
+    stats["logos"] = len(_logo_cache)
+    stats["logo_bytes"] = _logo_cache_bytes
+    return stats
+
+
+def _build_styles():
+    base = getSampleStyleSheet()
+    normal = ParagraphStyle(name='Body', parent=base['Normal'], leading=14)
+    return {
+        "title": ParagraphStyle(name='Title', parent=base['h1'], alignment=TA_LEFT),
+        "normal": normal,
+        "company_name": ParagraphStyle(name='CompanyName', parent=base['h2'], alignment=TA_RIGHT),
+        "company_details": ParagraphStyle(name='CompanyDetails', parent=base['Normal'], alignment=TA_RIGHT, leading=14),
+        "left": ParagraphStyle(name='Left', parent=normal, alignment=TA_LEFT),
+        "right": ParagraphStyle(name='Right', parent=normal, alignment=TA_RIGHT),
+        "bold_left": ParagraphStyle(name='BoldLeft', parent=normal, fontName='Helvetica-Bold', alignment=TA_LEFT),
+        "bold_right": ParagraphStyle(name='BoldRight', parent=normal, fontName='Helvetica-Bold', alignment=TA_RIGHT),
+        "net_total": ParagraphStyle(name='NetTotal', parent=base['h3'], alignment=TA_RIGHT,
+                                    textColor=colors.whitesmoke, backColor=colors.HexColor('#00B050'),
+                                    padding=10, borderPadding=5, borderRadius=5),
+        "notes": ParagraphStyle(name='Notes', parent=normal, alignment=TA_CENTER),
+        "footer": ParagraphStyle(name='Footer', parent=normal, fontSize=8, alignment=TA_CENTER),
+        # Thermal receipt
+        "t_center": ParagraphStyle(name='Center', alignment=TA_CENTER, fontName="Helvetica", fontSize=10),
+        "t_center_bold": ParagraphStyle(name='CenterBold', alignment=TA_CENTER, fontName="Helvetica-Bold", fontSize=12),
+        "t_left": ParagraphStyle(name='Left', alignment=TA_LEFT, fontName="Helvetica", fontSize=10, leading=12),
+        "t_right": ParagraphStyle(name='Right', alignment=TA_RIGHT, fontName="Helvetica", fontSize=10, leading=12),
+        "t_total": ParagraphStyle(name='Total', alignment=TA_RIGHT, fontName="Helvetica-Bold", fontSize=14),
+    }
+
+
+_SUMMARY_HEADER_COMMANDS = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F81BD')), 
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke), 
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'), 
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'), 
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'), 
+    ('GRID', (0, 0), (-1, -1), 1, colors.black), 
+    ('BOX', (0, 0), (-1, -1), 1, colors.black), 
+]
+
+STYLES = _build_styles()
+TABLE_STYLES = {
+    "top": TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')]),
+    "rule": TableStyle([('LINEBELOW', (0,0), (-1,-1), 2, colors.blue)]),
+    "receipt_summary": TableStyle(_SUMMARY_HEADER_COMMANDS + [
+        ('LINEABOVE', (0, -1), (-1, -1), 1, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#E0E0E0')),
+    ]),
+    "payslip_summary": TableStyle(_SUMMARY_HEADER_COMMANDS + [
+        ('LINEABOVE', (0, 4), (-1, 4), 1, colors.black),
+        ('BACKGROUND', (0, 4), (-1, 4), colors.HexColor('#E0E0E0')),
+        ('LINEABOVE', (0, 6), (-1, 6), 1, colors.black),
+        ('BACKGROUND', (0, 6), (-1, 6), colors.HexColor('#E0E0E0')),
+    ]),
+    "thermal_line": TableStyle([
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('LEFTPADDING', (0,0), (-1,-1), 0),
+        ('RIGHTPADDING', (0,0), (-1,-1), 0),
+    ]),
+}
+
+
+def _company_header(isp_details, story):
+    """Logo + company name/details block shared by the A4 receipt and payslip."""
+    company_name_para = Paragraph(isp_details['company_name'], STYLES["company_name"])
+    company_details_para = Paragraph(
+        f"{isp_details['address']}<br/>"
+        f"{isp_details['phone']} | {isp_details['email']}",
+        STYLES["company_details"]
+    )
+
+    logo_image = get_logo_image(isp_details.get("logo_path"), 1.3*inch)
+    if logo_image:
+        header_data = [[logo_image, [company_name_para, company_details_para]]]
+        header_table = Table(header_data, colWidths=[1.5*inch, None])
+        header_table.setStyle(TABLE_STYLES["top"])
+        story.append(header_table)
+    else:
+        story.append(company_name_para)
+        story.append(company_details_para)
+
+    story.append(Spacer(1, 0.25 * inch))
+    story.append(Table([['']], colWidths='100%', style=TABLE_STYLES["rule"]))
+    story.append(Spacer(1, 0.25 * inch))
+
+
 def generate_invoice_number(customer_id, issue_date):
     """Generates a unique invoice number."""
     cust_short = str(customer_id).split('-')[0].upper()
@@ -125,52 +278,9 @@ def create_receipt_pdf_as_bytes(invoice_data, customer_data, company_data, gener
         doc = SimpleDocTemplate(buffer, pagesize=letter,
                                 leftMargin=0.75*inch, rightMargin=0.75*inch,
                                 topMargin=0.75*inch, bottomMargin=0.75*inch)
-        styles = getSampleStyleSheet()
         story = []
 
-        logo_path = isp_details.get("logo_path")
-        logo_image = None
-        if logo_path:
-            try:
-                response = requests.get(logo_path)
-                response.raise_for_status() 
-                logo_data = BytesIO(response.content)
-                
-                img = Image(logo_data, width=1.3*inch) 
-                aspect = img.imageHeight / img.imageWidth
-                img.drawHeight = (1.3 * inch) * aspect
-                logo_image = img
-                
-                logo_image.hAlign = 'LEFT'
-            except Exception as e:
-                print(f"Error downloading logo: {e}")
-                logo_image = None
-
-        company_name_style = ParagraphStyle(name='CompanyName', parent=styles['h2'], alignment=TA_RIGHT)
-        company_details_style = ParagraphStyle(name='CompanyDetails', parent=styles['Normal'], alignment=TA_RIGHT, leading=14)
-        
-        company_name_para = Paragraph(isp_details['company_name'], company_name_style)
-        company_details_para = Paragraph(
-            f"{isp_details['address']}<br/>"
-            f"{isp_details['phone']} | {isp_details['email']}",
-            company_details_style
-        )
-
-        if logo_image:
-            header_data = [[logo_image, [company_name_para, company_details_para]]]
-            header_table = Table(header_data, colWidths=[1.5*inch, None])
-            header_table.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')]))
-            story.append(header_table)
-        else:
-            story.append(company_name_para)
-            story.append(company_details_para)
-
-        story.append(Spacer(1, 0.25 * inch))
-        story.append(Table(
-            [['']], 
-            colWidths='100%', 
-            style=TableStyle([('LINEBELOW', (0,0), (-1,-1), 2, colors.blue)])))
-        story.append(Spacer(1, 0.25 * inch))
+        _company_header(isp_details, story)
 
         try:
             issue_date = datetime.datetime.fromisoformat(invoice_data['issue_date'])
@@ -178,13 +288,8 @@ def create_receipt_pdf_as_bytes(invoice_data, customer_data, company_data, gener
         except:
             billing_period = "N/A"
             
-        title_style = styles['h1']; title_style.alignment = TA_LEFT
-        story.append(Paragraph(f"Payment Receipt: {billing_period}", title_style))
+        story.append(Paragraph(f"Payment Receipt: {billing_period}", STYLES["title"]))
         story.append(Spacer(1, 0.3 * inch))
-
-        styles['Normal'].leading = 14
-        p_style_left = ParagraphStyle(name='Left', parent=styles['Normal'], alignment=TA_LEFT)
-        p_style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT)
         
         payment_date_str = datetime.date.today().strftime('%d %b %Y')
         if invoice_data.get('paid_at'):
@@ -212,17 +317,14 @@ def create_receipt_pdf_as_bytes(invoice_data, customer_data, company_data, gener
             Billing Period: {billing_period}
         """
 
-        details_data = [[Paragraph(billed_to_content, p_style_left), Paragraph(receipt_details_content, p_style_right)]]
+        details_data = [[Paragraph(billed_to_content, STYLES["left"]), Paragraph(receipt_details_content, STYLES["right"])]]
         details_table = Table(details_data, colWidths=['60%', '40%'])
-        details_table.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+        details_table.setStyle(TABLE_STYLES["top"])
         story.append(details_table)
         story.append(Spacer(1, 0.3 * inch))
-
-        bold_left = ParagraphStyle(name='BoldLeft', parent=styles['Normal'], fontName='Helvetica-Bold', alignment=TA_LEFT)
-        bold_right = ParagraphStyle(name='BoldRight', parent=styles['Normal'], fontName='Helvetica-Bold', alignment=TA_RIGHT)
         
         summary_data = [
-            [Paragraph('<b>Description</b>', styles['Normal']), Paragraph('<b>Amount (BDT)</b>', p_style_right)],
+            [Paragraph('<b>Description</b>', STYLES["normal"]), Paragraph('<b>Amount (BDT)</b>', STYLES["right"])],
         ]
 
         if charge_details:
@@ -240,41 +342,23 @@ def create_receipt_pdf_as_bytes(invoice_data, customer_data, company_data, gener
             summary_data.append([description, f"{invoice_data['amount']:.2f}"])
             
         summary_data.append(
-            [Paragraph('Total Amount', bold_left), Paragraph(f"{invoice_data['amount']:.2f}", bold_right)]
+            [Paragraph('Total Amount', STYLES["bold_left"]), Paragraph(f"{invoice_data['amount']:.2f}", STYLES["bold_right"])]
         )
 
         summary_table = Table(summary_data, colWidths=['75%', '25%'])
-        style_commands = [
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F81BD')), 
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke), 
-            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'), 
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'), 
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'), 
-            ('GRID', (0, 0), (-1, -1), 1, colors.black), 
-            ('BOX', (0, 0), (-1, -1), 1, colors.black), 
-            ('LINEABOVE', (0, -1), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#E0E0E0')),
-        ]
-        
-        summary_table.setStyle(TableStyle(style_commands))
+        summary_table.setStyle(TABLE_STYLES["receipt_summary"])
         story.append(summary_table)
         story.append(Spacer(1, 0.3 * inch))
-
-        net_paid_style = ParagraphStyle(name='NetPaid', parent=styles['h3'], alignment=TA_RIGHT,
-                                        textColor=colors.whitesmoke, backColor=colors.HexColor('#00B050'),
-                                        padding=10, borderPadding=5, borderRadius=5)
         
-        story.append(Paragraph(f"Total Paid: {invoice_data['amount']:.2f} BDT", net_paid_style))
+        story.append(Paragraph(f"Total Paid: {invoice_data['amount']:.2f} BDT", STYLES["net_total"]))
         story.append(Spacer(1, 0.2 * inch))
 
         if isp_details.get('payment_info'):
-            notes_style = styles['Normal']; notes_style.alignment = TA_CENTER
-            story.append(Paragraph(f"<i>Payment Instructions: {isp_details['payment_info']}</i>", notes_style))
+            story.append(Paragraph(f"<i>Payment Instructions: {isp_details['payment_info']}</i>", STYLES["notes"]))
             story.append(Spacer(1, 0.3 * inch))
 
-        footer_style = ParagraphStyle(name='Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER)
-        story.append(Paragraph(f"Generated by: {generated_by_name}", footer_style))
-        story.append(Paragraph("Powered by Nazrul Huda", footer_style))
+        story.append(Paragraph(f"Generated by: {generated_by_name}", STYLES["footer"]))
+        story.append(Paragraph("Powered by Nazrul Huda", STYLES["footer"]))
 
         doc.build(story, onFirstPage=lambda c, d: draw_paid_watermark(c, d, isp_details))
         
@@ -296,59 +380,16 @@ def create_payslip_pdf_as_bytes(payroll_data, employee_data, company_data, gener
         doc = SimpleDocTemplate(buffer, pagesize=letter,
                                 leftMargin=0.75*inch, rightMargin=0.75*inch,
                                 topMargin=0.75*inch, bottomMargin=0.75*inch)
-        styles = getSampleStyleSheet()
         story = []
 
         # company_data is now the full details dict
         isp_details = company_data
 
-        logo_path = isp_details.get("logo_path")
-        logo_image = None
-        if logo_path:
-            try:
-                response = requests.get(logo_path)
-                response.raise_for_status() 
-                logo_data = BytesIO(response.content)
-                img = Image(logo_data, width=1.3*inch) 
-                aspect = img.imageHeight / img.imageWidth
-                img.drawHeight = (1.3 * inch) * aspect
-                logo_image = img
-                logo_image.hAlign = 'LEFT'
-            except Exception as e:
-                print(f"Error downloading logo: {e}")
-                logo_image = None
-
-        company_name_style = ParagraphStyle(name='CompanyName', parent=styles['h2'], alignment=TA_RIGHT)
-        company_details_style = ParagraphStyle(name='CompanyDetails', parent=styles['Normal'], alignment=TA_RIGHT, leading=14)
-        
-        company_name_para = Paragraph(isp_details['company_name'], company_name_style)
-        company_details_para = Paragraph(
-            f"{isp_details['address']}<br/>"
-            f"{isp_details['phone']} | {isp_details['email']}",
-            company_details_style
-        )
-
-        if logo_image:
-            header_data = [[logo_image, [company_name_para, company_details_para]]]
-            header_table = Table(header_data, colWidths=[1.5*inch, None])
-            header_table.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')]))
-            story.append(header_table)
-        else:
-            story.append(company_name_para)
-            story.append(company_details_para)
-
-        story.append(Spacer(1, 0.25 * inch))
-        story.append(Table([['']], colWidths='100%', style=TableStyle([('LINEBELOW', (0,0), (-1,-1), 2, colors.blue)])))
-        story.append(Spacer(1, 0.25 * inch))
+        _company_header(isp_details, story)
 
-        title_style = styles['h1']
-        title_style.alignment = TA_LEFT
         pay_period = f"{datetime.date(payroll_data['pay_period_year'], payroll_data['pay_period_month'], 1).strftime('%B %Y')}"
-        story.append(Paragraph(f"Payslip: {pay_period}", title_style))
+        story.append(Paragraph(f"Payslip: {pay_period}", STYLES["title"]))
         story.append(Spacer(1, 0.2 * inch))
-
-        p_style_left = ParagraphStyle(name='Left', parent=styles['Normal'], alignment=TA_LEFT, leading=14)
-        p_style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, leading=14)
         
         employee_info = f"""
             <b>Paid To:</b><br/>
@@ -366,20 +407,19 @@ def create_payslip_pdf_as_bytes(payroll_data, employee_data, company_data, gener
             <b>Pay Period:</b> {pay_period}
         """
         
-        details_data = [[Paragraph(employee_info, p_style_left), Paragraph(pay_details, p_style_right)]]
+        details_data = [[Paragraph(employee_info, STYLES["left"]), Paragraph(pay_details, STYLES["right"])]]
         details_table = Table(details_data, colWidths=['50%', '50%'])
-        details_table.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+        details_table.setStyle(TABLE_STYLES["top"])
         story.append(details_table)
         story.append(Spacer(1, 0.3 * inch))
 
-        bold_left = ParagraphStyle(name='BoldLeft', parent=styles['Normal'], fontName='Helvetica-Bold', alignment=TA_LEFT)
-        bold_right = ParagraphStyle(name='BoldRight', parent=styles['Normal'], fontName='Helvetica-Bold', alignment=TA_RIGHT)
+        bold_left, bold_right = STYLES["bold_left"], STYLES["bold_right"]
 
         gross_salary = payroll_data['base_salary'] + payroll_data['incentives'] + payroll_data['increments']
         total_deductions = payroll_data['deductions']
 
         summary_data = [
-            [Paragraph('<b>Description</b>', styles['Normal']), Paragraph('<b>Amount (BDT)</b>', p_style_right)],
+            [Paragraph('<b>Description</b>', STYLES["normal"]), Paragraph('<b>Amount (BDT)</b>', STYLES["right"])],
             ['Base Salary', f"{payroll_data['base_salary']:.2f}"],
             ['Incentives', f"{payroll_data['incentives']:.2f}"],
             ['Increments', f"{payroll_data['increments']:.2f}"],
@@ -389,35 +429,17 @@ def create_payslip_pdf_as_bytes(payroll_data, employee_data, company_data, gener
         ]
 
         summary_table = Table(summary_data, colWidths=['75%', '25%'])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F81BD')), 
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke), 
-            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'), 
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'), 
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'), 
-            ('GRID', (0, 0), (-1, -1), 1, colors.black), 
-            ('BOX', (0, 0), (-1, -1), 1, colors.black), 
-            ('LINEABOVE', (0, 4), (-1, 4), 1, colors.black),
-            ('BACKGROUND', (0, 4), (-1, 4), colors.HexColor('#E0E0E0')),
-            ('LINEABOVE', (0, 6), (-1, 6), 1, colors.black),
-            ('BACKGROUND', (0, 6), (-1, 6), colors.HexColor('#E0E0E0')),
-        ]))
+        summary_table.setStyle(TABLE_STYLES["payslip_summary"])
         
         story.append(summary_table)
         story.append(Spacer(1, 0.3 * inch))
 
         net_salary = payroll_data['net_salary']
-        net_salary_style = ParagraphStyle(name='NetSalary', parent=styles['h3'], alignment=TA_RIGHT,
-                                        textColor=colors.whitesmoke, backColor=colors.HexColor('#00B050'),
-                                        padding=10, borderPadding=5, borderRadius=5)
-        
-        story.append(Paragraph(f"Net Salary Paid: {net_salary:.2f} BDT", net_salary_style))
+        story.append(Paragraph(f"Net Salary Paid: {net_salary:.2f} BDT", STYLES["net_total"]))
         story.append(Spacer(1, 0.5 * inch))
         
-        footer_style = ParagraphStyle(name='Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER)
-        
-        story.append(Paragraph(f"This is a system-generated payslip. Generated by: {generated_by_name}", footer_style))
-        story.append(Paragraph("Powered by Nazrul Huda", footer_style))
+        story.append(Paragraph(f"This is a system-generated payslip. Generated by: {generated_by_name}", STYLES["footer"]))
+        story.append(Paragraph("Powered by Nazrul Huda", STYLES["footer"]))
 
         doc.build(story)
         
@@ -442,12 +464,10 @@ def create_thermal_receipt_as_bytes(invoice_data, customer_data, company_data, g
                                 leftMargin=5*mm, rightMargin=5*mm,
                                 topMargin=5*mm, bottomMargin=5*mm)
         
-        styles = getSampleStyleSheet()
-        styles.add(ParagraphStyle(name='Center', alignment=TA_CENTER, fontName="Helvetica", fontSize=10))
-        styles.add(ParagraphStyle(name='CenterBold', alignment=TA_CENTER, fontName="Helvetica-Bold", fontSize=12))
-        styles.add(ParagraphStyle(name='Left', alignment=TA_LEFT, fontName="Helvetica", fontSize=10, leading=12))
-        styles.add(ParagraphStyle(name='Right', alignment=TA_RIGHT, fontName="Helvetica", fontSize=10, leading=12))
-        styles.add(ParagraphStyle(name='Total', alignment=TA_RIGHT, fontName="Helvetica-Bold", fontSize=14))
+        styles = {
+            'Center': STYLES["t_center"], 'CenterBold': STYLES["t_center_bold"],
+            'Left': STYLES["t_left"], 'Right': STYLES["t_right"], 'Total': STYLES["t_total"],
+        }
         
         elements = []
         
@@ -458,24 +478,8 @@ def create_thermal_receipt_as_bytes(invoice_data, customer_data, company_data, g
         phone = isp_details.get('phone', 'N/A')
 
         # --- *** NEW LOGO LOGIC *** ---
-        logo_path = isp_details.get("logo_path")
-        logo_image = None
-        if logo_path:
-            try:
-                response = requests.get(logo_path)
-                response.raise_for_status() 
-                logo_data = BytesIO(response.content)
-                
-                # Resize for thermal paper (40mm width)
-                img = Image(logo_data, width=30*mm) 
-                aspect = img.imageHeight / img.imageWidth
-                img.drawHeight = (40*mm) * aspect
-                logo_image = img
-                
-                logo_image.hAlign = 'CENTER' # Center the logo
-            except Exception as e:
-                print(f"Error downloading logo for thermal receipt: {e}")
-                logo_image = None
+        # Sized for thermal paper, centered (cached, see get_logo_image)
+        logo_image = get_logo_image(isp_details.get("logo_path"), 30*mm, height_scale=40*mm, h_align='CENTER')
         
         if logo_image:
             elements.append(logo_image)
@@ -517,11 +521,7 @@ def create_thermal_receipt_as_bytes(invoice_data, customer_data, company_data, g
             [Paragraph(desc, styles['Left']), Paragraph(f"{invoice_data['amount']:.2f}", styles['Right'])]
         ]
         line_item_table = Table(line_item_data, colWidths=['70%', '30%'])
-        line_item_table.setStyle(TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (-1,-1), 0),
-            ('RIGHTPADDING', (0,0), (-1,-1), 0),
-        ]))
+        line_item_table.setStyle(TABLE_STYLES["thermal_line"])
         elements.append(line_item_table)
 
         elements.append(Spacer(1, 2 * mm))
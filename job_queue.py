@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+import traceback
+
+# --- Durable Background Job Queue ---
+# Side effects that don't have to happen before we answer the customer
+# (receipts, emails, notifications, router reactivation) are stored as jobs in a
+# local SQLite file and run by worker threads. Jobs survive a worker restart,
+# are retried with backoff, and end up in a 'dead' state (visible on
+# /admin/jobs) once they run out of attempts.
+#
+#   @jobs.handler('invoice_receipt_email')
+#   def invoice_receipt_email(payload): ...
+#
+#   jobs.enqueue('invoice_receipt_email', {'invoice_id': 42},
+#                idempotency_key='invoice:42:receipt')
+#
+# The idempotency key is UNIQUE, so enqueueing the same work twice (double
+# callback, page refresh) is a no-op.
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', 5))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 300))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    locked_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at);
+"""
+
+
+class JobQueue:
+    def __init__(self):
+        self.db_path = None
+        self._handlers = {}
+        self._workers = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._local = threading.local()
+
+    # --- Setup ---
+
+    def init_app(self, app, db_path=None):
+        """
+        Creates the SQLite store under the instance folder. Call start() once every
+        handler is registered, so a job left over from before a restart is never
+        claimed by a worker that can't run it yet.
+        """
+        if db_path is None:
+            os.makedirs(app.instance_path, exist_ok=True)
+            db_path = os.path.join(app.instance_path, 'jobs.sqlite3')
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Several gunicorn workers share the file; let SQLite wait on locks
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def handler(self, name):
+        """Registers the function that runs jobs called `name`."""
+        def decorator(f):
+            self._handlers[name] = f
+            return f
+        return decorator
+
+    def start(self):
+        if self._workers:
+            return
+        for i in range(JOB_WORKERS):
+            t = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for t in self._workers:
+            t.join(timeout)
+
+    # --- Producing ---
+
+    def enqueue(self, name, payload, idempotency_key=None, max_attempts=JOB_MAX_ATTEMPTS, delay=0):
+        """
+        Stores a job. Returns False if a job with the same idempotency key already exists.
+        """
+        now = time.time()
+        cur = self._connect().execute(
+            "INSERT OR IGNORE INTO jobs (name, payload, idempotency_key, max_attempts, run_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, json.dumps(payload, default=str), idempotency_key, max_attempts, now + delay, now, now)
+        )
+        self._wakeup.set()
+        return cur.rowcount == 1
+
+    # --- Consuming ---
+
+    def _claim(self):
+        """
+        Takes the next due job. A 'running' job whose lease ran out (its worker died
+        mid-way) is due again and is reclaimed here, in the same transaction.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'pending' AND run_at <= ?) "
+                "OR (status = 'running' AND locked_at < ?) ORDER BY run_at LIMIT 1",
+                (now, now - JOB_LEASE_SECONDS)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_at = ?, updated_at = ? WHERE id = ?",
+                (now, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _finish(self, job, error=None):
+        conn = self._connect()
+        now = time.time()
+        attempts = job['attempts'] + 1
+        if error is None:
+            conn.execute("UPDATE jobs SET status = 'done', locked_at = NULL, last_error = NULL, updated_at = ? WHERE id = ?",
+                         (now, job['id']))
+        elif attempts >= job['max_attempts']:
+            print(f"[JOBS] '{job['name']}' #{job['id']} is dead after {attempts} attempts: {error}")
+            conn.execute("UPDATE jobs SET status = 'dead', locked_at = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                         (error, now, job['id']))
+        else:
+            # Exponential backoff with jitter: ~5s, 10s, 20s, 40s...
+            delay = JOB_BACKOFF_BASE * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            conn.execute("UPDATE jobs SET status = 'pending', locked_at = NULL, last_error = ?, run_at = ?, updated_at = ? WHERE id = ?",
+                         (error, now + delay, now, job['id']))
+
+    def _run(self, job):
+        handler = self._handlers.get(job['name'])
+        if handler is None:
+            self._finish(job, error=f"No handler registered for '{job['name']}'")
+            return
+        try:
+            handler(json.loads(job['payload']))
+            self._finish(job)
+        except Exception as e:
+            print(f"[JOBS] '{job['name']}' #{job['id']} failed: {e}")
+            self._finish(job, error=f"{e}\n{traceback.format_exc(limit=3)}")
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"[JOBS] Claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    # --- Dead-letter management ---
+
+    def list_jobs(self, status='dead', limit=100):
+        rows = self._connect().execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (status, limit)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def counts(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r['status']: r['n'] for r in rows}
+
+    def retry(self, job_id):
+        """Moves a dead job back to pending with a fresh set of attempts."""
+        now = time.time()
+        cur = self._connect().execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, run_at = ?, updated_at = ? WHERE id = ? AND status = 'dead'",
+            (now, now, job_id)
+        )
+        self._wakeup.set()
+        return cur.rowcount == 1
+
+    def discard(self, job_id):
+        cur = self._connect().execute("DELETE FROM jobs WHERE id = ? AND status = 'dead'", (job_id,))
+        return cur.rowcount == 1
+
+
+jobs = JobQueue()
@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from collections import defaultdict
+import http_client
+from scheduler_leader import leader
+
+# --- Outbound Mail Dispatcher ---
+# email_service's send_* helpers used to make one blocking Brevo POST per email.
+# They now only store the message in a local SQLite outbox
+# (instance/mail.sqlite3) and return. A dispatcher thread on the scheduler
+# leader (see scheduler_leader.py) drains the outbox:
+#
+#   * messages that share sender and reply-to go out together through Brevo's
+#     messageVersions batch call (MAIL_BATCH_SIZE per request); messages with
+#     attachments are sent on their own
+#   * token buckets per sender address and per ISP company keep bulk runs
+#     (billing notices, mass reactivation) under the provider's rate limits and
+#     stop one tenant from starving the others
+#   * 429 and 5xx responses and connection errors are retried with backoff
+#     (honouring Retry-After); other 4xx responses fail the message for good
+#     (a rejected batch is first re-sent message by message, so only the bad one fails)
+#   * every message keeps its status, attempts, last error and provider message
+#     id, so the outbox doubles as the delivery log
+#
+# MAIL_TRANSPORT=fake swaps Brevo for FakeSink, which accepts everything (or
+# fails on demand) and appends each request to instance/mail_sink.jsonl.
+
+MAIL_TRANSPORT = os.environ.get('MAIL_TRANSPORT', 'brevo')
+MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 6))
+MAIL_BACKOFF_BASE = float(os.environ.get('MAIL_BACKOFF_BASE', 10))
+MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', 2))
+MAIL_LEASE_SECONDS = float(os.environ.get('MAIL_LEASE_SECONDS', 300))
+MAIL_RATE_PER_SENDER = float(os.environ.get('MAIL_RATE_PER_SENDER', 10))      # messages/second
+MAIL_BURST_PER_SENDER = float(os.environ.get('MAIL_BURST_PER_SENDER', 100))
+MAIL_RATE_PER_COMPANY = float(os.environ.get('MAIL_RATE_PER_COMPANY', 3))     # messages/second
+MAIL_BURST_PER_COMPANY = float(os.environ.get('MAIL_BURST_PER_COMPANY', 30))
+MAIL_LOG_RETENTION_DAYS = float(os.environ.get('MAIL_LOG_RETENTION_DAYS', 14))
+
+BREVO_URL = "https://api.brevo.com/v3/smtp/email"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_mail (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_id TEXT,
+    sender_email TEXT NOT NULL,
+    sender_name TEXT,
+    reply_to TEXT,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html TEXT NOT NULL,
+    attachments TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    locked_at REAL,
+    last_error TEXT,
+    provider_message_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_mail_due ON outbound_mail (status, next_attempt_at);
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, n=1):
+        """Takes n tokens. Returns 0 on success, otherwise the seconds until n tokens are available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+# --- Transports ---
+# send(payload) -> (status_code, response_dict, retry_after_seconds or None)
+
+class BrevoTransport:
+    name = 'brevo'
+
+    def ready(self):
+        if not os.environ.get('BREVO_API_KEY'):
+            return False, "Brevo configuration missing."
+        return True, None
+
+    def send(self, payload):
+        headers = {
+            "accept": "application/json",
+            "api-key": os.environ.get('BREVO_API_KEY'),
+            "content-type": "application/json"
+        }
+        response = http_client.post('brevo', BREVO_URL, json=payload, headers=headers)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"message": response.text}
+        retry_after = response.headers.get('Retry-After')
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return response.status_code, body, retry_after
+
+
+class FakeSink:
+    """Stand-in transport for tests and local runs: records every request, never sends."""
+    name = 'fake'
+
+    def __init__(self, path=None):
+        self.path = path
+        self.requests = []
+        self._failures = []
+        self._lock = threading.Lock()
+
+    def ready(self):
+        return True, None
+
+    def fail_next(self, status_code, count=1, retry_after=None):
+        """Makes the next `count` requests answer with `status_code`."""
+        with self._lock:
+            self._failures.extend([(status_code, retry_after)] * count)
+
+    def send(self, payload):
+        with self._lock:
+            if self._failures:
+                status, retry_after = self._failures.pop(0)
+                return status, {"message": f"FakeSink forced {status}"}, retry_after
+            self.requests.append(payload)
+            n = len(self.requests)
+        versions = payload.get('messageVersions')
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(payload, default=str) + "\n")
+        if versions:
+            return 201, {"messageIds": [f"<fake-{n}-{i}@sink>" for i in range(len(versions))]}, None
+        return 201, {"messageId": f"<fake-{n}@sink>"}, None
+
+
+class MailDispatcher:
+    def __init__(self):
+        self.db_path = None
+        self.transport = FakeSink() if MAIL_TRANSPORT == 'fake' else BrevoTransport()
+        self._sender_buckets = defaultdict(lambda: TokenBucket(MAIL_RATE_PER_SENDER, MAIL_BURST_PER_SENDER))
+        self._company_buckets = defaultdict(lambda: TokenBucket(MAIL_RATE_PER_COMPANY, MAIL_BURST_PER_COMPANY))
+        self._worker = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._local = threading.local()
+        self._purged_at = 0.0
+
+    # --- Setup ---
+
+    def init_app(self, app, db_path=None):
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.db_path = db_path or os.path.join(app.instance_path, 'mail.sqlite3')
+        if isinstance(self.transport, FakeSink) and self.transport.path is None:
+            self.transport.path = os.path.join(app.instance_path, 'mail_sink.jsonl')
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, name='mail-dispatcher', daemon=True)
+            self._worker.start()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join(timeout)
+
+    # --- Producing ---
+
+    def ready(self):
+        return self.transport.ready()
+
+    def enqueue(self, to_email, subject, html, sender_email, sender_name=None, reply_to=None,
+                company_id=None, attachments=None):
+        """
+        Stores one message for delivery and returns its id. `attachments` are
+        Brevo attachment dicts ({"name", "content" (base64)}).
+        """
+        if self.db_path is None:
+            # Not running inside the app (scripts, shell): deliver right away
+            return self._send_now(to_email, subject, html, sender_email, sender_name, reply_to, attachments)
+
+        now = time.time()
+        cur = self._connect().execute(
+            "INSERT INTO outbound_mail (company_id, sender_email, sender_name, reply_to, to_email, subject, html, "
+            "attachments, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(company_id) if company_id else None, sender_email, sender_name, reply_to, to_email, str(subject),
+             html, json.dumps(attachments) if attachments else None, now, now)
+        )
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def _send_now(self, to_email, subject, html, sender_email, sender_name, reply_to, attachments):
+        row = {"to_email": to_email, "subject": subject, "html": html, "sender_email": sender_email,
+               "sender_name": sender_name, "reply_to": reply_to,
+               "attachments": json.dumps(attachments) if attachments else None}
+        status, body, _ = self.transport.send(self._single_payload(row))
+        if not 200 <= status < 300:
+            raise Exception(f"Mail transport returned {status}: {body.get('message', body)}")
+        return None
+
+    # --- Payloads ---
+
+    @staticmethod
+    def _base_payload(row):
+        payload = {"sender": {"name": row['sender_name'], "email": row['sender_email']}}
+        if row['reply_to']:
+            payload['replyTo'] = {"email": row['reply_to']}
+        return payload
+
+    def _single_payload(self, row):
+        payload = self._base_payload(row)
+        payload['to'] = [{"email": row['to_email']}]
+        payload['subject'] = row['subject']
+        payload['htmlContent'] = row['html']
+        if row['attachments']:
+            payload['attachment'] = json.loads(row['attachments'])
+        return payload
+
+    def _batch_payload(self, rows):
+        payload = self._base_payload(rows[0])
+        # Top-level content is required; every version overrides it with its own
+        payload['subject'] = rows[0]['subject']
+        payload['htmlContent'] = rows[0]['html']
+        payload['messageVersions'] = [{
+            "to": [{"email": row['to_email']}],
+            "subject": row['subject'],
+            "htmlContent": row['html']
+        } for row in rows]
+        return payload
+
+    # --- Consuming ---
+
+    def _claim(self):
+        """
+        Takes the next due messages. Rows left in 'sending' by a leader that died
+        mid-delivery are due again once their lease (MAIL_LEASE_SECONDS) runs out.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT * FROM outbound_mail WHERE (status IN ('queued', 'retrying') AND next_attempt_at <= ?) "
+                "OR (status = 'sending' AND locked_at < ?) "
+                "ORDER BY next_attempt_at LIMIT ?", (now, now - MAIL_LEASE_SECONDS, MAIL_BATCH_SIZE * 4)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbound_mail SET status = 'sending', attempts = attempts + 1, locked_at = ? WHERE id = ?",
+                    [(now, row['id']) for row in rows]
+                )
+            conn.execute('COMMIT')
+            return [dict(row, attempts=row['attempts'] + 1) for row in rows]
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _admit(self, rows):
+        """Applies the rate limits. Returns the rows that may go now; the rest are pushed back."""
+        admitted, deferred = [], []
+        for row in rows:
+            wait = self._company_buckets[row['company_id'] or 'platform'].take()
+            if not wait:
+                wait = self._sender_buckets[row['sender_email']].take()
+            if wait:
+                deferred.append((row, wait))
+            else:
+                admitted.append(row)
+        if deferred:
+            now = time.time()
+            # Throttling doesn't count as an attempt
+            self._connect().executemany(
+                "UPDATE outbound_mail SET status = 'queued', attempts = attempts - 1, locked_at = NULL, "
+                "next_attempt_at = ? WHERE id = ?",
+                [(now + wait, row['id']) for row, wait in deferred]
+            )
+        return admitted
+
+    @staticmethod
+    def _group(rows):
+        """Batches rows that can share one messageVersions request; attachments go alone."""
+        groups = defaultdict(list)
+        singles = []
+        for row in rows:
+            if row['attachments']:
+                singles.append([row])
+            else:
+                groups[(row['sender_email'], row['sender_name'], row['reply_to'])].append(row)
+        batches = []
+        for group in groups.values():
+            for i in range(0, len(group), MAIL_BATCH_SIZE):
+                batches.append(group[i:i + MAIL_BATCH_SIZE])
+        return batches + singles
+
+    def _deliver(self, batch):
+        payload = self._single_payload(batch[0]) if len(batch) == 1 else self._batch_payload(batch)
+        try:
+            status, body, retry_after = self.transport.send(payload)
+        except Exception as e:
+            self._record_failure(batch, f"Connection error: {e}", retryable=True)
+            return
+
+        if 200 <= status < 300:
+            ids = body.get('messageIds') or [body.get('messageId')] * len(batch)
+            now = time.time()
+            self._connect().executemany(
+                "UPDATE outbound_mail SET status = 'sent', locked_at = NULL, last_error = NULL, "
+                "provider_message_id = ?, sent_at = ? WHERE id = ?",
+                [(ids[i] if i < len(ids) else None, now, row['id']) for i, row in enumerate(batch)]
+            )
+        else:
+            message = f"HTTP {status}: {body.get('message', body) if isinstance(body, dict) else body}"
+            print(f"[MAIL] Delivery of {len(batch)} message(s) failed: {message}")
+            retryable = status == 429 or status >= 500
+            if not retryable and len(batch) > 1:
+                # One bad message (e.g. a malformed address) rejects the whole batch;
+                # send them one by one so only that message is failed
+                for row in batch:
+                    self._deliver([row])
+                return
+            self._record_failure(batch, message, retryable=retryable, retry_after=retry_after)
+
+    def _record_failure(self, batch, error, retryable, retry_after=None):
+        now = time.time()
+        updates = []
+        for row in batch:
+            if retryable and row['attempts'] < MAIL_MAX_ATTEMPTS:
+                delay = retry_after or MAIL_BACKOFF_BASE * (2 ** (row['attempts'] - 1)) * random.uniform(0.8, 1.2)
+                updates.append(('retrying', error, now + delay, row['id']))
+            else:
+                updates.append(('failed', error, now, row['id']))
+        self._connect().executemany(
+            "UPDATE outbound_mail SET status = ?, locked_at = NULL, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            updates
+        )
+
+    def _work(self):
+        while not self._stopping.is_set():
+            rows = []
+            if leader.is_leader():
+                try:
+                    rows = self._claim()
+                    if rows:
+                        for batch in self._group(self._admit(rows)):
+                            self._deliver(batch)
+                    self._purge_old()
+                except Exception as e:
+                    print(f"[MAIL] Dispatch loop error: {e}")
+            if not rows:
+                self._wakeup.wait(MAIL_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _purge_old(self):
+        """Trims delivered messages out of the log once a day."""
+        if time.monotonic() - self._purged_at < 86400:
+            return
+        self._purged_at = time.monotonic()
+        cutoff = time.time() - MAIL_LOG_RETENTION_DAYS * 86400
+        self._connect().execute("DELETE FROM outbound_mail WHERE status = 'sent' AND sent_at < ?", (cutoff,))
+
+    # --- Delivery log ---
+
+    def status(self, mail_id):
+        row = self._connect().execute(
+            "SELECT id, to_email, subject, status, attempts, last_error, provider_message_id, created_at, sent_at "
+            "FROM outbound_mail WHERE id = ?", (mail_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def recent(self, status=None, limit=50):
+        query = ("SELECT id, company_id, to_email, subject, status, attempts, last_error, provider_message_id, "
+                 "created_at, sent_at FROM outbound_mail")
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        return [dict(r) for r in self._connect().execute(query, params).fetchall()]
+
+    def counts(self):
+        if self.db_path is None:
+            return {}
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM outbound_mail GROUP BY status").fetchall()
+        return {r['status']: r['n'] for r in rows}
+
+    def retry(self, mail_id):
+        """Puts a failed message back in the queue with a fresh set of attempts."""
+        cur = self._connect().execute(
+            "UPDATE outbound_mail SET status = 'queued', attempts = 0, next_attempt_at = ? WHERE id = ? AND status = 'failed'",
+            (time.time(), mail_id)
+        )
+        self._wakeup.set()
+        return cur.rowcount == 1
+
+
+mailer = MailDispatcher()
@@ -0,0 +1,120 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, make_response
+from database import get_saas_settings, get_saas_settings_version
+from product_catalog import catalog
+
+# --- Public Page Cache ---
+# The storefront pages (/shop, /product/<id>, /purchase, /contact) look the same
+# for every anonymous visitor. Their rendered HTML is kept per worker, keyed by
+# path + the query args that change the page + the settings and catalog
+# versions, so an edit to either produces a new key. Entries also expire after
+# PAGE_CACHE_TTL for changes we can't see (reviews approved from the admin app).
+#
+# Only plain anonymous GETs are cached: no logged-in user, nothing in the cart
+# and no pending flash messages, since those all change the rendered page.
+# Responses carry an ETag and Last-Modified, so repeat visits get a 304.
+
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 60))
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 256))
+
+_pages = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "not_modified": 0}
+
+# Session keys that make a page personal
+_PERSONAL_SESSION_KEYS = ('user', 'cart', '_flashes')
+
+
+def _cacheable():
+    if request.method != 'GET':
+        return False
+    return not any(session.get(k) for k in _PERSONAL_SESSION_KEYS)
+
+
+def _cache_key(arg_names):
+    args = tuple((name, request.args.get(name, '').strip().lower()) for name in arg_names)
+    # Make sure the versions reflect the current data before keying on them
+    get_saas_settings()
+    return (request.path, args, get_saas_settings_version(), catalog.current_version())
+
+
+def _respond(entry, status_label):
+    response = make_response(entry["body"])
+    response.mimetype = entry["mimetype"]
+    response.set_etag(entry["etag"])
+    response.last_modified = entry["last_modified"]
+    response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    response.headers['Vary'] = 'Cookie'
+    response.headers['X-Page-Cache'] = status_label
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        _stats["not_modified"] += 1
+    return response
+
+
+def cached_page(arg_names=()):
+    """Caches the rendered response of a public GET view. `arg_names` lists the query args that matter."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _cacheable():
+                _stats["bypassed"] += 1
+                return f(*args, **kwargs)
+
+            key = _cache_key(arg_names)
+            now = time.monotonic()
+            with _lock:
+                entry = _pages.get(key)
+                if entry and now - entry["stored_at"] < PAGE_CACHE_TTL:
+                    _pages.move_to_end(key)
+                else:
+                    entry = None
+            if entry:
+                _stats["hits"] += 1
+                return _respond(entry, 'HIT')
+
+            _stats["misses"] += 1
+            response = make_response(f(*args, **kwargs))
+            # Only keep successful full pages (not redirects, errors, or pages that flashed)
+            if response.status_code != 200 or response.direct_passthrough or not _cacheable():
+                return response
+
+            body = response.get_data()
+            entry = {
+                "body": body,
+                "mimetype": response.mimetype,
+                "etag": hashlib.sha1(body).hexdigest(),
+                "last_modified": datetime.now(timezone.utc).replace(microsecond=0),
+                "stored_at": now,
+            }
+            with _lock:
+                _pages[key] = entry
+                _pages.move_to_end(key)
+                while len(_pages) > PAGE_CACHE_MAX_ENTRIES:
+                    _pages.popitem(last=False)
+            return _respond(entry, 'MISS')
+        return wrapper
+    return decorator
+
+
+def invalidate_pages(path_prefix=None):
+    """Drops cached pages (all of them, or those whose path starts with `path_prefix`)."""
+    with _lock:
+        if path_prefix is None:
+            _pages.clear()
+        else:
+            for key in [k for k in _pages if k[0].startswith(path_prefix)]:
+                _pages.pop(key, None)
+
+
+def page_cache_stats():
+    stats = dict(_stats)
+    stats["entries"] = len(_pages)
+    stats["ttl"] = PAGE_CACHE_TTL
+    return stats
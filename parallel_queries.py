@@ -0,0 +1,51 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# --- Parallel Read Fan-Out ---
+# Dashboards issue several independent Supabase reads. Running them one after
+# another costs the sum of the round trips; running them together costs the
+# slowest one. Reads that fail or miss the deadline fall back to their default
+# so the page still renders with what did arrive.
+#
+#   results, failed = run_parallel({
+#       'tickets': (lambda: supabase.table(...).execute(), None),
+#       'ads': (get_portal_ads, []),
+#   }, deadline=3.0)
+
+QUERY_POOL_WORKERS = int(os.environ.get('QUERY_POOL_WORKERS', 16))
+QUERY_DEADLINE = float(os.environ.get('QUERY_DEADLINE', 4.0))
+
+_pool = ThreadPoolExecutor(max_workers=QUERY_POOL_WORKERS, thread_name_prefix='query')
+
+
+def run_parallel(tasks, deadline=QUERY_DEADLINE):
+    """
+    Runs each `name: (callable, default)` concurrently and waits at most `deadline` seconds.
+    Returns (results, failed): `results` has every name (the default where a task
+    raised or timed out) and `failed` is the set of names that didn't complete.
+    """
+    started = time.perf_counter()
+    futures = {name: _pool.submit(fn) for name, (fn, _) in tasks.items()}
+    wait(list(futures.values()), timeout=deadline)
+
+    results, failed = {}, set()
+    for name, future in futures.items():
+        default = tasks[name][1]
+        if not future.done():
+            # Leave it running; the result is simply dropped
+            print(f"[PARALLEL] '{name}' missed the {deadline}s deadline.")
+            results[name] = default
+            failed.add(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"[PARALLEL] '{name}' failed: {e}")
+            results[name] = default
+            failed.add(name)
+
+    if failed:
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"[PARALLEL] {len(tasks) - len(failed)}/{len(tasks)} reads completed in {elapsed:.0f} ms.")
+    return results, failed
@@ -0,0 +1,225 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from flask import send_file
+from database import supabase
+
+# --- Content-Addressed PDF Store ---
+# A paid invoice's receipt (or a payslip) never changes, but it used to be
+# re-rendered with reportlab on every view. PDFs are now stored under a hash of
+# everything that goes into them - the row content, the company details and the
+# template version - so the same inputs always map to the same key, and any
+# change to them simply produces a new one (nothing to invalidate).
+#
+#   key = pdf_key('receipt', invoice_row, customer, company_details)
+#   pdf_bytes = pdf_store.get_or_render(key, lambda: invoice_utils.create_...(...))
+#   return send_pdf(key, pdf_bytes, 'Receipt_INV-1.pdf')
+#
+# Tiers, fastest first:
+#   * memory   - per-worker LRU, capped at PDF_CACHE_MEMORY_BYTES
+#   * disk     - instance/pdf_cache, shared by the workers on this host
+#   * storage  - Supabase Storage bucket PDF_CACHE_BUCKET, when set (shared by all hosts)
+# The key doubles as a strong ETag, so repeat views get a 304.
+
+PDF_TEMPLATE_VERSION = 1  # Bump when the layouts in invoice_utils change
+PDF_CACHE_MEMORY_BYTES = int(os.environ.get('PDF_CACHE_MEMORY_BYTES', 32 * 1024 * 1024))
+PDF_CACHE_DISK_MAX_BYTES = int(os.environ.get('PDF_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+PDF_CACHE_BUCKET = os.environ.get('PDF_CACHE_BUCKET')
+
+
+def pdf_key(kind, *parts):
+    """Content hash of a document kind, the template version and everything rendered into it."""
+    material = json.dumps([kind, PDF_TEMPLATE_VERSION, parts], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class PdfStore:
+    def __init__(self):
+        self.disk_dir = None
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._rendering = {}  # key -> Lock, so one key is only rendered once at a time
+        self._puts_since_prune = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "storage_hits": 0, "renders": 0, "errors": 0}
+
+    def init_app(self, app, disk_dir=None):
+        self.disk_dir = disk_dir or os.path.join(app.instance_path, 'pdf_cache')
+        os.makedirs(self.disk_dir, exist_ok=True)
+
+    # --- Memory tier ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def _memory_put(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > PDF_CACHE_MEMORY_BYTES and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    # --- Disk tier ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pdf")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Readers never see a half-written file
+        except OSError as e:
+            print(f"[PDF_STORE] Disk write failed for {key}: {e}")
+            return
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= 100:
+            self._puts_since_prune = 0
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes the least recently written files once the disk tier is over its cap."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= PDF_CACHE_DISK_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # --- Storage tier ---
+
+    def _storage_get(self, key):
+        if not PDF_CACHE_BUCKET:
+            return None
+        try:
+            return supabase.storage.from_(PDF_CACHE_BUCKET).download(f"{key[:2]}/{key}.pdf") or None
+        except Exception:
+            return None
+
+    def _storage_put(self, key, data):
+        if not PDF_CACHE_BUCKET:
+            return
+        try:
+            supabase.storage.from_(PDF_CACHE_BUCKET).upload(
+                path=f"{key[:2]}/{key}.pdf",
+                file=data,
+                file_options={"content-type": "application/pdf", "upsert": "true"}
+            )
+        except Exception as e:
+            print(f"[PDF_STORE] Storage upload failed for {key}: {e}")
+
+    # --- Public API ---
+
+    def get(self, key):
+        """Returns the stored PDF bytes for `key`, or None. Lower-tier hits are copied upwards."""
+        data = self._memory_get(key)
+        if data is not None:
+            self.stats["memory_hits"] += 1
+            return data
+        data = self._disk_get(key)
+        if data is not None:
+            self.stats["disk_hits"] += 1
+            self._memory_put(key, data)
+            return data
+        data = self._storage_get(key)
+        if data is not None:
+            self.stats["storage_hits"] += 1
+            self._memory_put(key, data)
+            self._disk_put(key, data)
+            return data
+        return None
+
+    def put(self, key, data):
+        self._memory_put(key, data)
+        self._disk_put(key, data)
+        self._storage_put(key, data)
+
+    def get_or_render(self, key, render):
+        """
+        Returns the PDF for `key`, calling `render()` only if no tier has it.
+        `render` follows the invoice_utils convention and returns (success, bytes_or_error).
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            key_lock = self._rendering.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                data = self.get(key)  # Someone else may have rendered it while we waited
+                if data is None:
+                    success, result = render()
+                    if not success:
+                        self.stats["errors"] += 1
+                        raise Exception(f"PDF generation failed: {result}")
+                    self.stats["renders"] += 1
+                    data = result
+                    self.put(key, data)
+        finally:
+            with self._lock:
+                self._rendering.pop(key, None)
+        return data
+
+    def stats_snapshot(self):
+        stats = dict(self.stats)
+        stats["memory_entries"] = len(self._memory)
+        stats["memory_bytes"] = self._memory_bytes
+        stats["bucket"] = PDF_CACHE_BUCKET
+        return stats
+
+
+pdf_store = PdfStore()
+
+
+def send_pdf(key, pdf_bytes, download_name, as_attachment=False):
+    """Sends a stored PDF with the content key as a strong ETag (If-None-Match gets a 304)."""
+    response = send_file(
+        BytesIO(pdf_bytes),
+        mimetype='application/pdf',
+        as_attachment=as_attachment,
+        download_name=download_name,
+        etag=key,
+        conditional=True
+    )
+    # Receipts and payslips are personal: browsers may keep them, shared caches may not
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.no_cache = True
+    return response
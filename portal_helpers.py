@@ -1,8 +1,160 @@
+import os
+import time
+import atexit
 import datetime
 import threading
+from contextlib import contextmanager
 from database import supabase
 import routeros_api
+from routeros_api.exceptions import RouterOsApiCommunicationError
 import email_service
+from task_executor import tasks
+
+# --- RouterOS Connection Pool ---
+# Logging in to a MikroTik over the API costs a TCP connect plus a login round
+# trip. Connections are kept per (ip, port, user) and re-used; idle ones are
+# health-checked before reuse and closed after ROUTER_POOL_IDLE_SECONDS, and the
+# rest are logged out cleanly when the worker exits.
+ROUTER_POOL_MAX_IDLE = int(os.environ.get('ROUTER_POOL_MAX_IDLE', 2))
+ROUTER_POOL_IDLE_SECONDS = float(os.environ.get('ROUTER_POOL_IDLE_SECONDS', 120))
+ROUTER_HEALTHCHECK_AFTER = float(os.environ.get('ROUTER_HEALTHCHECK_AFTER', 30))
+ROUTER_SECRET_CACHE_TTL = float(os.environ.get('ROUTER_SECRET_CACHE_TTL', 300))
+
+
+class RouterConnectionPool:
+    def __init__(self):
+        self._idle = {}      # (ip, port, user) -> [(RouterOsApiPool, api, password, last_used)]
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"opened": 0, "reused": 0, "evicted": 0, "broken": 0}
+
+    def _open(self, ip, port, user, password):
+        connection = routeros_api.RouterOsApiPool(
+            ip,
+            username=user,
+            password=password,
+            port=port,
+            plaintext_login=True
+        )
+        api = connection.get_api()
+        self.stats["opened"] += 1
+        return connection, api
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _healthy(api):
+        try:
+            api.get_resource('/system/identity').get()
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self, now):
+        expired = []
+        with self._lock:
+            for key, entries in self._idle.items():
+                keep = []
+                for entry in entries:
+                    (expired if now - entry[3] > ROUTER_POOL_IDLE_SECONDS else keep).append(entry)
+                self._idle[key] = keep
+        for entry in expired:
+            self.stats["evicted"] += 1
+            self._close(entry[0])
+
+    def _checkout(self, key, password):
+        now = time.monotonic()
+        self._evict_idle(now)
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                entry = entries.pop() if entries else None
+            if entry is None:
+                return None
+            connection, api, entry_password, last_used = entry
+            # Credentials changed in the dashboard: drop the old login
+            if entry_password != password:
+                self._close(connection)
+                continue
+            if now - last_used > ROUTER_HEALTHCHECK_AFTER and not self._healthy(api):
+                self.stats["broken"] += 1
+                self._close(connection)
+                continue
+            self.stats["reused"] += 1
+            return connection, api
+
+    def _checkin(self, key, connection, api, password):
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            if not self._closed and len(entries) < ROUTER_POOL_MAX_IDLE:
+                entries.append((connection, api, password, time.monotonic()))
+                return
+        self._close(connection)
+
+    @contextmanager
+    def connection(self, ip, port, user, password):
+        """Yields a logged-in RouterOS api object; it goes back to the pool unless the block raised."""
+        key = (ip, int(port), user)
+        pooled = self._checkout(key, password)
+        if pooled is None:
+            pooled = self._open(ip, int(port), user, password)
+        connection, api = pooled
+        try:
+            yield api
+        except Exception:
+            self.stats["broken"] += 1
+            self._close(connection)
+            raise
+        else:
+            self._checkin(key, connection, api, password)
+
+    def close_all(self):
+        """Logs out every idle connection; ones still in use are closed when they come back."""
+        with self._lock:
+            self._closed = True
+            entries = [e for group in self._idle.values() for e in group]
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry[0])
+
+
+router_pool = RouterConnectionPool()
+atexit.register(router_pool.close_all)
+
+# name -> .id map of /ppp/secret per router, so a lookup isn't a full round trip every time
+_secret_ids = {}
+_secret_ids_lock = threading.Lock()
+
+
+def _load_secret_ids(key, api):
+    rows = api.get_resource('/ppp/secret').get()
+    ids = {row.get('name'): row.get('id') for row in rows if row.get('name')}
+    with _secret_ids_lock:
+        _secret_ids[key] = (ids, time.monotonic())
+    return ids
+
+
+def _secret_id_map(key, api, refresh=False):
+    with _secret_ids_lock:
+        cached = _secret_ids.get(key)
+    if not refresh and cached and time.monotonic() - cached[1] < ROUTER_SECRET_CACHE_TTL:
+        return cached[0]
+    return _load_secret_ids(key, api)
+
+
+def invalidate_secret_ids(ip=None, port=8728, user=None):
+    """Forgets the cached /ppp/secret ids for one router (or all routers)."""
+    with _secret_ids_lock:
+        if ip is None:
+            _secret_ids.clear()
+        else:
+            _secret_ids.pop((ip, int(port), user), None)
+
 
 class PortalRouterManager:
     def __init__(self, ip, user, password, port=8728):
@@ -11,45 +163,63 @@ class PortalRouterManager:
         self.password = password
         self.port = int(port)
 
+    def _key(self):
+        return (self.ip, self.port, self.user)
+
     def connect(self):
-        if not self.ip: return None
+        """Pooled connection context manager (see RouterConnectionPool)."""
+        return router_pool.connection(self.ip, self.port, self.user, self.password)
+
+    def set_secrets_disabled(self, usernames, disabled):
+        """
+        Enables or disables many PPPoE secrets over a single connection.
+        Returns {username: True/False}; False means not found or the router refused.
+        """
+        results = {name: False for name in usernames}
+        if not self.ip or not usernames:
+            return results
+        state = 'yes' if disabled else 'no'
+        action = 'disabled' if disabled else 'enabled'
+
         try:
-            connection = routeros_api.RouterOsApiPool(
-                self.ip,
-                username=self.user,
-                password=self.password,
-                port=self.port,
-                plaintext_login=True
-            )
-            return connection
+            with self.connect() as api:
+                secrets = api.get_resource('/ppp/secret')
+                ids = _secret_id_map(self._key(), api)
+                # New customers may have been added since the map was cached
+                if any(name not in ids for name in usernames):
+                    ids = _secret_id_map(self._key(), api, refresh=True)
+
+                for username in usernames:
+                    secret_id = ids.get(username)
+                    if not secret_id:
+                        print(f"⚠️ Router: User {username} not found.")
+                        continue
+                    try:
+                        secrets.set(id=secret_id, disabled=state)
+                    except RouterOsApiCommunicationError:
+                        # Stale id (secret re-created on the router): look it up again once
+                        ids = _secret_id_map(self._key(), api, refresh=True)
+                        if not ids.get(username):
+                            print(f"⚠️ Router: User {username} not found.")
+                            continue
+                        secrets.set(id=ids[username], disabled=state)
+                    results[username] = True
+                    print(f"✅ Router: User {username} {action} successfully.")
         except Exception as e:
-            print(f"Router Connection Error: {e}")
-            return None
+            print(f"❌ Router Error: {e}")
+        return results
 
     def enable_internet(self, username):
         """Enables a PPPoE user on the router."""
-        connection = self.connect()
-        if not connection: return False
-        
-        try:
-            api = connection.get_api()
-            secrets = api.get_resource('/ppp/secret')
-            user = secrets.get(name=username)
-            
-            if user:
-                secrets.set(id=user[0]['id'], disabled='no')
-                print(f"✅ Router: User {username} enabled successfully.")
-                return True
-            else:
-                print(f"⚠️ Router: User {username} not found.")
-                return False
-        except Exception as e:
-            print(f"❌ Router Error: {e}")
-            return False
-        finally:
-            connection.disconnect()
+        return self.set_secrets_disabled([username], disabled=False).get(username, False)
 
-def reactivate_service(customer_id):
+def reactivate_service(customer_id, wait_for_router=False):
+    """
+    Marks the customer Active, emails them if they were suspended and re-enables
+    their PPPoE secret. With wait_for_router=True (the durable job) the router call
+    runs inline and a failure is returned, so the job is retried; otherwise it is
+    handed to the router pool and this returns straight away.
+    """
     print(f"--- Reactivating Service for Customer ID: {customer_id} ---")
     
     next_due = datetime.date.today() + datetime.timedelta(days=30)
@@ -103,9 +273,14 @@ def reactivate_service(customer_id):
                 password=settings.get('router_password'),
                 port=settings.get('router_api_port', 8728)
             )
-            router.enable_internet(username)
+            return router.enable_internet(username)
 
-        threading.Thread(target=router_task, daemon=True).start()
+        if wait_for_router:
+            if not router_task():
+                return False, f"Database updated, but the router did not enable {username}."
+        else:
+            # Router pool (see task_executor.py) instead of a thread per call
+            tasks.submit('router', router_task)
         
         return True, f"Service reactivated for {username}."
             
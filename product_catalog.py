@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+from database import supabase
+
+# --- In-Memory Product Catalog ---
+# The cart routes used to download the whole 'get_products_with_reviews' result
+# just to pick out one or two products. We keep that result per worker, indexed
+# by product id and category, and refresh it in the background of normal traffic:
+#   * every CATALOG_TTL seconds, fetch only rows whose updated_at moved
+#   * every CATALOG_FULL_RELOAD seconds, reload everything (deletes, review counts)
+# Stock shown from here can be slightly stale; checkout re-checks the DB.
+#
+# Ids the RPC doesn't return (hidden products, rows newer than the last
+# refresh) are read straight from the 'products' table on a cart lookup. Those
+# rows are kept apart, for CATALOG_TTL, and never become part of the listed
+# catalog (all(), by_category(), search) or move the incremental watermark.
+
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', 30))
+CATALOG_FULL_RELOAD = float(os.environ.get('CATALOG_FULL_RELOAD', 600))
+
+
+class ProductCatalog:
+    def __init__(self, ttl=CATALOG_TTL, full_reload=CATALOG_FULL_RELOAD):
+        self.ttl = ttl
+        self.full_reload = full_reload
+        self._by_id = {}
+        self._by_category = {}
+        self._fallback = {}          # product_id -> (fetched_at, row) for ids the RPC didn't return
+        self._watermark = None       # Highest updated_at seen so far
+        self._checked_at = 0.0       # Last refresh attempt (monotonic)
+        self._full_at = 0.0          # Last full reload (monotonic)
+        self._version = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "full_reloads": 0, "incremental": 0, "errors": 0}
+
+    # --- Loading ---
+
+    def _rpc(self):
+        return supabase.rpc('get_products_with_reviews', {'p_search_term': ""})
+
+    def _index(self, rows, replace=False):
+        by_id = {} if replace else dict(self._by_id)
+        for row in rows:
+            by_id[str(row['id'])] = row
+            stamp = row.get('updated_at')
+            if stamp and (self._watermark is None or stamp > self._watermark):
+                self._watermark = stamp
+
+        by_category = {}
+        for pid, row in by_id.items():
+            by_category.setdefault(str(row.get('category_id')), []).append(pid)
+
+        # Swap whole dicts so readers never see a half-built index
+        self._by_id = by_id
+        self._by_category = by_category
+        self._version += 1
+
+    def _load_full(self, now):
+        res = self._rpc().execute()
+        self._watermark = None
+        self._index(res.data or [], replace=True)
+        self._fallback = {}
+        self._full_at = now
+        self.stats["full_reloads"] += 1
+
+    def _load_changed(self):
+        res = self._rpc().gt('updated_at', self._watermark).execute()
+        if res.data:
+            self._index(res.data)
+        self.stats["incremental"] += 1
+
+    def _refresh(self, force_full=False):
+        now = time.monotonic()
+        try:
+            if force_full or not self._by_id or self._watermark is None or now - self._full_at >= self.full_reload:
+                self._load_full(now)
+            else:
+                self._load_changed()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[CATALOG] Refresh failed: {e}")
+        finally:
+            self._checked_at = now
+
+    def _ensure_fresh(self):
+        if time.monotonic() - self._checked_at < self.ttl:
+            return
+        if self._by_id:
+            # Somebody else is refreshing; keep serving what we have.
+            if not self._lock.acquire(blocking=False):
+                return
+        else:
+            self._lock.acquire()
+        try:
+            if time.monotonic() - self._checked_at >= self.ttl:
+                self._refresh()
+        finally:
+            self._lock.release()
+
+    def _fetch_missing(self, product_ids):
+        """
+        Direct table read for ids the catalog does not know (new or hidden from the RPC).
+        Results go to the fallback side table only (see the note at the top).
+        """
+        now = time.monotonic()
+        fallback = self._fallback
+        found = {}
+        to_fetch = []
+        for pid in product_ids:
+            entry = fallback.get(pid)
+            if entry and now - entry[0] < self.ttl:
+                found[pid] = entry[1]
+            else:
+                to_fetch.append(pid)
+        if to_fetch:
+            try:
+                res = supabase.table('products').select('*').in_('id', to_fetch).execute()
+                rows = res.data or []
+            except Exception as e:
+                print(f"[CATALOG] Fallback fetch failed: {e}")
+                rows = []
+            for row in rows:
+                pid = str(row['id'])
+                fallback[pid] = (now, row)
+                found[pid] = row
+        return found
+
+    # --- Lookups ---
+
+    def get(self, product_id):
+        """Returns one product (a copy) or None."""
+        found = self.get_many([product_id])
+        return found[0] if found else None
+
+    def get_many(self, product_ids):
+        """Returns the products for the given ids, in the same order, skipping unknown ids."""
+        self._ensure_fresh()
+        ids = [str(pid) for pid in product_ids]
+        by_id = self._by_id
+        missing = [pid for pid in ids if pid not in by_id]
+        self.stats["hits"] += len(ids) - len(missing)
+        if missing:
+            self.stats["misses"] += len(missing)
+            by_id = dict(by_id)
+            by_id.update(self._fetch_missing(missing))
+        return [dict(by_id[pid]) for pid in ids if pid in by_id]
+
+    def by_category(self, category_id):
+        """Returns every listed (RPC) product in a category."""
+        self._ensure_fresh()
+        by_id = self._by_id
+        return [dict(by_id[pid]) for pid in self._by_category.get(str(category_id), []) if pid in by_id]
+
+    def listed(self):
+        """Every listed (RPC) product; fallback rows are never included."""
+        self._ensure_fresh()
+        return [dict(p) for p in self._by_id.values()]
+
+    def update_stock(self, product_id, stock_quantity):
+        """Writes a freshly read stock figure back into the cache."""
+        row = self._by_id.get(str(product_id))
+        if row is None:
+            entry = self._fallback.get(str(product_id))
+            row = entry[1] if entry else None
+        if row is not None:
+            row['stock_quantity'] = stock_quantity
+
+    def version(self):
+        """Changes every time the cached catalog changes."""
+        return self._version
+
+    def current_version(self):
+        """Like version(), but refreshes the catalog first if it is past its TTL."""
+        self._ensure_fresh()
+        return self._version
+
+    def invalidate(self):
+        """Forces a full reload on the next lookup."""
+        with self._lock:
+            self._checked_at = 0.0
+            self._full_at = 0.0
+
+
+catalog = ProductCatalog()
+
+
+def check_live_stock(cart):
+    """
+    Re-reads stock from the products table for every item in the cart.
+    Returns a list of (product_id, requested, available) for items that are short.
+    """
+    product_ids = list(cart.keys())
+    if not product_ids:
+        return []
+    res = supabase.table('products').select('id, stock_quantity').in_('id', product_ids).execute()
+    live = {str(row['id']): (row.get('stock_quantity') or 0) for row in (res.data or [])}
+
+    short = []
+    for pid, qty in cart.items():
+        available = live.get(str(pid), 0)
+        catalog.update_stock(pid, available)
+        if int(qty) > available:
+            short.append((str(pid), int(qty), available))
+    return short
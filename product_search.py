@@ -0,0 +1,226 @@
+import re
+import bisect
+import threading
+from collections import defaultdict
+from database import supabase
+from product_catalog import catalog
+
+# --- Local Product Search Index ---
+# An inverted index over product name, category and description, kept in step
+# with the in-memory catalog (product_catalog.py). Only products whose indexed
+# fields changed are re-tokenized when the catalog moves on. Only products the
+# catalog RPC lists are indexed; hidden products fetched directly by id for a
+# cart never show up in /shop or search results.
+#
+# Matching, per query term, best first:
+#   exact token   - 1.0
+#   prefix        - 0.7  ("rout" -> "router")
+#   one typo      - 0.5  ("ruoter", "routr" -> "router"; terms of 4+ chars)
+# A product has to match every query term. Its score adds up the match
+# quality times the field weight, so name hits outrank description hits.
+
+FIELD_WEIGHTS = {'name': 3.0, 'category': 2.0, 'description': 1.0}
+MATCH_EXACT, MATCH_PREFIX, MATCH_FUZZY = 1.0, 0.7, 0.5
+FUZZY_MIN_LENGTH = 4
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def _deletes(term):
+    """The term with each single character removed (symmetric-delete typo lookup)."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by one insert, delete, substitution or adjacent swap."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diffs = [i for i in range(la) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+    if la > lb:
+        a, b = b, a
+    # b is one longer than a: skip one char of b
+    i = j = 0
+    skipped = False
+    while i < len(a) and j < len(b):
+        if a[i] != b[j]:
+            if skipped:
+                return False
+            skipped = True
+            j += 1
+            continue
+        i += 1
+        j += 1
+    return True
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._postings = defaultdict(dict)   # token -> {product_id: best field weight}
+        self._doc_tokens = {}                # product_id -> set of tokens (for removal)
+        self._doc_signature = {}             # product_id -> indexed field values
+        self._vocab = []                     # sorted tokens, for prefix lookups
+        self._delete_map = defaultdict(set)  # single-delete variant -> tokens
+        self._categories = {}                # category_id -> name
+        self._products = {}                  # product_id -> product dict
+        self._synced_version = None
+        self._lock = threading.Lock()
+
+    # --- Index maintenance ---
+
+    def _load_categories(self):
+        try:
+            res = supabase.table('product_categories').select('id, name').execute()
+            self._categories = {str(c['id']): c.get('name') or '' for c in (res.data or [])}
+        except Exception as e:
+            print(f"[SEARCH] Could not load categories: {e}")
+
+    def _signature(self, product):
+        return (product.get('name'), product.get('description'), str(product.get('category_id')),
+                self._categories.get(str(product.get('category_id')), ''))
+
+    def _remove(self, pid):
+        for token in self._doc_tokens.pop(pid, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(pid, None)
+                if not postings:
+                    del self._postings[token]
+        self._doc_signature.pop(pid, None)
+
+    def _add(self, pid, product):
+        fields = {
+            'name': product.get('name'),
+            'category': self._categories.get(str(product.get('category_id')), ''),
+            'description': product.get('description'),
+        }
+        tokens = set()
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                postings = self._postings[token]
+                if postings.get(pid, 0) < weight:
+                    postings[pid] = weight
+                tokens.add(token)
+        self._doc_tokens[pid] = tokens
+        self._doc_signature[pid] = self._signature(product)
+
+    def _rebuild_lookup_tables(self):
+        self._vocab = sorted(self._postings)
+        delete_map = defaultdict(set)
+        for token in self._vocab:
+            if len(token) >= FUZZY_MIN_LENGTH - 1:
+                delete_map[token].add(token)
+                for variant in _deletes(token):
+                    delete_map[variant].add(token)
+        self._delete_map = delete_map
+
+    def sync(self):
+        """Brings the index up to date with the catalog; only changed products are re-indexed."""
+        version = catalog.current_version()
+        if version == self._synced_version:
+            return
+        with self._lock:
+            if version == self._synced_version:
+                return
+            self._load_categories()
+            products = {str(p['id']): p for p in catalog.listed()}
+
+            changed = 0
+            for pid in [pid for pid in self._doc_tokens if pid not in products]:
+                self._remove(pid)
+                changed += 1
+            for pid, product in products.items():
+                if self._doc_signature.get(pid) != self._signature(product):
+                    self._remove(pid)
+                    self._add(pid, product)
+                    changed += 1
+            if changed:
+                self._rebuild_lookup_tables()
+            self._products = products
+            self._synced_version = version
+
+    # --- Querying ---
+
+    def _expand(self, term):
+        """Returns {token: match quality} for one query term."""
+        matches = {}
+        if term in self._postings:
+            matches[term] = MATCH_EXACT
+        start = bisect.bisect_left(self._vocab, term)
+        for token in self._vocab[start:]:
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, MATCH_PREFIX)
+        if len(term) >= FUZZY_MIN_LENGTH:
+            candidates = set(self._delete_map.get(term, ()))
+            for variant in _deletes(term):
+                candidates |= self._delete_map.get(variant, set())
+            for token in candidates:
+                if token not in matches and _within_one_edit(term, token):
+                    matches[token] = MATCH_FUZZY
+        return matches
+
+    def search(self, query, category_id=None, limit=None):
+        """
+        Returns (products, facets). `products` are catalog dicts (copies) with a
+        '_score', best first; `facets` maps category_id -> matching product count.
+        """
+        self.sync()
+        with self._lock:
+            return self._search(tokenize(query), category_id, limit)
+
+    def _search(self, terms, category_id, limit):
+        products = self._products
+
+        if not terms:
+            scores = {pid: 0.0 for pid in products}
+        else:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for token, quality in self._expand(term).items():
+                    for pid, weight in self._postings[token].items():
+                        score = quality * weight
+                        if score > term_scores.get(pid, 0):
+                            term_scores[pid] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in term_scores.items() if pid in scores}
+                if not scores:
+                    break
+            scores = scores or {}
+
+        facets = defaultdict(int)
+        for pid in scores:
+            facets[str(products[pid].get('category_id'))] += 1
+
+        if category_id:
+            scores = {pid: s for pid, s in scores.items() if str(products[pid].get('category_id')) == str(category_id)}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], products[item[0]].get('name') or ''))
+        if limit:
+            ranked = ranked[:limit]
+        results = []
+        for pid, score in ranked:
+            product = dict(products[pid])
+            product['_score'] = round(score, 2)
+            results.append(product)
+        return results, dict(facets)
+
+    def category_names(self):
+        return dict(self._categories)
+
+
+search_index = ProductSearchIndex()
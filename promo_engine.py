@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from datetime import date
+from database import supabase
+
+# --- Promo Code Engine ---
+# Promo codes used to be looked up in 'product_promos' on every apply, with a
+# second 'products' query to check category targets. Active promos are now
+# loaded once per PROMO_CACHE_TTL and compiled into PromoRule objects that
+# check the date window, usage limit and product/category target in Python
+# against the cart lines (which already carry category_id from the catalog).
+#
+# The cached usage_count can lag behind other workers, so the limit check here
+# is advisory; the increment at checkout, before the order row is written, is
+# the authoritative one ('increment_promo_usage' RPC when deployed, otherwise a
+# compare-and-set update). An online order that is cancelled or fails gives its
+# use back with release_usage().
+
+PROMO_CACHE_TTL = float(os.environ.get('PROMO_CACHE_TTL', 60))
+
+
+class PromoError(Exception):
+    """A promo code that can't be used; the message is shown to the customer."""
+
+
+class PromoRule:
+    __slots__ = ('id', 'code', 'status', 'discount_type', 'value', 'start_date', 'end_date',
+                 'usage_limit', 'usage_count', 'target_product_id', 'target_category_id')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.code = (row.get('code') or '').strip().upper()
+        self.status = row.get('status')
+        self.discount_type = row.get('discount_type')
+        self.value = float(row.get('discount_value') or 0)
+        self.start_date = row.get('start_date') or '1970-01-01'
+        self.end_date = row.get('end_date') or '2099-12-31'
+        self.usage_limit = row.get('usage_limit')
+        self.usage_count = row.get('usage_count') or 0
+        self.target_product_id = str(row['target_product_id']) if row.get('target_product_id') else None
+        self.target_category_id = str(row['target_category_id']) if row.get('target_category_id') else None
+
+    def check(self, cart_lines, today=None):
+        """Raises PromoError if the promo can't be used on these cart lines."""
+        today = today or date.today().isoformat()
+        if self.status != 'Active':
+            raise PromoError(f"The promo code '{self.code}' is currently inactive.")
+        if today < self.start_date:
+            raise PromoError(f"The promo code '{self.code}' is not active yet. It starts on {self.start_date}.")
+        if today > self.end_date:
+            raise PromoError(f"The promo code '{self.code}' has expired.")
+        if self.usage_limit is not None and self.usage_count >= self.usage_limit:
+            raise PromoError(f"The promo code '{self.code}' has reached its maximum usage limit and is no longer available.")
+        if not cart_lines:
+            raise PromoError("Your cart is empty. Please add items before applying a promo code.")
+        if not self.applies_to(cart_lines):
+            raise PromoError(f"The promo code '{self.code}' is valid, but it does not apply to the items currently in your cart.")
+
+    def applies_to(self, cart_lines):
+        if self.target_product_id:
+            return any(str(line['id']) == self.target_product_id for line in cart_lines)
+        if self.target_category_id:
+            return any(str(line.get('category_id')) == self.target_category_id for line in cart_lines)
+        return True
+
+    def to_session(self):
+        return {
+            'code': self.code,
+            'type': self.discount_type,
+            'value': self.value,
+            'id': self.id,
+            'target_product_id': self.target_product_id,
+            'target_category_id': self.target_category_id
+        }
+
+
+class PromoEngine:
+    def __init__(self, ttl=PROMO_CACHE_TTL):
+        self.ttl = ttl
+        self._rules = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0, "errors": 0, "increments": 0}
+
+    def _load(self):
+        res = supabase.table('product_promos').select('*').execute()
+        rules = {}
+        for row in res.data or []:
+            rule = PromoRule(row)
+            if rule.code:
+                rules[rule.code] = rule
+        self._rules = rules
+        self._loaded_at = time.monotonic()
+        self.stats["loads"] += 1
+
+    def _ensure_fresh(self):
+        if time.monotonic() - self._loaded_at < self.ttl:
+            self.stats["hits"] += 1
+            return
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.ttl:
+                return
+            try:
+                self._load()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[PROMO] Could not load promos: {e}")
+                if not self._rules:
+                    raise
+
+    def get(self, code):
+        self._ensure_fresh()
+        return self._rules.get((code or '').strip().upper())
+
+    def validate(self, code, cart_lines):
+        """Returns the PromoRule for `code` if it can be used on the cart lines, else raises PromoError."""
+        rule = self.get(code)
+        if rule is None:
+            raise PromoError(f"The promo code '{code}' is invalid. Please check the spelling.")
+        rule.check(cart_lines)
+        return rule
+
+    def record_usage(self, code):
+        """Counts one use of a promo at order commit. Returns False if the limit was already reached."""
+        code = (code or '').strip().upper()
+        if not code:
+            return True
+        try:
+            res = supabase.rpc('increment_promo_usage', {'p_code': code}).execute()
+            ok = bool(res.data)
+        except Exception:
+            ok = self._increment_cas(code)
+        if ok:
+            self.stats["increments"] += 1
+            rule = self._rules.get(code)
+            if rule is not None:
+                rule.usage_count += 1
+        return ok
+
+    def _increment_cas(self, code, attempts=3):
+        """Compare-and-set fallback: only bumps usage_count if nobody else did in between."""
+        for _ in range(attempts):
+            try:
+                res = supabase.table('product_promos').select('id, usage_count, usage_limit').eq('code', code).execute()
+                if not res.data:
+                    return False
+                row = res.data[0]
+                count = row.get('usage_count') or 0
+                if row.get('usage_limit') is not None and count >= row['usage_limit']:
+                    return False
+                upd = supabase.table('product_promos').update({'usage_count': count + 1})\
+                    .eq('id', row['id']).eq('usage_count', count).execute()
+                if upd.data:
+                    return True
+            except Exception as e:
+                print(f"[PROMO] Usage increment for '{code}' failed: {e}")
+                return False
+        print(f"[PROMO] Usage increment for '{code}' lost the race {attempts} times.")
+        return False
+
+    def release_usage(self, code, attempts=3):
+        """Gives back one use counted by record_usage (the order was cancelled or never placed)."""
+        code = (code or '').strip().upper()
+        if not code:
+            return
+        for _ in range(attempts):
+            try:
+                res = supabase.table('product_promos').select('id, usage_count').eq('code', code).execute()
+                if not res.data or not res.data[0].get('usage_count'):
+                    return
+                row = res.data[0]
+                count = row['usage_count']
+                upd = supabase.table('product_promos').update({'usage_count': count - 1})\
+                    .eq('id', row['id']).eq('usage_count', count).execute()
+                if upd.data:
+                    rule = self._rules.get(code)
+                    if rule is not None and rule.usage_count > 0:
+                        rule.usage_count -= 1
+                    return
+            except Exception as e:
+                print(f"[PROMO] Usage release for '{code}' failed: {e}")
+                return
+        print(f"[PROMO] Usage release for '{code}' lost the race {attempts} times.")
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+promo_engine = PromoEngine()
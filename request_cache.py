@@ -0,0 +1,65 @@
+from functools import wraps
+from flask import g, has_app_context, has_request_context
+
+# --- Request-Scoped Memo Store ---
+# A single request often looks up the same row several times (company details,
+# settings, ads...). Results are stored on Flask's `g`, so they live only for the
+# current request and never leak between users.
+
+
+def _store():
+    if not hasattr(g, '_request_memo'):
+        g._request_memo = {}
+        g._request_memo_avoided = 0
+    return g._request_memo
+
+
+def memo_lookup(key, loader):
+    """
+    Returns the memoized value for `key`, calling `loader()` the first time.
+    Outside a request (background threads, scheduler) it just calls `loader()`.
+    """
+    if not (has_app_context() and has_request_context()):
+        return loader()
+
+    store = _store()
+    if key in store:
+        g._request_memo_avoided += 1
+        return store[key]
+
+    value = loader()
+    store[key] = value
+    return value
+
+
+def request_memoized(table, columns='*'):
+    """
+    Decorator for helpers that read one row per key, e.g.
+    @request_memoized('isp_companies', 'company_name, logo_url').
+    Each distinct (table, args, columns) lookup runs at most once per request.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = (table, columns, f.__name__, args, tuple(sorted(kwargs.items())))
+            return memo_lookup(key, lambda: f(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def forget(table=None):
+    """Clears memoized lookups for one table (or all) after a write in the same request."""
+    if not (has_app_context() and has_request_context()) or not hasattr(g, '_request_memo'):
+        return
+    if table is None:
+        g._request_memo.clear()
+    else:
+        for key in [k for k in g._request_memo if k[0] == table]:
+            g._request_memo.pop(key, None)
+
+
+def queries_avoided():
+    """How many lookups the memo store answered during this request."""
+    if not has_app_context():
+        return 0
+    return getattr(g, '_request_memo_avoided', 0)
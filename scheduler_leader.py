@@ -0,0 +1,151 @@
+import os
+import time
+import sqlite3
+import threading
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, always leader
+    fcntl = None
+
+# --- Scheduler Leader Election ---
+# APScheduler starts in every gunicorn worker, so without coordination each
+# scheduled job would run once per worker. Workers compete for an exclusive
+# flock() on instance/scheduler.lock; whoever holds it is the leader and is the
+# only one that actually runs jobs. The OS drops the lock when a process dies,
+# and the other workers keep retrying, so leadership moves on automatically.
+#
+#   @leader_only('check_sla_breaches')
+#   def check_sla_breaches(): ...
+#
+# Every run on the leader is recorded (duration, outcome) in
+# instance/scheduler.sqlite3.
+
+SCHEDULER_LEADER_RETRY = float(os.environ.get('SCHEDULER_LEADER_RETRY', 15))
+
+RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_name TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    duration_ms REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_job_runs_name ON job_runs (job_name, started_at);
+"""
+
+
+class SchedulerLeader:
+    def __init__(self):
+        self.lock_path = None
+        self.db_path = None
+        self._lock_file = None
+        self._is_leader = fcntl is None
+        self._elector = None
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.lock_path = os.path.join(app.instance_path, 'scheduler.lock')
+        self.db_path = os.path.join(app.instance_path, 'scheduler.sqlite3')
+        with self._connect() as conn:
+            conn.executescript(RUNS_SCHEMA)
+        self._try_acquire()
+        if self._elector is None and fcntl is not None:
+            self._elector = threading.Thread(target=self._elect_loop, name='scheduler-leader', daemon=True)
+            self._elector.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _try_acquire(self):
+        if self._is_leader or fcntl is None:
+            return self._is_leader
+        handle = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._lock_file = handle  # Keep it open: closing the file releases the lock
+        self._is_leader = True
+        print(f"[SCHEDULER] Worker {os.getpid()} is now the scheduler leader.")
+        return True
+
+    def _elect_loop(self):
+        while not self._stopping.wait(SCHEDULER_LEADER_RETRY):
+            if not self._is_leader:
+                self._try_acquire()
+
+    def is_leader(self):
+        return self._is_leader
+
+    def leader_pid(self):
+        if self._is_leader:
+            return os.getpid()
+        try:
+            with open(self.lock_path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def release(self):
+        self._stopping.set()
+        if self._lock_file is not None:
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                self._lock_file.close()
+            except Exception:
+                pass
+            self._lock_file = None
+        self._is_leader = fcntl is None
+
+    # --- Run history ---
+
+    def record_run(self, job_name, started_at, duration_ms, outcome, error=None):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO job_runs (job_name, pid, started_at, duration_ms, outcome, error) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_name, os.getpid(), started_at, duration_ms, outcome, error)
+                )
+        except Exception as e:
+            print(f"[SCHEDULER] Could not record run of {job_name}: {e}")
+
+    def recent_runs(self, limit=20):
+        if not self.db_path:
+            return []
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM job_runs ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+
+leader = SchedulerLeader()
+
+
+def leader_only(job_name):
+    """Skips the job on non-leader workers and records each run on the leader."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not leader.is_leader():
+                return None
+            started_at = time.time()
+            start = time.perf_counter()
+            try:
+                result = f(*args, **kwargs)
+            except Exception as e:
+                leader.record_run(job_name, started_at, (time.perf_counter() - start) * 1000, 'error', str(e))
+                raise
+            leader.record_run(job_name, started_at, (time.perf_counter() - start) * 1000, 'ok')
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,270 @@
+import os
+import time
+import sqlite3
+import secrets
+import threading
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+
+# --- Server-Side Sessions ---
+# Flask's default session is the whole dict, serialized and HMAC-signed into
+# the cookie. Logging in puts the user's company details, social links,
+# payment info, logos and permissions in there, so every response re-signs it
+# and every request (speed-test pings included) carries it back. The cookie
+# now holds only a random session id; the data lives in a store:
+#
+#   SESSION_STORE=sqlite  (default) instance/sessions.sqlite3, shared by all workers on the host
+#   SESSION_STORE=memory  per-process LRU, for a single worker / local development
+#   SESSION_STORE=cookie  Flask's built-in signed cookie (no server-side state)
+#
+# Nothing is stored (and no cookie is set) until something is put in the
+# session. Sessions are written only when modified, plus an occasional touch to
+# push the idle expiry (SESSION_IDLE_TTL) forward for active users. A touch
+# only moves the expiry, so it can't overwrite data a concurrent request saved.
+# Call session.regenerate() when a user logs in so a pre-login id can't be reused.
+
+SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+SESSION_IDLE_TTL = float(os.environ.get('SESSION_IDLE_TTL', 7 * 24 * 3600))
+SESSION_MEMORY_MAX = int(os.environ.get('SESSION_MEMORY_MAX', 10000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);
+"""
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=0.0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+        self.regenerated_from = None
+        self.stale_cookie = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """Moves the data to a fresh session id (call on login / privilege change)."""
+        if self.regenerated_from is None and not self.new:
+            self.regenerated_from = self.sid
+        self.sid = _new_sid()
+        self.modified = True
+
+
+def _new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class MemoryStore:
+    """Per-process LRU; sessions are lost on restart and not shared between workers."""
+
+    def __init__(self, max_entries=SESSION_MEMORY_MAX):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # sid -> (expires_at, serialized)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return entry
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._data[sid] = (expires_at, data)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is not None:
+                self._data[sid] = (expires_at, entry[1])
+                self._data.move_to_end(sid)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def count(self):
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Sessions in a local SQLite file, shared by every gunicorn worker on the host."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._saves_since_purge = 0
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            'SELECT expires_at, data FROM sessions WHERE id = ? AND expires_at > ?', (sid, time.time())
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid, data, expires_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at',
+            (sid, data, expires_at)
+        )
+        self._saves_since_purge += 1
+        if self._saves_since_purge >= 500:
+            self._saves_since_purge = 0
+            conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+
+    def touch(self, sid, expires_at):
+        self._connect().execute('UPDATE sessions SET expires_at = ? WHERE id = ?', (expires_at, sid))
+
+    def delete(self, sid):
+        self._connect().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM sessions WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, store, idle_ttl=SESSION_IDLE_TTL):
+        self.store = store
+        self.idle_ttl = idle_ttl
+
+    def _ttl(self, app, session):
+        if session.permanent:
+            return app.permanent_session_lifetime.total_seconds()
+        return self.idle_ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                entry = self.store.load(sid)
+            except Exception as e:
+                print(f"[SESSION] Could not load session: {e}")
+                entry = None
+            if entry is not None:
+                expires_at, data = entry
+                try:
+                    return self.session_class(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+                except Exception as e:
+                    print(f"[SESSION] Dropping unreadable session: {e}")
+        # Unknown or expired ids are never reused; a new one is issued if data gets stored
+        session = self.session_class(sid=_new_sid(), new=True)
+        session.stale_cookie = bool(sid)
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.regenerated_from:
+            self.store.delete(session.regenerated_from)
+
+        if not session:
+            # Empty sessions are never stored; a cleared or expired one loses its cookie too
+            if session.stale_cookie or (not session.new and session.modified):
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        now = time.time()
+        ttl = self._ttl(app, session)
+        # Touch unmodified sessions once they've used up half their idle window
+        needs_touch = session.expires_at - now < ttl / 2
+        if not (session.modified or needs_touch):
+            return
+
+        session.expires_at = now + ttl
+        try:
+            if session.modified:
+                self.store.save(session.sid, self.serializer.dumps(dict(session)), session.expires_at)
+            else:
+                # Only the expiry moves; this request's copy of the data may be stale
+                self.store.touch(session.sid, session.expires_at)
+        except Exception as e:
+            print(f"[SESSION] Could not save session: {e}")
+            return
+
+        if session.new or session.regenerated_from or session.permanent:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly, domain=domain, path=path,
+                secure=secure, samesite=samesite
+            )
+            response.vary.add('Cookie')
+
+
+def init_app(app, store=None):
+    """Installs the server-side session interface (unless SESSION_STORE=cookie)."""
+    if store is None:
+        if SESSION_STORE == 'cookie':
+            return None
+        if SESSION_STORE == 'memory':
+            store = MemoryStore()
+        else:
+            os.makedirs(app.instance_path, exist_ok=True)
+            store = SQLiteStore(os.path.join(app.instance_path, 'sessions.sqlite3'))
+    app.session_interface = ServerSessionInterface(store)
+    return store
+
+
+def rotate(session):
+    """session.regenerate() when the server-side store is active; a no-op for cookie sessions."""
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate is not None:
+        regenerate()
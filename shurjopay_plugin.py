@@ -1,4 +1,5 @@
-import requests
+import http_client
+import gateway_tokens
 import logging
 import json
 from datetime import datetime
@@ -29,32 +30,38 @@ class ShurjopayPlugin:
         self.token = None
         self.store_id = None
         
+    def _token_key(self):
+        return ('shurjopay', self.config.api_url, self.config.username, self.config.password)
+
+    def _grant_token(self):
+        url = f"{self.config.api_url}/api/get_token"
+        payload = {
+            "username": self.config.username,
+            "password": self.config.password
+        }
+        headers = {'Content-Type': 'application/json'}
+        
+        response = http_client.post('shurjopay', url, json=payload, headers=headers, idempotent=True)
+        data = response.json()
+        
+        if response.status_code == 200 and 'checkout_url' in data:
+            # Note: Some versions return the token differently. 
+            # Usually it sets a token for subsequent requests.
+            # For standard ShurjoPay, the 'get_token' endpoint returns the token 
+            # which acts as the authorization bearer.
+            return data, data.get('expires_in')
+        raise Exception(f"ShurjoPay Token Error: {data}")
+
     def get_token(self):
         """
         Authenticates with ShurjoPay and retrieves a transaction token.
+        The grant is cached process-wide per store credentials (see gateway_tokens.py).
         """
         try:
-            url = f"{self.config.api_url}/api/get_token"
-            payload = {
-                "username": self.config.username,
-                "password": self.config.password
-            }
-            headers = {'Content-Type': 'application/json'}
-            
-            response = requests.post(url, json=payload, headers=headers)
-            data = response.json()
-            
-            if response.status_code == 200 and 'checkout_url' in data:
-                # Note: Some versions return the token differently. 
-                # Usually it sets a token for subsequent requests.
-                # For standard ShurjoPay, the 'get_token' endpoint returns the token 
-                # which acts as the authorization bearer.
-                self.token = data.get('token')
-                self.store_id = data.get('store_id')
-                return self.token
-            else:
-                logger.error(f"ShurjoPay Token Error: {data}")
-                return None
+            data = gateway_tokens.get(self._token_key(), self._grant_token)
+            self.token = data.get('token')
+            self.store_id = data.get('store_id')
+            return self.token
         except Exception as e:
             logger.error(f"ShurjoPay Connection Error: {e}")
             return None
@@ -102,7 +109,7 @@ class ShurjopayPlugin:
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = http_client.post('shurjopay', url, json=payload, headers=headers)
             data = response.json()
             
             # Create a simple object to return consistent results
@@ -140,7 +147,7 @@ class ShurjopayPlugin:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = http_client.post('shurjopay', url, json=payload, headers=headers, idempotent=True)
             data = response.json()
             # Returns the raw list of transaction objects/dicts
             return data 
@@ -0,0 +1,179 @@
+import os
+import time
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# --- Named Background Task Pools ---
+# Fire-and-forget work is split by what it waits on, so a slow MikroTik router
+# can't hold up receipts and a slow Brevo call can't hold up reactivations:
+#
+#   router - RouterOS API calls (reactivation, enable/disable)
+#   email  - outbound mail
+#   pdf    - receipt / invoice PDF generation
+#
+# Each pool has its own worker count and queue limit, configurable with
+# TASK_POOL_<NAME>_WORKERS, TASK_POOL_<NAME>_QUEUE and TASK_POOL_<NAME>_POLICY.
+# When a pool's queue is full the policy decides what happens to a new task:
+#   abort       - raise TaskRejected
+#   caller_runs - run it right away in the submitting thread (natural backpressure)
+#   discard     - drop it (counted in the pool's 'rejected' metric)
+#
+#   tasks.submit('email', email_service.send_generic_email, details, to, subject, body)
+
+TASK_DRAIN_TIMEOUT = float(os.environ.get('TASK_DRAIN_TIMEOUT', 20))
+
+POOL_DEFAULTS = {
+    'router': {'workers': 4, 'queue': 200, 'policy': 'caller_runs'},
+    'email': {'workers': 4, 'queue': 500, 'policy': 'caller_runs'},
+    'pdf': {'workers': 2, 'queue': 100, 'policy': 'caller_runs'},
+}
+
+POLICIES = ('abort', 'caller_runs', 'discard')
+
+
+class TaskRejected(Exception):
+    """Raised when a pool with the 'abort' policy is full."""
+
+
+class TaskPool:
+    def __init__(self, name, workers, max_queue, policy):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown rejection policy '{policy}' for pool '{name}'")
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{name}-task')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.metrics = {
+            "submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "ran_in_caller": 0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0, "run_ms_total": 0.0, "run_ms_max": 0.0,
+        }
+
+    def _timed(self, fn, args, kwargs, queued_at):
+        started = time.perf_counter()
+        wait_ms = (started - queued_at) * 1000
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        except Exception as e:
+            failed = True
+            print(f"[TASKS] {self.name} task {getattr(fn, '__name__', fn)} failed: {e}")
+            raise
+        finally:
+            run_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                m = self.metrics
+                m["failed" if failed else "completed"] += 1
+                m["wait_ms_total"] += wait_ms
+                m["wait_ms_max"] = max(m["wait_ms_max"], wait_ms)
+                m["run_ms_total"] += run_ms
+                m["run_ms_max"] = max(m["run_ms_max"], run_ms)
+
+    def depth(self):
+        """Tasks queued or running in this pool."""
+        return len(self._pending)
+
+    def submit(self, fn, *args, **kwargs):
+        queued_at = time.perf_counter()
+        with self._lock:
+            full = len(self._pending) >= self.workers + self.max_queue
+            if full:
+                self.metrics["rejected"] += 1
+            else:
+                self.metrics["submitted"] += 1
+
+        if full:
+            if self.policy == 'abort':
+                raise TaskRejected(f"Task pool '{self.name}' is full ({self.max_queue} queued).")
+            if self.policy == 'discard':
+                print(f"[TASKS] {self.name} pool full; dropped {getattr(fn, '__name__', fn)}")
+                return None
+            with self._lock:
+                self.metrics["ran_in_caller"] += 1
+            try:
+                self._timed(fn, args, kwargs, queued_at)
+            except Exception:
+                pass
+            return None
+
+        future = self._executor.submit(self._timed, fn, args, kwargs, queued_at)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def drain(self, timeout):
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            print(f"[TASKS] Draining {len(pending)} task(s) from the {self.name} pool...")
+            wait(pending, timeout=timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            m = dict(self.metrics)
+            depth = len(self._pending)
+        done = m["completed"] + m["failed"]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "policy": self.policy,
+            "depth": depth,
+            "submitted": m["submitted"],
+            "completed": m["completed"],
+            "failed": m["failed"],
+            "rejected": m["rejected"],
+            "ran_in_caller": m["ran_in_caller"],
+            "avg_wait_ms": round(m["wait_ms_total"] / done, 1) if done else 0,
+            "max_wait_ms": round(m["wait_ms_max"], 1),
+            "avg_run_ms": round(m["run_ms_total"] / done, 1) if done else 0,
+            "max_run_ms": round(m["run_ms_max"], 1),
+        }
+
+
+class TaskExecutor:
+    def __init__(self, defaults=POOL_DEFAULTS):
+        self._pools = {}
+        for name, cfg in defaults.items():
+            prefix = f"TASK_POOL_{name.upper()}_"
+            self._pools[name] = TaskPool(
+                name,
+                workers=int(os.environ.get(prefix + 'WORKERS', cfg['workers'])),
+                max_queue=int(os.environ.get(prefix + 'QUEUE', cfg['queue'])),
+                policy=os.environ.get(prefix + 'POLICY', cfg['policy']),
+            )
+        self._drained = False
+
+    def pool(self, name):
+        return self._pools[name]
+
+    def submit(self, pool_name, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the named pool. Returns a Future (or None if it didn't queue)."""
+        return self._pools[pool_name].submit(fn, *args, **kwargs)
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def drain(self, timeout=TASK_DRAIN_TIMEOUT):
+        """Lets queued tasks finish (up to `timeout` seconds in total) before the worker exits."""
+        if self._drained:
+            return
+        self._drained = True
+        deadline = time.monotonic() + timeout
+        for pool in self._pools.values():
+            pool.drain(max(0, deadline - time.monotonic()))
+
+
+tasks = TaskExecutor()
+
+# gunicorn's graceful worker shutdown ends in sys.exit(), which runs this
+atexit.register(tasks.drain)
@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+from collections import Counter
+from database import supabase
+
+# --- Ticket Auto-Assignment Engine ---
+# Picking a technician used to cost one COUNT query per candidate. We now keep,
+# per company:
+#   * the roster of active employees (id, name, email, zone), cached for ROSTER_TTL
+#   * an in-memory count of open tickets per employee
+# The counts move on create / assign / status-change events in this process and
+# are reconciled with the database (one grouped query) every RECONCILE_SECONDS,
+# which also picks up changes made from the admin app or by other workers.
+#
+# Strategy is chosen with TICKET_ASSIGN_STRATEGY:
+#   least_loaded  - fewest open tickets among technicians in the customer's zone (default)
+#   round_robin   - rotate through the zone's technicians
+#   zone_weighted - whole company; technicians outside the zone carry ZONE_PENALTY extra load
+
+OPEN_STATUSES = ('Open', 'In Progress')
+
+TICKET_ASSIGN_STRATEGY = os.environ.get('TICKET_ASSIGN_STRATEGY', 'least_loaded')
+ROSTER_TTL = float(os.environ.get('TICKET_ROSTER_TTL', 300))
+RECONCILE_SECONDS = float(os.environ.get('TICKET_LOAD_RECONCILE_SECONDS', 120))
+ZONE_PENALTY = float(os.environ.get('TICKET_ZONE_PENALTY', 3))
+
+
+def _least_loaded(engine, company_id, zone_id, roster, loads):
+    candidates = [e for e in roster if e.get('zone_id') == zone_id]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda e: loads.get(e['id'], 0))
+
+
+def _round_robin(engine, company_id, zone_id, roster, loads):
+    candidates = sorted((e for e in roster if e.get('zone_id') == zone_id), key=lambda e: str(e['id']))
+    if not candidates:
+        return None
+    key = (company_id, zone_id)
+    position = engine._rr_cursor.get(key, -1) + 1
+    engine._rr_cursor[key] = position
+    return candidates[position % len(candidates)]
+
+
+def _zone_weighted(engine, company_id, zone_id, roster, loads):
+    if not roster:
+        return None
+    def weight(e):
+        penalty = 0 if (zone_id and e.get('zone_id') == zone_id) else ZONE_PENALTY
+        return loads.get(e['id'], 0) + penalty
+    return min(roster, key=weight)
+
+
+STRATEGIES = {
+    'least_loaded': _least_loaded,
+    'round_robin': _round_robin,
+    'zone_weighted': _zone_weighted,
+}
+
+
+class AssignmentEngine:
+    def __init__(self, strategy=TICKET_ASSIGN_STRATEGY):
+        if strategy not in STRATEGIES:
+            print(f"[ASSIGN] Unknown strategy '{strategy}', using least_loaded.")
+            strategy = 'least_loaded'
+        self.strategy = strategy
+        self._roster = {}       # company_id -> (employees, loaded_at)
+        self._loads = {}        # company_id -> Counter(employee_id -> open tickets)
+        self._reconciled = {}   # company_id -> monotonic time of last reconcile
+        self._rr_cursor = {}
+        self._lock = threading.Lock()
+
+    # --- Loading ---
+
+    def _get_roster(self, company_id):
+        cached = self._roster.get(company_id)
+        if cached and time.monotonic() - cached[1] < ROSTER_TTL:
+            return cached[0]
+        res = supabase.table('employees').select('id, full_name, email, zone_id')\
+            .eq('company_id', company_id)\
+            .eq('status', 'Active').execute()
+        employees = res.data or []
+        self._roster[company_id] = (employees, time.monotonic())
+        return employees
+
+    def reconcile(self, company_id):
+        """Rebuilds the open-ticket counts for a company from the database in one call."""
+        try:
+            res = supabase.rpc('get_open_ticket_counts', {'p_company_id': company_id}).execute()
+            loads = Counter({row['employee_id']: int(row['open_count']) for row in (res.data or [])})
+        except Exception:
+            # No RPC deployed: one select of the assignee column, counted here
+            res = supabase.table('support_tickets').select('assigned_to_employee_id')\
+                .eq('company_id', company_id)\
+                .in_('status', list(OPEN_STATUSES))\
+                .not_.is_('assigned_to_employee_id', 'null')\
+                .execute()
+            loads = Counter(row['assigned_to_employee_id'] for row in (res.data or []))
+        with self._lock:
+            self._loads[company_id] = loads
+            self._reconciled[company_id] = time.monotonic()
+        return loads
+
+    def _get_loads(self, company_id):
+        if time.monotonic() - self._reconciled.get(company_id, 0) >= RECONCILE_SECONDS:
+            return self.reconcile(company_id)
+        return self._loads.setdefault(company_id, Counter())
+
+    # --- Assignment ---
+
+    def assign(self, company_id, zone_id):
+        """
+        Picks a technician for a new ticket and reserves the slot in the load index.
+        Returns the employee dict, or None. Call release() if the ticket isn't created.
+        """
+        roster = self._get_roster(company_id)
+        loads = self._get_loads(company_id)
+        with self._lock:
+            chosen = STRATEGIES[self.strategy](self, company_id, zone_id, roster, loads)
+            if chosen:
+                loads[chosen['id']] += 1
+        return chosen
+
+    def release(self, company_id, employee_id):
+        self._adjust(company_id, employee_id, -1)
+
+    def on_assigned(self, company_id, employee_id):
+        self._adjust(company_id, employee_id, +1)
+
+    def on_status_change(self, company_id, employee_id, old_status, new_status):
+        """Keeps the index in step when a ticket enters or leaves the open statuses."""
+        was_open = old_status in OPEN_STATUSES
+        is_open = new_status in OPEN_STATUSES
+        if was_open and not is_open:
+            self._adjust(company_id, employee_id, -1)
+        elif is_open and not was_open:
+            self._adjust(company_id, employee_id, +1)
+
+    def _adjust(self, company_id, employee_id, delta):
+        if not company_id or not employee_id:
+            return
+        with self._lock:
+            loads = self._loads.get(company_id)
+            if loads is None:
+                return  # Not loaded yet; the first reconcile will count it
+            loads[employee_id] = max(0, loads[employee_id] + delta)
+
+    def invalidate_roster(self, company_id=None):
+        if company_id is None:
+            self._roster.clear()
+        else:
+            self._roster.pop(company_id, None)
+
+
+assignment_engine = AssignmentEngine()